@@ -0,0 +1,222 @@
+import argparse
+import datetime
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+from collections import namedtuple
+from banalcow import banalutil
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    uploaded_at TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS downloads (
+    accountnumber TEXT NOT NULL,
+    from_date TEXT NOT NULL,
+    to_date TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    archived_at TEXT NOT NULL,
+    PRIMARY KEY (accountnumber, from_date, to_date, digest)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS downloads_digest ON downloads (digest);
+"""
+
+download = namedtuple(
+    'download', 'accountnumber from_date to_date digest archived_at'
+)
+
+
+class Archive:
+    """Compressed archive of every OFX file downloaded.
+
+    Files are stored once per distinct content, gzipped under their
+    SHA-256 digest, and indexed in SQLite by account number and date
+    range. The digests of files Penny has accepted are remembered so
+    the same content is not uploaded again.
+    """
+
+    date_fmt = '%Y-%m-%d'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(directory, 'index.db'), check_same_thread=False
+        )
+        self.conn.executescript(SCHEMA)
+
+    def path(self, digest):
+        return os.path.join(
+            self.directory, 'objects', digest[:2], digest[2:] + '.ofx.gz'
+        )
+
+    @staticmethod
+    def digest(filename):
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def add(self, accountnumber, filename, from_date=None, to_date=None):
+        """Archive filename and return its digest.
+
+        The dates default to those in a banalutil.filename() name. Adding
+        content already in the archive only records the download.
+        """
+        if from_date is None or to_date is None:
+            from_date, to_date = banalutil.daterange(filename)
+        digest = self.digest(filename)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Compress to a temporary name so a crash never leaves a
+            # truncated object behind.
+            tmp = '{0}.{1}.{2}.tmp'.format(
+                path, os.getpid(), threading.get_ident()
+            )
+            with open(filename, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp, path)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR IGNORE INTO objects (digest, size, stored_size) '
+                'VALUES (?, ?, ?)',
+                (digest, os.path.getsize(filename), os.path.getsize(path))
+            )
+            self.conn.execute(
+                'INSERT OR IGNORE INTO downloads (accountnumber, from_date, '
+                'to_date, digest, archived_at) VALUES (?, ?, ?, ?, ?)',
+                (
+                    accountnumber, from_date.strftime(self.date_fmt),
+                    to_date.strftime(self.date_fmt), digest,
+                    datetime.datetime.now().strftime(self.date_fmt)
+                )
+            )
+        return digest
+
+    def uploaded(self, digest):
+        """Return True if Penny has accepted content with this digest."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT uploaded_at FROM objects WHERE digest = ?', (digest,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def mark_uploaded(self, digest):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'UPDATE objects SET uploaded_at = ? WHERE digest = ?',
+                (datetime.datetime.now().strftime(self.date_fmt), digest)
+            )
+
+    def find(self, accountnumber, from_date=None, to_date=None):
+        """Return the downloads of accountnumber overlapping the range,
+        oldest first."""
+        query = 'SELECT * FROM downloads WHERE accountnumber = ?'
+        params = [accountnumber]
+        if to_date is not None:
+            query += ' AND from_date <= ?'
+            params.append(to_date.strftime(self.date_fmt))
+        if from_date is not None:
+            query += ' AND to_date >= ?'
+            params.append(from_date.strftime(self.date_fmt))
+        with self.lock:
+            rows = self.conn.execute(
+                query + ' ORDER BY from_date, to_date', params
+            ).fetchall()
+        return [download(*row) for row in rows]
+
+    def open(self, digest):
+        """Return the archived content with this digest opened for
+        reading as bytes."""
+        return gzip.open(self.path(digest), 'rb')
+
+    def extract(self, digest, filename):
+        with self.open(digest) as src, open(filename, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+    def prune(self, days):
+        """Forget downloads archived more than days ago and delete the
+        content no download refers to any more. Returns the number of
+        objects deleted."""
+        cutoff = (
+            datetime.datetime.now() - datetime.timedelta(days=days)
+        ).strftime(self.date_fmt)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'DELETE FROM downloads WHERE archived_at < ?', (cutoff,)
+            )
+            orphans = [row[0] for row in self.conn.execute(
+                'SELECT digest FROM objects WHERE digest NOT IN '
+                '(SELECT digest FROM downloads)'
+            )]
+            self.conn.executemany(
+                'DELETE FROM objects WHERE digest = ?',
+                ((digest,) for digest in orphans)
+            )
+        for digest in orphans:
+            try:
+                os.remove(self.path(digest))
+            except FileNotFoundError:
+                pass
+        return len(orphans)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='OFX download archive')
+    parser.add_argument(
+        '--directory', required=False, default='archive',
+        help='Archive directory'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    find = commands.add_parser('find', help='List downloads of an account')
+    find.add_argument('accountnumber')
+    find.add_argument('--from-date', default=None, help='YYYY-MM-DD')
+    find.add_argument('--to-date', default=None, help='YYYY-MM-DD')
+    extract = commands.add_parser('extract', help='Write out an OFX file')
+    extract.add_argument('digest')
+    extract.add_argument('filename')
+    prune = commands.add_parser(
+        'prune', help='Drop downloads archived more than DAYS ago'
+    )
+    prune.add_argument('days', type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    archive = Archive(args.directory)
+
+    def date(value):
+        if value is None:
+            return None
+        return datetime.datetime.strptime(value, Archive.date_fmt)
+
+    if args.command == 'find':
+        for d in archive.find(
+                args.accountnumber, date(args.from_date), date(args.to_date)):
+            print('{0} {1} {2} {3}'.format(
+                d.from_date, d.to_date, d.digest, d.archived_at
+            ))
+    elif args.command == 'extract':
+        archive.extract(args.digest, args.filename)
+    elif args.command == 'prune':
+        print('Deleted {0} files'.format(archive.prune(args.days)))
+    archive.close()
+
+
+if __name__ == '__main__':
+    main()
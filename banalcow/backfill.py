@@ -0,0 +1,148 @@
+import datetime
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from banalcow import banalutil, ofx
+from banalcow.export import ExportError
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+window = namedtuple('window', 'from_date to_date')
+
+
+def windows(from_date, to_date, months=3):
+    """Split from_date to to_date into windows of whole blocks of months
+    calendar months, clipped to the range at either end.
+
+    Windows are aligned to the calendar rather than to from_date so the
+    same windows come out of every run and the journal stays valid.
+    """
+    start = datetime.datetime(from_date.year, from_date.month, from_date.day)
+    end = datetime.datetime(to_date.year, to_date.month, to_date.day)
+    while start <= end:
+        block = (start.year * 12 + start.month - 1) // months * months
+        year, month = divmod(block + months, 12)
+        following = datetime.datetime(year, month + 1, 1)
+        yield window(start, min(following - datetime.timedelta(days=1), end))
+        start = following
+
+
+class Backfill:
+    """Download a long date range of every account window by window.
+
+    Windows are exported over HTTP from the logged in session, several at
+    once, and each one that completes is journalled in the StateStore so
+    a rerun only downloads the windows still missing. Once every window
+    of an account is in, they are merged into a single OFX file in the
+    session's output_dir with each transaction only once, ready for the
+    usual upload.
+    """
+
+    def __init__(self, session, store, **kwargs):
+        self.session = session
+        self.store = store
+        self.from_date = kwargs.get('from_date', session.from_date)
+        self.to_date = kwargs.get('to_date', session.to_date)
+        self.months = kwargs.get('months', 3)
+        self.workers = max(1, kwargs.get('workers', 4))
+        self.directory = kwargs.get(
+            'directory', os.path.join(session.output_dir, 'backfill')
+        )
+        os.makedirs(self.directory, exist_ok=True)
+
+    def pending(self, accountnumber):
+        """Return the windows of accountnumber still to download."""
+        done = self.store.windows(accountnumber)
+        return [
+            w for w in windows(self.from_date, self.to_date, self.months)
+            if not os.path.exists(done.get(w, ''))
+        ]
+
+    def download(self, accountnumber, data, w):
+        filename = os.path.join(self.directory, banalutil.filename(
+            accountnumber, w.from_date, w.to_date
+        ))
+        self.session.throttle()
+        with metrics.span('backfill_window', account=accountnumber):
+            self.session.export_account(
+                data._replace(filename=filename, from_date=w.from_date),
+                to_date=w.to_date
+            )
+        self.store.add_window(accountnumber, w.from_date, w.to_date, filename)
+        metrics.inc('backfill_windows', account=accountnumber)
+
+    def run(self, accounts, done=None):
+        """Backfill every account and return a dict of accounts that
+        failed mapped to the first exception raised for them.
+
+        done, if given, is called with each account and its data, naming
+        the merged file, like NetbankPool.run.
+        """
+        jobs = [
+            (accountnumber, data, w)
+            for accountnumber, data in accounts.items()
+            for w in self.pending(accountnumber)
+        ]
+        logger.info('Backfilling {0} windows of {1} accounts'.format(
+            len(jobs), len(accounts)
+        ))
+
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.download, *job) for job in jobs]
+            for (accountnumber, data, w), future in zip(jobs, futures):
+                try:
+                    future.result()
+                except (ExportError, OSError) as e:
+                    logger.error(
+                        'Failed to backfill {0} from {1:%d/%m/%Y} to '
+                        '{2:%d/%m/%Y}: {3}'.format(
+                            accountnumber, w.from_date, w.to_date, e
+                        )
+                    )
+                    failures.setdefault(accountnumber, e)
+
+        for accountnumber, data in accounts.items():
+            if accountnumber in failures:
+                continue
+            try:
+                filename = self.merge(accountnumber)
+            except (ValueError, OSError) as e:
+                logger.error('Failed to merge the backfill of {0}: {1}'.format(
+                    accountnumber, e
+                ))
+                failures[accountnumber] = e
+                continue
+            if done is not None:
+                done(accountnumber, data._replace(filename=filename))
+        return failures
+
+    def merge(self, accountnumber):
+        done = self.store.windows(accountnumber)
+        journalled = list(windows(self.from_date, self.to_date, self.months))
+        filenames = [done[w] for w in journalled]
+        filename = os.path.join(self.session.output_dir, banalutil.filename(
+            accountnumber, self.from_date, self.to_date
+        ))
+        try:
+            count = ofx.merge_unique(filenames, filename)
+        except ValueError:
+            # The statement of the last window, which the merged file is
+            # built around, is broken. Download it again next run.
+            last = journalled[-1]
+            self.store.forget_window(
+                accountnumber, last.from_date, last.to_date
+            )
+            raise
+        if self.session.columns is not None:
+            self.session.columns.append(accountnumber, filename)
+        logger.info('Merged {0} windows of {1} into {2} transactions'.format(
+            len(filenames), accountnumber, count
+        ))
+        mark = self.store.watermark(accountnumber)
+        if mark is None or mark.synced_to < self.to_date:
+            self.store.mark_synced(
+                accountnumber, self.to_date, ofx.latest_fitid(filename)
+            )
+        return filename
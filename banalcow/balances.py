@@ -0,0 +1,220 @@
+import argparse
+import datetime
+import decimal
+import os
+import re
+import threading
+import time
+import numpy as np
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+# One snapshot: seconds since the epoch, then balance and available in
+# cents. MISSING marks an amount the portfolio did not show.
+SNAPSHOT = np.dtype([
+    ('time', '<i8'), ('balance', '<i8'), ('available', '<i8')
+])
+MISSING = np.iinfo(np.int64).min
+
+AMOUNT = re.compile(r'^(-)?\$?(-)?([\d,]+(?:\.\d+)?)\s*(CR|DR)?$', re.I)
+
+
+def cents(text):
+    """Return a Netbank amount like $1,234.56, -$5.00 or $5.00 DR in
+    cents, or MISSING if text is not an amount."""
+    if text is None:
+        return MISSING
+    m = AMOUNT.match(text.strip())
+    if m is None:
+        return MISSING
+    value = int(decimal.Decimal(m.group(3).replace(',', '')) * 100)
+    negative = m.group(1) or m.group(2) or \
+        (m.group(4) or '').upper() == 'DR'
+    return -value if negative else value
+
+
+class BalanceHistory:
+    """Balance and available amount snapshots of every account.
+
+    Each account has a file of fixed size SNAPSHOT records in time order,
+    appended to on every run. Queries map the file and find their range
+    by binary search on the time column, so they read only the records
+    they return however many years of snapshots there are.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def path(self, accountnumber):
+        # The account number names the file, so it must name one.
+        if not accountnumber or accountnumber.startswith('.') or \
+                os.sep in accountnumber:
+            raise ValueError(
+                'Invalid account number {0!r}'.format(accountnumber)
+            )
+        return os.path.join(self.directory, accountnumber + '.bin')
+
+    def accounts(self):
+        return sorted(
+            name[:-len('.bin')] for name in os.listdir(self.directory)
+            if name.endswith('.bin') and not name.startswith('.')
+        )
+
+    def snapshots(self, accountnumber):
+        """Return every snapshot of accountnumber as a read only array."""
+        try:
+            size = os.path.getsize(self.path(accountnumber))
+        except FileNotFoundError:
+            size = 0
+        # Ignore the tail of a record a crash left half written.
+        count = size // SNAPSHOT.itemsize
+        if not count:
+            return np.empty(0, dtype=SNAPSHOT)
+        return np.memmap(
+            self.path(accountnumber), dtype=SNAPSHOT, mode='r',
+            shape=(count,)
+        )
+
+    def append(self, accountnumber, balance, available, when=None):
+        """Append a snapshot of the balance and available amount strings
+        and return whether it was stored."""
+        record = np.array([(
+            int(time.time() if when is None else when),
+            cents(balance), cents(available)
+        )], dtype=SNAPSHOT)
+        if record['balance'][0] == MISSING and \
+                record['available'][0] == MISSING:
+            return False
+        with self.lock:
+            history = self.snapshots(accountnumber)
+            if len(history) and history['time'][-1] > record['time'][0]:
+                logger.warning(
+                    'Not storing a balance of {0} older than its last'.format(
+                        accountnumber
+                    )
+                )
+                return False
+            with open(self.path(accountnumber), 'ab') as f:
+                f.truncate(len(history) * SNAPSHOT.itemsize)
+                f.write(record.tobytes())
+        metrics.inc('balance_snapshots')
+        return True
+
+    def record(self, accounts, when=None):
+        """Append a snapshot of every account get_accounts returned."""
+        when = time.time() if when is None else when
+        stored = 0
+        for accountnumber, data in accounts.items():
+            try:
+                stored += self.append(
+                    accountnumber, data.balance, data.available, when
+                )
+            except ValueError as e:
+                logger.warning('Not storing a balance: {0}'.format(e))
+        return stored
+
+    def range(self, accountnumber, start=None, end=None):
+        """Return the snapshots taken from start up to but not including
+        end, in seconds since the epoch."""
+        history = self.snapshots(accountnumber)
+        times = history['time']
+        lo = 0 if start is None else np.searchsorted(times, start, 'left')
+        hi = len(history) if end is None else \
+            np.searchsorted(times, end, 'left')
+        return history[lo:hi]
+
+    def downsample(self, accountnumber, step, start=None, end=None,
+                   field='balance', how='last'):
+        """Return the bucket start times and one value of field for every
+        step seconds between start and end that has snapshots. how is
+        last, min, max or mean."""
+        history = self.range(accountnumber, start, end)
+        values = history[field]
+        present = values != MISSING
+        times = history['time'][present]
+        values = values[present]
+        if not len(values):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        origin = times[0] if start is None else start
+        buckets = (times - origin) // step
+        # Snapshots are in time order, so each bucket is a contiguous run.
+        first = np.flatnonzero(np.diff(buckets, prepend=-1))
+        if how == 'last':
+            reduced = values[np.append(first[1:], len(values)) - 1]
+        elif how == 'min':
+            reduced = np.minimum.reduceat(values, first)
+        elif how == 'max':
+            reduced = np.maximum.reduceat(values, first)
+        elif how == 'mean':
+            reduced = np.round(
+                np.add.reduceat(values, first) / np.diff(
+                    np.append(first, len(values))
+                )
+            ).astype(np.int64)
+        else:
+            raise ValueError('Unknown downsample {0}'.format(how))
+        return origin + buckets[first] * step, reduced
+
+
+def timestamp(text):
+    return int(datetime.datetime.strptime(text, '%d/%m/%Y').timestamp())
+
+
+def amount(value):
+    return '' if value == MISSING else '{0:.2f}'.format(value / 100)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Balance history')
+    parser.add_argument(
+        '--directory', required=False, default='balances',
+        help='History directory'
+    )
+    parser.add_argument('--start', required=False, default=None,
+                        type=timestamp, help='DD/MM/YYYY')
+    parser.add_argument('--end', required=False, default=None,
+                        type=timestamp, help='DD/MM/YYYY')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('accounts', help='List accounts with history')
+    show = commands.add_parser('range', help='Snapshots of an account')
+    show.add_argument('account')
+    sample = commands.add_parser('downsample', help='One value per step')
+    sample.add_argument('account')
+    sample.add_argument('--days', default=1, type=float,
+                        help='Step in days')
+    sample.add_argument('--field', default='balance',
+                        choices=('balance', 'available'))
+    sample.add_argument('--how', default='last',
+                        choices=('last', 'min', 'max', 'mean'))
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    history = BalanceHistory(args.directory)
+    if args.command == 'accounts':
+        for accountnumber in history.accounts():
+            print(accountnumber)
+    elif args.command == 'range':
+        for t, balance, available in history.range(
+                args.account, args.start, args.end).tolist():
+            print('{0} {1:>12} {2:>12}'.format(
+                datetime.datetime.fromtimestamp(t).isoformat(),
+                amount(balance), amount(available)
+            ))
+    elif args.command == 'downsample':
+        times, values = history.downsample(
+            args.account, int(args.days * 86400), args.start, args.end,
+            args.field, args.how
+        )
+        for t, value in zip(times.tolist(), values.tolist()):
+            print('{0} {1:>12}'.format(
+                datetime.datetime.fromtimestamp(t).isoformat(), amount(value)
+            ))
+
+
+if __name__ == '__main__':
+    main()
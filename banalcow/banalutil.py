@@ -1,4 +1,5 @@
 import datetime
+import os
 
 
 def pastdt(days=365):
@@ -11,3 +12,17 @@ def filename(account, from_date, to_date):
     return '{0}-{1}-{2}.ofx'.format(
         account, from_date.strftime('%Y%m%d'), to_date.strftime('%Y%m%d')
     )
+
+
+
+def accountnumber(filename):
+    """Return the account number from a filename() generated name."""
+    return os.path.basename(filename).split('-')[0]
+
+
+def daterange(filename):
+    """Return the from and to dates in a filename() generated name."""
+    parts = os.path.splitext(os.path.basename(filename))[0].split('-')
+    return tuple(
+        datetime.datetime.strptime(part, '%Y%m%d') for part in parts[1:3]
+    )
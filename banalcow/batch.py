@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+class HostLimiter:
+    """Space out requests to each host by at least interval seconds.
+
+    intervals maps a host name to its own interval. Callers reserve the
+    next free slot for a host and sleep until it comes round, so requests
+    from many threads are spread out in the order they asked.
+    """
+
+    def __init__(self, interval=0, intervals=None):
+        self.interval = interval
+        self.intervals = intervals or {}
+        self.lock = threading.Lock()
+        self.slots = {}
+
+    def wait(self, url):
+        host = urlparse(url).hostname or url
+        interval = self.intervals.get(host, self.interval)
+        if not interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.slots.get(host, now))
+            self.slots[host] = slot + interval
+        if slot > now:
+            metrics.inc('rate_limited_seconds', slot - now, host=host)
+            time.sleep(slot - now)
+
+
+result = namedtuple(
+    'result', 'profile accounts download_failures upload_failures error seconds'
+)
+
+
+class BatchRunner:
+    """Sync many profiles on a bounded pool of workers.
+
+    sync is called with each profile and returns the number of accounts
+    it found, a dict of accounts that failed to download and a list of
+    files that failed to upload. Each profile runs in isolation: an
+    exception from one is recorded in its result and the rest carry on.
+    """
+
+    def __init__(self, sync, workers=1):
+        self.sync = sync
+        self.workers = max(1, workers)
+
+    def run(self, profiles):
+        """Sync every profile and return a result for each, in order."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(self.run_profile, profiles))
+
+    def run_profile(self, profile):
+        logger.info('Syncing profile {0}'.format(profile.name))
+        start = time.monotonic()
+        accounts, download_failures, upload_failures, error = 0, {}, [], None
+        try:
+            with metrics.span('profile', profile=profile.name):
+                accounts, download_failures, upload_failures = self.sync(
+                    profile
+                )
+        except Exception as e:
+            logger.exception('Profile {0} failed'.format(profile.name))
+            error = e
+        ok = error is None and not download_failures and not upload_failures
+        metrics.inc('profiles', status='ok' if ok else 'failed')
+        return result(
+            profile=profile.name,
+            accounts=accounts,
+            download_failures=download_failures,
+            upload_failures=upload_failures,
+            error=error,
+            seconds=time.monotonic() - start
+        )
+
+
+def summary(results):
+    """Log a line per profile and return the number that failed."""
+    failed = 0
+    logger.info('{0:<20} {1:>8} {2:>10} {3:>8} {4:>9}  {5}'.format(
+        'profile', 'accounts', 'downloads', 'uploads', 'seconds', 'status'
+    ))
+    for r in results:
+        ok = r.error is None and not r.download_failures and \
+            not r.upload_failures
+        failed += not ok
+        logger.info(
+            '{0:<20} {1:>8} {2:>10} {3:>8} {4:>9.1f}  {5}'.format(
+                r.profile, r.accounts,
+                '{0} failed'.format(len(r.download_failures)),
+                '{0} failed'.format(len(r.upload_failures)),
+                r.seconds, 'ok' if ok else r.error or 'failed'
+            )
+        )
+    logger.info('{0} of {1} profiles synced'.format(
+        len(results) - failed, len(results)
+    ))
+    return failed
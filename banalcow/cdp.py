@@ -0,0 +1,804 @@
+import asyncio
+import itertools
+import json
+import shutil
+import tempfile
+import threading
+import urllib.request
+import websockets
+from selenium.common.exceptions import (
+    JavascriptException, NoSuchElementException,
+    StaleElementReferenceException, TimeoutException, WebDriverException
+)
+from selenium.webdriver.common.keys import Keys
+from banalcow.daemon import Browser
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+class CDPError(WebDriverException):
+    pass
+
+
+# Errors Chrome returns when the document a call ran in has gone, usually
+# because the page navigated while waiting.
+CONTEXT_LOST = (
+    'Execution context was destroyed',
+    'Cannot find context with specified id',
+    'Inspected target navigated or closed',
+)
+
+# Element lookup for every Selenium locator strategy, run in the page so
+# a whole locator chain costs one round trip.
+FIND = """
+var root = this && this.nodeType ? this : document;
+function find(by, value) {
+    switch (by) {
+    case 'id':
+        return Array.from(root.querySelectorAll('#' + CSS.escape(value)));
+    case 'name':
+        return Array.from(root.querySelectorAll(
+            '[name="' + CSS.escape(value) + '"]'
+        ));
+    case 'class name':
+        return Array.from(root.querySelectorAll('.' + CSS.escape(value)));
+    case 'tag name':
+    case 'css selector':
+        return Array.from(root.querySelectorAll(value));
+    case 'link text':
+    case 'partial link text':
+        return Array.from(root.querySelectorAll('a')).filter(function (a) {
+            var text = a.innerText.trim();
+            return by === 'link text' ? text === value :
+                text.indexOf(value) !== -1;
+        });
+    case 'xpath':
+        var result = document.evaluate(
+            value, root, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+        );
+        var nodes = [];
+        for (var i = 0; i < result.snapshotLength; i++) {
+            nodes.push(result.snapshotItem(i));
+        }
+        return nodes;
+    }
+    throw new Error('Unknown locator strategy ' + by);
+}
+function first(locators) {
+    for (var i = 0; i < locators.length; i++) {
+        var found = find(locators[i][0], locators[i][1]);
+        if (found.length) {
+            return [i, found[0]];
+        }
+    }
+    return null;
+}
+"""
+
+FIND_ALL = 'function (by, value) {' + FIND + 'return find(by, value);\n}'
+
+FIND_FIRST = 'function (locators) {' + FIND + 'return first(locators);\n}'
+
+# Resolve as soon as a mutation adds a match rather than polling for it.
+WAIT_FIRST = 'function (locators, timeout) {' + FIND + """
+var hit = first(locators);
+if (hit) {
+    return hit;
+}
+return new Promise(function (resolve) {
+    var timer;
+    var observer = new MutationObserver(function () {
+        var hit = first(locators);
+        if (hit) {
+            observer.disconnect();
+            clearTimeout(timer);
+            resolve(hit);
+        }
+    });
+    observer.observe(document, {
+        childList: true, subtree: true, attributes: true
+    });
+    timer = setTimeout(function () {
+        observer.disconnect();
+        resolve(null);
+    }, timeout * 1000);
+});
+}"""
+
+# Element calls start by checking the element is still in the document,
+# which Selenium reports as a stale element.
+STALE = 'if (!this.isConnected) { throw new Error("stale element"); }\n'
+
+CLICK = 'function () {' + STALE + """
+if (this.tagName === 'OPTION') {
+    var select = this.closest('select');
+    this.selected = true;
+    if (select) {
+        select.dispatchEvent(new Event('input', {bubbles: true}));
+        select.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+    return;
+}
+this.scrollIntoView({block: 'center'});
+this.click();
+}"""
+
+ATTRIBUTE = 'function (name) {' + STALE + """
+var value = this[name];
+if (value === undefined || value === null || typeof value === 'object') {
+    return this.getAttribute(name);
+}
+return String(value);
+}"""
+
+
+class Engine:
+    """An asyncio event loop on a thread of its own, shared by every CDP
+    page in the process so their commands and events interleave on one
+    loop while callers block only on their own results."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name='cdp', daemon=True
+        )
+        self.thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+engine = None
+engine_lock = threading.Lock()
+
+
+def get_engine():
+    global engine
+    with engine_lock:
+        if engine is None:
+            engine = Engine()
+        return engine
+
+
+def websocket_url(address):
+    """Return the browser websocket of the DevTools server at address."""
+    with urllib.request.urlopen(
+            'http://{0}/json/version'.format(address), timeout=10) as f:
+        return json.load(f)['webSocketDebuggerUrl']
+
+
+class Connection:
+    """One DevTools websocket, with commands for every page multiplexed
+    over it as flat sessions."""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.listeners = {}
+        self.task = None
+
+    @classmethod
+    async def open(cls, url):
+        connection = cls(
+            await websockets.connect(url, max_size=None, ping_interval=None)
+        )
+        connection.task = asyncio.get_running_loop().create_task(
+            connection.listen()
+        )
+        return connection
+
+    async def send(self, method, params=None, session=None):
+        message = {'id': next(self.ids), 'method': method}
+        if params:
+            message['params'] = params
+        if session:
+            message['sessionId'] = session
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message['id']] = future
+        metrics.inc('cdp_commands', command=method)
+        try:
+            await self.websocket.send(json.dumps(message))
+        except websockets.ConnectionClosed as e:
+            self.pending.pop(message['id'], None)
+            raise CDPError('DevTools connection closed') from e
+        return await future
+
+    async def listen(self):
+        try:
+            async for raw in self.websocket:
+                message = json.loads(raw)
+                if 'id' in message:
+                    future = self.pending.pop(message['id'], None)
+                    if future is None or future.done():
+                        continue
+                    if 'error' in message:
+                        future.set_exception(
+                            CDPError(message['error'].get('message'))
+                        )
+                    else:
+                        future.set_result(message.get('result', {}))
+                    continue
+                key = (message.get('sessionId'), message.get('method'))
+                for callback in list(self.listeners.get(key, ())):
+                    callback(message.get('params', {}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(
+                        CDPError('DevTools connection closed')
+                    )
+            self.pending.clear()
+
+    def on(self, session, method, callback):
+        self.listeners.setdefault((session, method), []).append(callback)
+
+    def off(self, session, method, callback):
+        try:
+            self.listeners[(session, method)].remove(callback)
+        except (KeyError, ValueError):
+            pass
+
+    def expect(self, session, method):
+        """Return a future for the next method event of session."""
+        future = asyncio.get_running_loop().create_future()
+
+        def callback(params):
+            if not future.done():
+                future.set_result(params)
+
+        self.on(session, method, callback)
+        future.add_done_callback(
+            lambda f: self.off(session, method, callback)
+        )
+        return future
+
+    async def close(self):
+        await self.websocket.close()
+        if self.task is not None:
+            await self.task
+
+
+class Chrome:
+    """A browser on a DevTools connection, either launched for this
+    process or attached to at address, such as a daemon's warm browser."""
+
+    def __init__(self, connection, browser=None):
+        self.connection = connection
+        self.browser = browser
+        self.pages = 0
+
+    @classmethod
+    def launch(cls, chrome_binary, arguments, proxy=None):
+        browser = Browser(
+            'cdp', tempfile.mkdtemp(prefix='banalcow-cdp-'), chrome_binary,
+            proxy=proxy, arguments=arguments
+        )
+        browser.start()
+        try:
+            return cls.attach(browser.address, browser)
+        except (OSError, WebDriverException):
+            cls.stop(browser)
+            raise
+
+    @classmethod
+    def attach(cls, address, browser=None):
+        url = websocket_url(address)
+        return cls(get_engine().run(Connection.open(url)), browser)
+
+    @property
+    def pid(self):
+        if self.browser is None or self.browser.process is None:
+            return None
+        return self.browser.process.pid
+
+    async def new_page(self, **kwargs):
+        target = await self.connection.send(
+            'Target.createTarget', {'url': 'about:blank'}
+        )
+        attached = await self.connection.send('Target.attachToTarget', {
+            'targetId': target['targetId'], 'flatten': True
+        })
+        page = Page(
+            self.connection, target['targetId'], attached['sessionId'],
+            **kwargs
+        )
+        await page.setup()
+        return page
+
+    def close(self):
+        try:
+            get_engine().run(self.connection.close())
+        except (OSError, websockets.WebSocketException):
+            pass
+        if self.browser is not None:
+            self.stop(self.browser)
+
+    @staticmethod
+    def stop(browser):
+        browser.stop()
+        shutil.rmtree(browser.profile_dir, ignore_errors=True)
+
+
+class Browsers:
+    """Launched browsers shared by every CDP driver in the process with
+    the same launch arguments, each driver getting a page of its own."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+
+    def acquire(self, chrome_binary, arguments, proxy=None):
+        key = (chrome_binary, tuple(arguments), proxy)
+        with self.lock:
+            chrome = self.running.get(key)
+            if chrome is None:
+                chrome = Chrome.launch(chrome_binary, arguments, proxy)
+                self.running[key] = chrome
+            chrome.pages += 1
+            return chrome
+
+    def release(self, chrome):
+        with self.lock:
+            chrome.pages -= 1
+            if chrome.pages > 0:
+                return
+            for key, running in list(self.running.items()):
+                if running is chrome:
+                    del self.running[key]
+        chrome.close()
+
+
+browsers = Browsers()
+
+
+class Page:
+    """A tab driven over its own session, tracking its URL and document
+    from the events Chrome sends rather than by asking."""
+
+    def __init__(self, connection, target_id, session_id, **kwargs):
+        self.connection = connection
+        self.target_id = target_id
+        self.session_id = session_id
+        self.download_dir = kwargs.get('download_dir')
+        # With eager loads navigation returns at DOMContentLoaded, like
+        # Selenium's eager page load strategy.
+        self.eager = kwargs.get('eager', False)
+        self.timeout = kwargs.get('page_load_timeout', 300)
+        self.url = 'about:blank'
+        self.frame_id = None
+        self.context_id = None
+        self.context_ready = asyncio.Event()
+
+    def on(self, method, callback):
+        self.connection.on(self.session_id, method, callback)
+
+    async def send(self, method, params=None):
+        return await self.connection.send(method, params, self.session_id)
+
+    async def setup(self):
+        self.on('Page.frameNavigated', self.frame_navigated)
+        self.on('Page.navigatedWithinDocument', self.navigated_within)
+        self.on('Runtime.executionContextCreated', self.context_created)
+        self.on('Runtime.executionContextDestroyed', self.context_destroyed)
+        self.on('Runtime.executionContextsCleared', self.contexts_cleared)
+        tree = await self.send('Page.getFrameTree')
+        self.frame_id = tree['frameTree']['frame']['id']
+        self.url = tree['frameTree']['frame']['url']
+        commands = [self.send('Page.enable'), self.send('Runtime.enable')]
+        if self.download_dir:
+            commands.append(self.send('Page.setDownloadBehavior', {
+                'behavior': 'allow', 'downloadPath': self.download_dir
+            }))
+        await asyncio.gather(*commands)
+
+    def frame_navigated(self, params):
+        frame = params['frame']
+        if frame.get('parentId') is None:
+            self.frame_id = frame['id']
+            self.url = frame['url'] + frame.get('urlFragment', '')
+
+    def navigated_within(self, params):
+        if params.get('frameId') == self.frame_id:
+            self.url = params['url']
+
+    def context_created(self, params):
+        context = params['context']
+        aux = context.get('auxData', {})
+        if aux.get('isDefault') and aux.get('frameId') == self.frame_id:
+            self.context_id = context['id']
+            self.context_ready.set()
+
+    def context_destroyed(self, params):
+        if params.get('executionContextId') == self.context_id:
+            self.contexts_cleared(params)
+
+    def contexts_cleared(self, params):
+        self.context_id = None
+        self.context_ready.clear()
+
+    async def navigate(self, url):
+        event = 'Page.domContentEventFired' if self.eager \
+            else 'Page.loadEventFired'
+        loaded = self.connection.expect(self.session_id, event)
+        try:
+            result = await self.send('Page.navigate', {'url': url})
+            if result.get('errorText'):
+                raise CDPError('Failed to load {0}: {1}'.format(
+                    url, result['errorText']
+                ))
+            # Only a new document has a loader, a fragment change has not.
+            if result.get('loaderId'):
+                await asyncio.wait_for(loaded, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutException('Timed out loading {0}'.format(url))
+        finally:
+            loaded.cancel()
+
+    async def call(self, declaration, *args, **kwargs):
+        """Call the JavaScript function declaration with args, on the
+        element object_id or else in the current document, and return
+        its RemoteObject."""
+        params = {
+            'functionDeclaration': declaration,
+            'arguments': [
+                {'objectId': arg.object_id} if isinstance(arg, CDPElement)
+                else {'value': arg} for arg in args
+            ],
+            'returnByValue': kwargs.get('by_value', True),
+            'awaitPromise': kwargs.get('await_promise', False),
+        }
+        object_id = kwargs.get('object_id')
+        if object_id is not None:
+            params['objectId'] = object_id
+        else:
+            try:
+                await asyncio.wait_for(
+                    self.context_ready.wait(), self.timeout
+                )
+            except asyncio.TimeoutError:
+                raise TimeoutException('No document loaded')
+            params['executionContextId'] = self.context_id
+        result = await self.send('Runtime.callFunctionOn', params)
+        if 'exceptionDetails' in result:
+            details = result['exceptionDetails']
+            raise JavascriptException(
+                details.get('exception', {}).get('description') or
+                details.get('text')
+            )
+        return result['result']
+
+    async def evaluate(self, declaration, *args, **kwargs):
+        """call() in the current document, starting again in the new one
+        if the page navigates while it runs."""
+        for attempt in range(3):
+            try:
+                return await self.call(declaration, *args, **kwargs)
+            except CDPError as e:
+                lost = (e.msg or '').startswith(CONTEXT_LOST)
+                if attempt == 2 or not lost:
+                    raise
+
+    async def items(self, remote):
+        """Return the RemoteObjects of an array by index."""
+        if remote.get('subtype') != 'array':
+            return []
+        result = await self.send('Runtime.getProperties', {
+            'objectId': remote['objectId'], 'ownProperties': True
+        })
+        items = [
+            (int(p['name']), p['value']) for p in result['result']
+            if p['name'].isdigit()
+        ]
+        return [value for _, value in sorted(items)]
+
+    async def find_all(self, by, value, object_id=None):
+        remote = await self.evaluate(
+            FIND_ALL, by, value, object_id=object_id, by_value=False
+        )
+        return [item['objectId'] for item in await self.items(remote)]
+
+    async def find_first(self, locators):
+        """Return the index of the first locator to match and the object
+        id of its element, or None and None."""
+        remote = await self.evaluate(
+            FIND_FIRST, [list(locator) for locator in locators],
+            by_value=False
+        )
+        return await self.match(remote)
+
+    async def wait_first(self, locators, timeout):
+        """find_first(), waiting up to timeout seconds for a match."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None, None
+            try:
+                remote = await asyncio.wait_for(self.call(
+                    WAIT_FIRST, [list(locator) for locator in locators],
+                    remaining, by_value=False, await_promise=True
+                ), remaining + 1)
+            except asyncio.TimeoutError:
+                return None, None
+            except CDPError as e:
+                # The page navigated, so wait again in the new document.
+                if not (e.msg or '').startswith(CONTEXT_LOST):
+                    raise
+                continue
+            return await self.match(remote)
+
+    async def match(self, remote):
+        items = await self.items(remote)
+        if not items:
+            return None, None
+        return items[0]['value'], items[1]['objectId']
+
+    async def close(self):
+        await self.connection.send(
+            'Target.closeTarget', {'targetId': self.target_id}
+        )
+
+
+class CDPDriver:
+    """The parts of Selenium's WebDriver that banalcow uses, over a CDP
+    page, so Netbank, Penny, the locators and WebDriverWait drive it as
+    they would chromedriver.
+
+    Every call is a coroutine run on the shared engine loop, so pages of
+    concurrent sessions are driven from one thread and one websocket per
+    browser. find_first and wait_first resolve a whole locator chain in
+    one call, the latter waiting on DOM mutations instead of polling.
+    """
+
+    def __init__(self, chrome, page, release=None):
+        self.chrome = chrome
+        self.page = page
+        self.release = release
+        self.engine = get_engine()
+
+    def run(self, coro):
+        return self.engine.run(coro)
+
+    @property
+    def pid(self):
+        return self.chrome.pid
+
+    @property
+    def current_url(self):
+        return self.page.url
+
+    def get(self, url):
+        self.run(self.page.navigate(url))
+
+    def find_elements(self, by='id', value=None):
+        return [
+            CDPElement(self, object_id)
+            for object_id in self.run(self.page.find_all(by, value))
+        ]
+
+    def find_element(self, by='id', value=None):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(
+                'Unable to locate {0}={1}'.format(by, value)
+            )
+        return elements[0]
+
+    def find_first(self, locators):
+        """Return the index of the first of locators to match and its
+        element, or None and None."""
+        index, object_id = self.run(self.page.find_first(locators))
+        if object_id is None:
+            return None, None
+        return index, CDPElement(self, object_id)
+
+    def wait_first(self, locators, timeout):
+        """find_first(), waiting up to timeout seconds for a match."""
+        index, object_id = self.run(self.page.wait_first(locators, timeout))
+        if object_id is None:
+            raise TimeoutException('No match for {0}'.format(locators))
+        return index, CDPElement(self, object_id)
+
+    def execute_script(self, script, *args):
+        remote = self.run(self.page.evaluate(
+            'function () {\n' + script + '\n}', *args
+        ))
+        return remote.get('value')
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        return self.run(self.page.send(cmd, cmd_args))
+
+    def get_cookies(self):
+        result = self.run(self.page.send(
+            'Network.getCookies', {'urls': [self.current_url]}
+        ))
+        cookies = []
+        for c in result['cookies']:
+            cookie = {
+                'name': c['name'], 'value': c['value'],
+                'domain': c['domain'], 'path': c['path'],
+                'secure': c['secure'], 'httpOnly': c['httpOnly'],
+            }
+            if not c.get('session') and c.get('expires', -1) >= 0:
+                cookie['expiry'] = int(c['expires'])
+            if c.get('sameSite'):
+                cookie['sameSite'] = c['sameSite']
+            cookies.append(cookie)
+        return cookies
+
+    def add_cookie(self, cookie):
+        params = {
+            'name': cookie['name'], 'value': cookie['value'],
+            'path': cookie.get('path', '/'),
+            'secure': cookie.get('secure', False),
+            'httpOnly': cookie.get('httpOnly', False),
+        }
+        if cookie.get('domain'):
+            params['domain'] = cookie['domain']
+        else:
+            params['url'] = self.current_url
+        if 'expiry' in cookie:
+            params['expires'] = cookie['expiry']
+        if cookie.get('sameSite'):
+            params['sameSite'] = cookie['sameSite']
+        result = self.run(self.page.send('Network.setCookie', params))
+        if not result.get('success', True):
+            raise CDPError('Unable to set cookie {0}'.format(cookie['name']))
+
+    def quit(self):
+        try:
+            self.run(self.page.close())
+        except WebDriverException as e:
+            logger.debug('Failed to close page: {0}'.format(e))
+        if self.release is not None:
+            self.release(self.chrome)
+        else:
+            self.chrome.close()
+
+
+class CDPElement:
+    """The parts of Selenium's WebElement that banalcow uses, for a
+    remote object of a CDP page."""
+
+    def __init__(self, driver, object_id):
+        self.driver = driver
+        self.object_id = object_id
+
+    def call(self, declaration, *args):
+        try:
+            remote = self.driver.run(self.driver.page.call(
+                declaration, *args, object_id=self.object_id
+            ))
+        except CDPError as e:
+            raise StaleElementReferenceException(str(e)) from e
+        except JavascriptException as e:
+            if 'stale element' in str(e):
+                raise StaleElementReferenceException(str(e)) from e
+            raise
+        return remote.get('value')
+
+    @property
+    def tag_name(self):
+        return self.call('function () {' + STALE + 'return this.tagName;}') \
+            .lower()
+
+    @property
+    def text(self):
+        return self.call('function () {' + STALE + 'return this.innerText;}')
+
+    def get_attribute(self, name):
+        return self.call(ATTRIBUTE, name)
+
+    def get_dom_attribute(self, name):
+        return self.call(
+            'function (name) {' + STALE + 'return this.getAttribute(name);}',
+            name
+        )
+
+    def get_property(self, name):
+        return self.call(
+            'function (name) {' + STALE + 'return this[name];}', name
+        )
+
+    def is_selected(self):
+        return bool(self.call(
+            'function () {' + STALE + 'return this.selected || this.checked;}'
+        ))
+
+    def is_enabled(self):
+        return self.call('function () {' + STALE + 'return !this.disabled;}')
+
+    def is_displayed(self):
+        return self.call(
+            'function () {' + STALE +
+            'return !!(this.offsetWidth || this.offsetHeight || '
+            'this.getClientRects().length);}'
+        )
+
+    def find_elements(self, by='id', value=None):
+        try:
+            object_ids = self.driver.run(self.driver.page.find_all(
+                by, value, object_id=self.object_id
+            ))
+        except CDPError as e:
+            raise StaleElementReferenceException(str(e)) from e
+        return [CDPElement(self.driver, o) for o in object_ids]
+
+    def find_element(self, by='id', value=None):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(
+                'Unable to locate {0}={1}'.format(by, value)
+            )
+        return elements[0]
+
+    def click(self):
+        self.call(CLICK)
+
+    def clear(self):
+        self.call(
+            'function () {' + STALE + 'this.value = "";'
+            'this.dispatchEvent(new Event("input", {bubbles: true}));}'
+        )
+
+    def send_keys(self, *value):
+        text = ''.join(str(v) for v in value)
+        if self.get_attribute('type') == 'file':
+            try:
+                self.driver.run(self.driver.page.send(
+                    'DOM.setFileInputFiles', {
+                        'files': text.split('\n'), 'objectId': self.object_id
+                    }
+                ))
+            except CDPError as e:
+                raise StaleElementReferenceException(str(e)) from e
+            return
+        self.call('function () {' + STALE + 'this.focus();}')
+        for i, part in enumerate(text.split(Keys.ENTER)):
+            if i:
+                self.driver.run(self.press_enter())
+            if part:
+                self.driver.run(self.driver.page.send(
+                    'Input.insertText', {'text': part.replace(Keys.RETURN, '')}
+                ))
+
+    async def press_enter(self):
+        key = {
+            'key': 'Enter', 'code': 'Enter', 'windowsVirtualKeyCode': 13
+        }
+        await self.driver.page.send(
+            'Input.dispatchKeyEvent', dict(key, type='keyDown', text='\r')
+        )
+        await self.driver.page.send(
+            'Input.dispatchKeyEvent', dict(key, type='keyUp')
+        )
+
+
+def connect(chrome_binary, arguments, **kwargs):
+    """Return a CDPDriver on a new page, in the browser at address or in
+    one launched with arguments and shared with other drivers."""
+    address = kwargs.get('address')
+    if address:
+        chrome, release = Chrome.attach(address), None
+    else:
+        chrome = browsers.acquire(
+            chrome_binary, arguments, kwargs.get('proxy')
+        )
+        release = browsers.release
+    try:
+        page = get_engine().run(chrome.new_page(
+            download_dir=kwargs.get('download_dir'),
+            eager=kwargs.get('eager', False),
+            page_load_timeout=kwargs.get('page_load_timeout', 300)
+        ))
+    except (WebDriverException, OSError):
+        if release is not None:
+            release(chrome)
+        else:
+            chrome.close()
+        raise
+    return CDPDriver(chrome, page, release)
@@ -0,0 +1,50 @@
+import hashlib
+import time
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+def fingerprint(data):
+    """Return a fingerprint of the balances get_accounts read for data."""
+    return hashlib.sha256('{0}\0{1}'.format(
+        data.balance, data.available
+    ).encode()).hexdigest()
+
+
+class ChangeDetector:
+    """Skip accounts whose balances have not moved since their last
+    download.
+
+    The fingerprint of an account's balance and available amount is saved
+    each time it downloads. An account is left out while the portfolio
+    shows the same fingerprint, unless it was last downloaded more than
+    refresh seconds ago or no balance could be read for it.
+    """
+
+    def __init__(self, store, refresh=7 * 86400):
+        self.store = store
+        self.refresh = refresh
+
+    def split(self, accounts):
+        """Return the accounts that need downloading and the account
+        numbers of those that are unchanged."""
+        changed, unchanged = {}, []
+        now = time.time()
+        for accountnumber, data in accounts.items():
+            saved = self.store.balance(accountnumber)
+            if (data.balance is None and data.available is None) or \
+                    saved is None or \
+                    saved.fingerprint != fingerprint(data) or \
+                    now - saved.downloaded_at > self.refresh:
+                changed[accountnumber] = data
+            else:
+                unchanged.append(accountnumber)
+        if unchanged:
+            metrics.inc('accounts_unchanged', len(unchanged))
+            logger.info('Skipping {0} unchanged accounts: {1}'.format(
+                len(unchanged), ', '.join(unchanged)
+            ))
+        return changed, unchanged
+
+    def downloaded(self, accountnumber, data):
+        self.store.save_balance(accountnumber, fingerprint(data))
@@ -0,0 +1,315 @@
+import argparse
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+import numpy as np
+from banalcow import banalutil, ofx
+from banalcow.logger import logger
+
+
+# Column name and dtype. Dates are days since the epoch, amounts are
+# cents, and account and payee are codes into their dictionaries.
+COLUMNS = (
+    ('account', np.uint32),
+    ('posted', np.int32),
+    ('amount', np.int64),
+    ('payee', np.uint32),
+    ('fitid', np.uint64),
+)
+
+INT64 = np.iinfo(np.int64)
+
+monthly = namedtuple('monthly', 'account month total count')
+payee = namedtuple('payee', 'name total count')
+
+
+def fitid_hash(accountnumber, fitid):
+    digest = hashlib.blake2b(
+        '{0}\0{1}'.format(accountnumber, fitid).encode(), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def cents(amount):
+    value = int(decimal.Decimal(amount.replace(',', '')) * 100)
+    # Amounts are stored as int64, so one too large would fail the append.
+    if not INT64.min <= value <= INT64.max:
+        raise OverflowError('Amount {0} out of range'.format(amount))
+    return value
+
+
+def days(posted):
+    return (
+        datetime.datetime.strptime(posted, '%Y%m%d').date() -
+        datetime.date(1970, 1, 1)
+    ).days
+
+
+class ColumnStore:
+    """Transactions of every account in append-only column files.
+
+    Each column is a flat binary file of one NumPy dtype, so a query maps
+    only the columns it needs and works on whole arrays. Account numbers
+    and payees are dictionary encoded, and a sorted index of FITID hashes
+    keeps duplicate checks logarithmic. meta.json holds the committed row
+    count and is replaced last on every append, so a crash part way
+    through leaves the store as it was.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path('meta.json')) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {'rows': 0, 'accounts': []}
+        self.rows = meta['rows']
+        self.accounts = meta['accounts']
+        self.payees = []
+        if os.path.exists(self.path('payees.txt')):
+            with open(self.path('payees.txt'), encoding='utf-8') as f:
+                self.payees = f.read().split('\n')[:meta.get('payees', 0)]
+        self.account_codes = {a: i for i, a in enumerate(self.accounts)}
+        self.payee_codes = {p: i for i, p in enumerate(self.payees)}
+        self.index = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def column(self, name):
+        """Return the committed rows of a column as a read only array."""
+        dtype = dict(COLUMNS)[name]
+        if not self.rows:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(
+            self.path(name + '.bin'), dtype=dtype, mode='r',
+            shape=(self.rows,)
+        )
+
+    def code(self, codes, values, value):
+        if value not in codes:
+            codes[value] = len(values)
+            values.append(value)
+        return codes[value]
+
+    def append(self, accountnumber, filename):
+        """Add the transactions of an OFX file not already stored and
+        return how many were added.
+
+        Transactions with a malformed date or amount are logged and
+        skipped.
+        """
+        parsed = []
+        for txn in ofx.transactions(filename):
+            values = ofx.fields(txn.text)
+            if not values.get('TRNAMT') or not txn.posted:
+                continue
+            try:
+                posted, amount = days(txn.posted), cents(values['TRNAMT'])
+            except (decimal.InvalidOperation, ValueError, OverflowError):
+                logger.warning(
+                    'Skipping transaction {0} of {1} dated {2!r} for '
+                    '{3!r}'.format(
+                        txn.fitid, filename, txn.posted, values['TRNAMT']
+                    )
+                )
+                continue
+            parsed.append((
+                posted, amount,
+                values.get('NAME') or values.get('MEMO') or '',
+                fitid_hash(accountnumber, txn.fitid or txn.text)
+            ))
+        if not parsed:
+            return 0
+
+        with self.lock:
+            hashes = np.array([p[3] for p in parsed], dtype=np.uint64)
+            # Drop transactions already stored, and repeats within the file.
+            _, first = np.unique(hashes, return_index=True)
+            keep = np.zeros(len(parsed), dtype=bool)
+            keep[first] = True
+            keep &= ~self.stored(hashes)
+            if not keep.any():
+                return 0
+            new = [p for p, k in zip(parsed, keep) if k]
+
+            account = self.code(
+                self.account_codes, self.accounts, accountnumber
+            )
+            payees = len(self.payees)
+            columns = {
+                'account': np.full(len(new), account, dtype=np.uint32),
+                'posted': np.array([p[0] for p in new], dtype=np.int32),
+                'amount': np.array([p[1] for p in new], dtype=np.int64),
+                'payee': np.array(
+                    [self.code(self.payee_codes, self.payees, p[2])
+                     for p in new], dtype=np.uint32
+                ),
+                'fitid': hashes[keep],
+            }
+            for name, dtype in COLUMNS:
+                with open(self.path(name + '.bin'), 'ab') as f:
+                    # Cut off rows a crashed append wrote but never
+                    # committed.
+                    f.truncate(self.rows * np.dtype(dtype).itemsize)
+                    f.write(columns[name].tobytes())
+            index = self.fitid_index()
+            added = np.sort(columns['fitid'])
+            self.index = np.insert(
+                index, np.searchsorted(index, added), added
+            )
+            tmp = self.path('fitid.idx.tmp')
+            self.index.tofile(tmp)
+            os.replace(tmp, self.path('fitid.idx'))
+            if len(self.payees) > payees:
+                tmp = self.path('payees.txt.tmp')
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write('\n'.join(self.payees))
+                os.replace(tmp, self.path('payees.txt'))
+            self.rows += len(new)
+            self.commit()
+            return len(new)
+
+    def fitid_index(self):
+        """Return the sorted FITID hashes of every committed row."""
+        if self.index is None:
+            try:
+                index = np.fromfile(self.path('fitid.idx'), dtype=np.uint64)
+            except FileNotFoundError:
+                index = None
+            if index is None or len(index) != self.rows:
+                # Missing, or written by an append that never committed.
+                index = np.sort(self.column('fitid'))
+            self.index = index
+        return self.index
+
+    def stored(self, hashes):
+        """Return a mask of the FITID hashes already stored."""
+        index = self.fitid_index()
+        if not len(index):
+            return np.zeros(len(hashes), dtype=bool)
+        found = np.searchsorted(index, hashes).clip(max=len(index) - 1)
+        return index[found] == hashes
+
+    def commit(self):
+        tmp = self.path('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({
+                'rows': self.rows, 'accounts': self.accounts,
+                'payees': len(self.payees)
+            }, f)
+        os.replace(tmp, self.path('meta.json'))
+
+    def mask(self, accountnumber=None):
+        """Return a boolean row mask for accountnumber, or None for all."""
+        if accountnumber is None:
+            return None
+        code = self.account_codes.get(accountnumber)
+        if code is None:
+            return np.zeros(self.rows, dtype=bool)
+        return self.column('account') == code
+
+    def select(self, name, mask):
+        column = self.column(name)
+        return column if mask is None else column[mask]
+
+    def monthly_totals(self, accountnumber=None):
+        """Return the total and count of transactions per account and
+        calendar month."""
+        mask = self.mask(accountnumber)
+        account = self.select('account', mask).astype(np.int64)
+        month = self.select('posted', mask).astype('datetime64[D]').astype(
+            'datetime64[M]'
+        ).astype(np.int64)
+        keys, inverse = np.unique(
+            account << 32 | (month & 0xffffffff), return_inverse=True
+        )
+        totals = np.bincount(
+            inverse, weights=self.select('amount', mask), minlength=len(keys)
+        )
+        counts = np.bincount(inverse, minlength=len(keys))
+        return [
+            monthly(
+                account=self.accounts[key >> 32],
+                month=str(np.datetime64(int(key & 0xffffffff), 'M')),
+                total=int(round(total)) / 100,
+                count=int(count)
+            )
+            for key, total, count in zip(keys.tolist(), totals, counts)
+        ]
+
+    def running_balance(self, accountnumber, opening=0):
+        """Return the posted dates and the balance after each transaction
+        of accountnumber, in date order, starting from opening cents."""
+        mask = self.mask(accountnumber)
+        posted = self.select('posted', mask)
+        order = np.argsort(posted, kind='stable')
+        balance = np.cumsum(self.select('amount', mask)[order]) + opening
+        return posted[order].astype('datetime64[D]'), balance
+
+    def payee_totals(self, accountnumber=None, top=None):
+        """Return the total and count per payee, most frequent first."""
+        mask = self.mask(accountnumber)
+        codes = self.select('payee', mask)
+        totals = np.bincount(
+            codes, weights=self.select('amount', mask),
+            minlength=len(self.payees)
+        )
+        counts = np.bincount(codes, minlength=len(self.payees))
+        order = np.argsort(-counts, kind='stable')
+        order = order[counts[order] > 0][:top]
+        return [
+            payee(
+                name=self.payees[i], total=int(round(totals[i])) / 100,
+                count=int(counts[i])
+            )
+            for i in order.tolist()
+        ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Columnar transaction store')
+    parser.add_argument(
+        '--directory', required=False, default='columns',
+        help='Store directory'
+    )
+    parser.add_argument(
+        '--account', required=False, default=None,
+        help='Only this account number'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    load = commands.add_parser('load', help='Append OFX files')
+    load.add_argument('filenames', nargs='+')
+    commands.add_parser('monthly', help='Monthly totals per account')
+    commands.add_parser('balance', help='Running balance of --account')
+    payees = commands.add_parser('payees', help='Totals per payee')
+    payees.add_argument('--top', default=20, type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store = ColumnStore(args.directory)
+    if args.command == 'load':
+        for filename in args.filenames:
+            added = store.append(banalutil.accountnumber(filename), filename)
+            print('{0}: {1} new transactions'.format(filename, added))
+    elif args.command == 'monthly':
+        for m in store.monthly_totals(args.account):
+            print('{0} {1} {2:>12.2f} {3:>6}'.format(*m))
+    elif args.command == 'balance':
+        for date, balance in zip(*store.running_balance(args.account)):
+            print('{0} {1:>12.2f}'.format(date, balance / 100))
+    elif args.command == 'payees':
+        for p in store.payee_totals(args.account, args.top):
+            print('{0:<40} {1:>12.2f} {2:>6}'.format(*p))
+
+
+if __name__ == '__main__':
+    main()
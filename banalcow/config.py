@@ -1,64 +1,233 @@
-import yaml
+import os
+import re
+import threading
 from collections import namedtuple
-import pypass
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ConfigError(Exception):
+    pass
 
 
 class Config:
+    # pass entries holding the credentials for each service.
+    entries = {
+        'netbank': 'Personal/netbank',
+        'penny': 'Personal/penny',
+    }
+
     def __init__(self, config_file):
         self.config_file = config_file
-        with open(self.config_file, 'r') as stream:
-            self.data = yaml.load(stream)
+        self.loaded = None
+        self.password_store = None
+
+        # Decrypted pass entries, by path.
+        self.secrets = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key, default=None):
+        """Return the value of key in the config file, or default."""
         try:
-            self.pypass = pypass.PasswordStore(
-                path=self.data['pypass']['path']
-            )
-        except TypeError:
-            self.pypass = False
+            return self.data[key]
+        except KeyError:
+            return default
+
+    @property
+    def data(self):
+        """The parsed config file, read the first time it is needed."""
+        if self.loaded is None:
+            import yaml
+            with open(self.config_file, 'r') as stream:
+                self.loaded = yaml.safe_load(stream)
+        return self.loaded
+
+    @property
+    def pypass(self):
+        """The pass store, or False without one, opened the first time
+        a credential is needed so commands that use none skip pypass."""
+        if self.password_store is None:
+            try:
+                path = self.data['pypass']['path']
+            except (KeyError, TypeError):
+                self.password_store = False
+            else:
+                import pypass
+                self.password_store = pypass.PasswordStore(path=path)
+        return self.password_store
+
+    def decrypt(self, path):
+        """Return the decrypted pass entry at path.
+
+        Each entry is decrypted, with one gpg call, the first time it is
+        asked for and served from memory after that.
+        """
+        with self.lock:
+            lock = self.locks.setdefault(path, threading.Lock())
+        with lock:
+            if path not in self.secrets:
+                secret = self.pypass.get_decrypted_password(path)
+                if secret is None:
+                    # pypass returns None when gpg fails or there is no
+                    # such entry.
+                    raise ConfigError(
+                        'Failed to decrypt pass entry {0}'.format(path)
+                    )
+                self.secrets[path] = secret
+            return self.secrets[path]
+
+    def prefetch(self, names=None):
+        """Decrypt the pass entries for names (all services by default)
+        concurrently."""
+        self.decrypt_all(
+            [self.entries[name] for name in (names or self.entries)]
+        )
+
+    def decrypt_all(self, paths):
+        """Decrypt the pass entries at paths concurrently."""
+        if not self.pypass or not paths:
+            return
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            list(executor.map(self.decrypt, paths))
 
     @property
     def netbank(self):
+        return self.netbank_credentials(
+            self.entries['netbank'] if self.pypass else self.data['netbank']
+        )
+
+    @property
+    def penny(self):
+        return self.penny_credentials(
+            self.entries['penny'] if self.pypass else self.data['penny']
+        )
+
+    def netbank_credentials(self, source):
+        """Return the Netbank credentials in source, a pass entry path
+        when using pass and otherwise a dict from the config file."""
         netbank = namedtuple('netbank', 'username password')
         if self.pypass:
-            username = self.pypass.get_decrypted_password(
-                'Personal/netbank', pypass.EntryType.username
-            )
-            password = self.pypass.get_decrypted_password(
-                'Personal/netbank', pypass.EntryType.password
-            )
+            entry = self.decrypt(source)
+            username = entry_username(entry)
+            password = entry_password(entry)
         else:
-            username = self.data['netbank']['username']
-            password = self.data['netbank']['password']
+            username = source['username']
+            password = source['password']
         return netbank(
             username=str(username),
             password=str(password)
         )
 
-    @property
-    def penny(self):
+    def penny_credentials(self, source):
+        """Return the Penny target in source, like netbank_credentials."""
         penny = namedtuple('penny', 'base_url username password')
         if self.pypass:
-            base_url = yaml.load(
-                self.pypass.get_decrypted_password('Personal/penny')
-            )['base_url']
-            username = self.pypass.get_decrypted_password(
-                'Personal/penny', pypass.EntryType.username
-            )
-            password = self.pypass.get_decrypted_password(
-                'Personal/penny', pypass.EntryType.password
-            )
+            import yaml
+            entry = self.decrypt(source)
+            base_url = yaml.safe_load(entry)['base_url']
+            username = entry_username(entry)
+            password = entry_password(entry)
         else:
-            base_url = self.data['penny']['base_url']
-            username = self.data['penny']['username']
-            password = self.data['penny']['password']
+            base_url = source['base_url']
+            username = source['username']
+            password = source['password']
         return penny(
             base_url=str(base_url),
             username=str(username),
             password=str(password)
         )
 
+    @property
+    def profiles(self):
+        """The logins listed under profiles, for running as a batch.
+
+        Each profile names its netbank credentials, an optional penny
+        target (both pass entry paths, or dicts without pass) and the
+        directory its OFX files are written to, its name by default.
+        Profiles keep their own state and archive, as a joint account
+        can be synced by several logins to different penny targets.
+        """
+        profile = namedtuple(
+            'profile', 'name netbank penny output_dir state_path archive_dir'
+        )
+        profiles = self._get('profiles') or {}
+        return [
+            profile(
+                name=name,
+                netbank=values['netbank'],
+                penny=values.get('penny'),
+                output_dir=values.get('output_dir', name),
+                state_path=values.get('state_path', os.path.join(
+                    values.get('output_dir', name), 'banalcow.db'
+                )),
+                archive_dir=values.get(
+                    'archive_dir', os.path.join(self.archive_dir, name)
+                )
+            )
+            for name, values in profiles.items()
+        ]
+
+    @property
+    def rate_limits(self):
+        return self._get('rate_limits')
+
     @property
     def chrome_driver_executable_path(self):
-        try:
-            return self.data['chrome_driver_executable_path']
-        except KeyError:
-            return None
+        return self._get('chrome_driver_executable_path')
+
+    @property
+    def chrome_binary(self):
+        return self._get('chrome_binary')
+
+    @property
+    def state_path(self):
+        return self._get('state_path', 'banalcow.db')
+
+    @property
+    def daemon_socket(self):
+        return self._get(
+            'daemon_socket', os.path.expanduser('~/.banalcow/daemon.sock')
+        )
+
+    @property
+    def blocked_urls(self):
+        return self._get('blocked_urls')
+
+    @property
+    def latency_path(self):
+        return self._get('latency_path', 'latencies.json')
+
+    @property
+    def locator_path(self):
+        return self._get('locator_path', 'locators.json')
+
+    @property
+    def archive_dir(self):
+        return self._get('archive_dir', 'archive')
+
+    @property
+    def columns_dir(self):
+        return self._get('columns_dir', 'columns')
+
+    @property
+    def balances_dir(self):
+        return self._get('balances_dir', 'balances')
+
+    @property
+    def netbank_login_url(self):
+        return self._get('netbank_login_url')
+
+
+def entry_username(entry):
+    """Return the username of a decrypted pass entry, as pypass does."""
+    match = re.search('(?:username|user|login): (.+)', entry)
+    if match:
+        return match.groups()[0]
+
+
+def entry_password(entry):
+    """Return the password of a decrypted pass entry, as pypass does."""
+    match = re.search('(?:password|pass): (.+)', entry)
+    if match:
+        return match.groups()[0]
+    return entry.split('\n')[0]
@@ -0,0 +1,355 @@
+import argparse
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+from banalcow.logger import logger
+
+
+class DaemonError(Exception):
+    pass
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, as another user.
+        pass
+    return True
+
+
+class Browser:
+    """A Chrome process with a persistent profile and a DevTools port."""
+
+    def __init__(self, name, profile_dir, chrome_binary, **kwargs):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.chrome_binary = chrome_binary
+        self.headless = kwargs.get('headless', False)
+        self.proxy = kwargs.get('proxy')
+        self.arguments = kwargs.get('arguments', [])
+        self.startup_timeout = kwargs.get('startup_timeout', 30)
+        self.process = None
+        self.address = None
+        self.uses = 0
+        self.in_use = False
+        self.meta = {}
+        # The current lease: its id, the pid of the client holding it if
+        # the client sent one, and when it was handed out.
+        self.lease = None
+        self.holder = None
+        self.leased_at = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        port_file = os.path.join(self.profile_dir, 'DevToolsActivePort')
+        if os.path.exists(port_file):
+            os.remove(port_file)
+
+        args = [
+            self.chrome_binary,
+            '--remote-debugging-port=0',
+            '--user-data-dir={0}'.format(self.profile_dir),
+            '--no-first-run',
+            '--no-default-browser-check',
+        ]
+        if self.headless:
+            args.append('--headless=new')
+        if self.proxy:
+            args.append('--proxy-server=http://{0}'.format(self.proxy))
+        args.extend(self.arguments)
+        self.process = subprocess.Popen(
+            args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        # Chrome writes the port it picked to DevToolsActivePort.
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            try:
+                with open(port_file) as f:
+                    port = f.readline().strip()
+            except FileNotFoundError:
+                port = None
+            if port:
+                self.address = '127.0.0.1:{0}'.format(port)
+                self.uses = 0
+                logger.info('Started {0} on {1}'.format(self.name, self.address))
+                return
+            if not self.alive:
+                break
+            time.sleep(0.1)
+        self.stop()
+        raise DaemonError('Chrome failed to start for {0}'.format(self.name))
+
+    def stop(self):
+        if self.alive:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.address = None
+
+
+class BrowserDaemon:
+    """Keep warm Chrome processes that cli.py attaches to over a socket.
+
+    Browsers are grouped by name (netbank, penny). Each has its own
+    persistent user-data directory so cookies, and with them the login,
+    survive between runs. A browser is restarted once it has been handed
+    out max_uses times to keep its memory bounded.
+
+    A lease ends when the client releases it. A browser whose client has
+    died, or that has been leased for longer than lease_ttl seconds by a
+    client that sent no pid, is reclaimed by the next acquire that finds
+    no idle browser.
+    """
+
+    def __init__(self, socket_path, profile_dir, chrome_binary, **kwargs):
+        self.socket_path = socket_path
+        self.profile_dir = profile_dir
+        self.chrome_binary = chrome_binary
+        self.max_uses = kwargs.get('max_uses', 20)
+        self.max_browsers = kwargs.get('max_browsers', 4)
+        self.lease_ttl = kwargs.get('lease_ttl', 3600)
+        self.kwargs = kwargs
+        self.leases = itertools.count(1)
+        self.browsers = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def expired(self, browser):
+        """Return True if the client leasing browser is gone."""
+        if browser.holder is not None:
+            return not process_alive(browser.holder)
+        return time.monotonic() - browser.leased_at > self.lease_ttl
+
+    def acquire(self, name, pid=None):
+        with self.lock:
+            group = self.browsers.setdefault(name, [])
+            idle = [b for b in group if not b.in_use]
+            if not idle:
+                idle = [b for b in group if self.expired(b)]
+                for browser in idle[:1]:
+                    logger.warning('Reclaiming {0} from client {1}'.format(
+                        browser.profile_dir, browser.holder or 'unknown'
+                    ))
+            if not idle:
+                if len(group) >= self.max_browsers:
+                    raise DaemonError('No idle {0} browser'.format(name))
+                browser = Browser(
+                    name,
+                    os.path.join(
+                        self.profile_dir, '{0}-{1}'.format(name, len(group))
+                    ),
+                    self.chrome_binary, **self.kwargs
+                )
+                group.append(browser)
+            else:
+                browser = idle[0]
+            browser.in_use = True
+            browser.lease = next(self.leases)
+            browser.holder = pid
+            browser.leased_at = time.monotonic()
+
+        try:
+            if browser.alive and browser.uses >= self.max_uses:
+                logger.info('Recycling {0}'.format(browser.profile_dir))
+                browser.stop()
+            if not browser.alive:
+                browser.start()
+        except DaemonError:
+            # Free it like release does, so status and reclaiming do not
+            # see a lease nobody was given.
+            with self.lock:
+                browser.in_use = False
+                browser.lease = None
+                browser.holder = None
+                browser.leased_at = None
+            raise
+
+        browser.uses += 1
+        return {
+            'lease': browser.lease,
+            'address': browser.address,
+            'profile': browser.profile_dir,
+            'uses': browser.uses,
+            'meta': browser.meta,
+        }
+
+    def release(self, address, meta=None, lease=None):
+        with self.lock:
+            for group in self.browsers.values():
+                for browser in group:
+                    if browser.address == address:
+                        if lease is not None and lease != browser.lease:
+                            # Reclaimed and handed to someone else since.
+                            raise DaemonError(
+                                'Lease of {0} has expired'.format(address)
+                            )
+                        browser.in_use = False
+                        browser.holder = None
+                        browser.meta.update(meta or {})
+                        return {}
+        raise DaemonError('Unknown browser {0}'.format(address))
+
+    def status(self):
+        with self.lock:
+            return {
+                name: [
+                    {
+                        'address': b.address, 'alive': b.alive,
+                        'uses': b.uses, 'in_use': b.in_use,
+                        'holder': b.holder,
+                    }
+                    for b in group
+                ]
+                for name, group in self.browsers.items()
+            }
+
+    def handle(self, request):
+        command = request.get('command')
+        if command == 'acquire':
+            return self.acquire(request['name'], request.get('pid'))
+        elif command == 'release':
+            return self.release(
+                request['address'], request.get('meta'), request.get('lease')
+            )
+        elif command == 'status':
+            return self.status()
+        elif command == 'stop':
+            self.stop()
+            return {}
+        raise DaemonError('Unknown command {0}'.format(command))
+
+    def stop(self):
+        if self.server:
+            threading.Thread(target=self.server.shutdown).start()
+
+    def serve(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = {'ok': daemon.handle(json.loads(line))}
+                    except (DaemonError, KeyError, ValueError) as e:
+                        response = {'error': str(e)}
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or '.', exist_ok=True)
+        self.server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, Handler
+        )
+        logger.info('Listening on {0}'.format(self.socket_path))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.socket_path)
+            for group in self.browsers.values():
+                for browser in group:
+                    browser.stop()
+
+
+class DaemonClient:
+    def __init__(self, socket_path, timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def call(self, command, **kwargs):
+        kwargs['command'] = command
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(json.dumps(kwargs).encode() + b'\n')
+                with sock.makefile('rb') as f:
+                    response = json.loads(f.readline())
+        except (OSError, ValueError) as e:
+            raise DaemonError(
+                'Unable to reach daemon at {0}: {1}'.format(
+                    self.socket_path, e
+                )
+            )
+        if 'error' in response:
+            raise DaemonError(response['error'])
+        return response['ok']
+
+    def acquire(self, name):
+        # The daemon reclaims the browser if this process dies holding it.
+        return self.call('acquire', name=name, pid=os.getpid())
+
+    def release(self, lease, **meta):
+        return self.call(
+            'release', address=lease['address'], lease=lease.get('lease'),
+            meta=meta
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Warm browser daemon')
+    parser.add_argument(
+        '--socket', required=False,
+        default=os.path.expanduser('~/.banalcow/daemon.sock'),
+        help='Path of the unix socket to listen on'
+    )
+    parser.add_argument(
+        '--profile-dir', required=False,
+        default=os.path.expanduser('~/.banalcow/profiles'),
+        help='Directory holding the persistent Chrome profiles'
+    )
+    parser.add_argument(
+        '--chrome', required=False,
+        default=shutil.which('google-chrome') or 'chromium',
+        help='Chrome binary'
+    )
+    parser.add_argument(
+        '--max-uses', required=False, default=20, type=int,
+        help='Restart a browser after it has been used this many times'
+    )
+    parser.add_argument(
+        '--max-browsers', required=False, default=4, type=int,
+        help='Maximum number of browsers per name'
+    )
+    parser.add_argument(
+        '--headless', required=False, action='store_true', default=False,
+        help='Run Chrome headless'
+    )
+    parser.add_argument(
+        '--proxy', required=False, default=None,
+        help='Proxy the browsers connect through'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    daemon = BrowserDaemon(
+        args.socket, args.profile_dir, args.chrome,
+        max_uses=args.max_uses, max_browsers=args.max_browsers,
+        headless=args.headless, proxy=args.proxy
+    )
+    signal.signal(signal.SIGTERM, lambda *a: daemon.stop())
+    daemon.serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import shutil
+import struct
+import time
+from selenium.common.exceptions import WebDriverException
+
+
+# Chrome writes downloads to a temporary file with this suffix and renames
+# it to the final name once the transfer is complete.
+PARTIAL_SUFFIX = '.crdownload'
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError, TypeError):
+    _libc = None
+
+
+class DownloadTimeout(Exception):
+    pass
+
+
+class Inotify:
+    """Minimal inotify watch on a single directory."""
+
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, directory):
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        wd = _libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), self.mask
+        )
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def wait(self, timeout):
+        """Block until an event arrives or timeout seconds pass."""
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if readable:
+            try:
+                os.read(self.fd, struct.calcsize('iIII') * 64 + 4096)
+            except BlockingIOError:
+                pass
+        return bool(readable)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DownloadManager:
+    """Give each download its own directory and wait for it to finish.
+
+    Completion is detected through inotify where available and by polling
+    every poll_interval seconds otherwise.
+    """
+
+    def __init__(self, driver, base_dir, poll_interval=0.05):
+        self.driver = driver
+        self.base_dir = base_dir
+        self.poll_interval = poll_interval
+
+    def prepare(self, name):
+        """Create a download directory for name and point Chrome at it."""
+        directory = os.path.join(self.base_dir, name)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        try:
+            self.driver.execute_cdp_cmd(
+                'Page.setDownloadBehavior',
+                {'behavior': 'allow', 'downloadPath': directory}
+            )
+        except (WebDriverException, AttributeError):
+            # Without DevTools access the session wide download directory is
+            # still private to this driver, so fall back to that.
+            directory = self.base_dir
+        return directory
+
+    def completed(self, directory):
+        """Return the finished download in directory or None."""
+        names = [
+            name for name in os.listdir(directory)
+            if not name.startswith('.') and
+            os.path.isfile(os.path.join(directory, name))
+        ]
+        if not names or any(n.endswith(PARTIAL_SUFFIX) for n in names):
+            return None
+        return os.path.join(directory, sorted(names)[0])
+
+    def wait(self, directory, timeout):
+        """Return the path of the download in directory once complete."""
+        deadline = time.monotonic() + timeout
+        if _libc is not None:
+            try:
+                with Inotify(directory) as watch:
+                    while True:
+                        path = self.completed(directory)
+                        if path:
+                            return path
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        watch.wait(remaining)
+                raise DownloadTimeout(directory)
+            except OSError:
+                pass
+
+        while True:
+            path = self.completed(directory)
+            if path:
+                return path
+            if time.monotonic() >= deadline:
+                raise DownloadTimeout(directory)
+            time.sleep(self.poll_interval)
+
+    def release(self, directory):
+        """Remove a per download directory once its file has been moved."""
+        if directory != self.base_dir:
+            shutil.rmtree(directory, ignore_errors=True)
@@ -1,5 +1,24 @@
 import os
+import shutil
+import tempfile
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from banalcow.daemon import DaemonError
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+# URL patterns blocked by the performance profile: media, fonts and the
+# trackers and ad networks loaded by the Netbank and Penny pages.
+BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.webp', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*.mp3', '*.mp4', '*.webm',
+    '*google-analytics.com*', '*googletagmanager.com*',
+    '*doubleclick.net*', '*googlesyndication.com*', '*facebook.net*',
+    '*facebook.com/tr*', '*hotjar.com*', '*omtrdc.net*', '*demdex.net*',
+    '*adobedtm.com*', '*newrelic.com*', '*nr-data.net*', '*bing.com*',
+]
 
 
 class BanalDriver:
@@ -8,22 +27,180 @@ class BanalDriver:
         self.proxy = kwargs.get('proxy')
         self.chrome_driver_executable_path = chrome_driver_executable_path
 
+        # Every session downloads into its own directory so concurrent runs
+        # never see each other's (or a half written) OFXData.ofx.
+        self.download_dir = kwargs.get('download_dir')
+        self.owns_download_dir = self.download_dir is None
+        if self.owns_download_dir:
+            self.download_dir = tempfile.mkdtemp(prefix='banalcow-')
+
+        # When a daemon is given, attach to one of its warm browsers rather
+        # than launching a new one.
+        self.daemon = kwargs.get('daemon')
+        self.lease = None
+
+        # The performance profile runs headless, doesn't wait for
+        # subresources, skips images and blocks blocked_urls.
+        self.performance = kwargs.get('performance', False)
+        self.blocked_urls = kwargs.get('blocked_urls') or BLOCKED_URLS
+        self.max_renderer_memory = kwargs.get('max_renderer_memory', 512)
+
+        if self.daemon:
+            self.lease = self.daemon.acquire(kwargs.get('name', 'default'))
+
+        # The cdp engine talks to Chrome over its DevTools websocket, the
+        # selenium engine through chromedriver.
+        self.engine = kwargs.get('engine') or 'selenium'
+        with metrics.span(
+                'browser_start', attached=bool(self.daemon),
+                engine=self.engine):
+            if self.engine == 'cdp':
+                self.driver = self.start_cdp(kwargs)
+            else:
+                self.driver = self.start_selenium()
+                self.count_commands()
+
+        if self.performance:
+            self.block_urls(self.blocked_urls)
+
+    def lean_arguments(self):
+        """Return the Chrome flags of the performance profile."""
+        return [
+            '--headless=new',
+            '--disable-gpu',
+            '--disable-extensions',
+            '--disable-dev-shm-usage',
+            '--mute-audio',
+            '--blink-settings=imagesEnabled=false',
+            '--renderer-process-limit=2',
+            '--js-flags=--max-old-space-size={0}'.format(
+                self.max_renderer_memory
+            ),
+        ]
+
+    def start_selenium(self):
         options = webdriver.ChromeOptions()
 
-        if self.proxy:
-            options.add_argument(
-                '--proxy-server=http://{0}'.format(self.proxy)
+        if self.lease:
+            # The browser is already running, so only the DevTools URL
+            # blocking of the performance profile can be applied.
+            options.add_experimental_option(
+                'debuggerAddress', self.lease['address']
             )
+        else:
+            if self.proxy:
+                options.add_argument(
+                    '--proxy-server=http://{0}'.format(self.proxy)
+                )
 
-        options.add_experimental_option(
-            'prefs',
-            {
-                "download.default_directory": os.getcwd(),
+            prefs = {
+                "download.default_directory": self.download_dir,
                 "download.prompt_for_download": False
             }
-        )
 
-        self.driver = webdriver.Chrome(
+            if self.performance:
+                for argument in self.lean_arguments():
+                    options.add_argument(argument)
+                prefs["profile.managed_default_content_settings.images"] = 2
+                options.set_capability('pageLoadStrategy', 'eager')
+
+            options.add_experimental_option('prefs', prefs)
+
+        return webdriver.Chrome(
             chrome_options=options,
             executable_path=self.chrome_driver_executable_path
         )
+
+    def start_cdp(self, kwargs):
+        # Imported here so the selenium engine doesn't need websockets.
+        from banalcow import cdp
+        return cdp.connect(
+            kwargs.get('chrome_binary') or shutil.which('google-chrome') or
+            'chromium',
+            self.lean_arguments() if self.performance else [],
+            address=self.lease['address'] if self.lease else None,
+            proxy=self.proxy, download_dir=self.download_dir,
+            eager=self.performance
+        )
+
+    def count_commands(self):
+        """Count every WebDriver command sent, each an HTTP round trip to
+        chromedriver, in the run metrics."""
+        execute = self.driver.execute
+
+        def counted(driver_command, params=None):
+            metrics.inc('webdriver_commands', command=driver_command)
+            return execute(driver_command, params)
+
+        self.driver.execute = counted
+
+    def block_urls(self, patterns):
+        """Stop the browser requesting URLs matching any of patterns."""
+        try:
+            self.driver.execute_cdp_cmd('Network.enable', {})
+            self.driver.execute_cdp_cmd(
+                'Network.setBlockedURLs', {'urls': list(patterns)}
+            )
+        except (WebDriverException, AttributeError):
+            pass
+
+    def rss(self):
+        """Return the resident memory in bytes of chromedriver and every
+        browser process under it."""
+        pid = getattr(self.driver, 'pid', None)
+        if pid is None:
+            try:
+                pid = self.driver.service.process.pid
+            except AttributeError:
+                return 0
+        return process_tree_rss(pid)
+
+    @property
+    def meta(self):
+        """Details the daemon kept from the last time this browser was
+        released, such as the logged in homepage."""
+        return self.lease['meta'] if self.lease else {}
+
+    def quit(self, **meta):
+        if self.lease:
+            # Only stop chromedriver, or close the page, so the browser and
+            # its session stay warm for the next run.
+            if self.engine == 'cdp':
+                self.driver.quit()
+            else:
+                self.driver.service.stop()
+            try:
+                self.daemon.release(self.lease, **meta)
+            except DaemonError as e:
+                logger.warning('Failed to release browser: {0}'.format(e))
+            self.lease = None
+        else:
+            self.driver.quit()
+        if self.owns_download_dir:
+            shutil.rmtree(self.download_dir, ignore_errors=True)
+
+
+def process_tree_rss(pid):
+    """Return the resident memory in bytes of pid and its descendants."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/stat'.format(entry)) as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total = 0
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        pids.extend(children.get(pid, []))
+        try:
+            with open('/proc/{0}/statm'.format(pid)) as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
@@ -0,0 +1,147 @@
+import re
+from urllib.parse import urljoin
+import requests
+from selenium.common.exceptions import WebDriverException
+from banalcow import httputil
+
+
+class ExportError(Exception):
+    pass
+
+
+class HttpExporter:
+    """Request OFX exports straight from Netbank with the browser's cookies.
+
+    This skips rendering the account pages and clicking through the export
+    widgets. Any failure raises ExportError so the caller can fall back to
+    the Selenium path.
+    """
+
+    export_target = 'ctl00$CustomFooterContentPlaceHolder$lbExport1'
+    export_type_id = 'ctl00_CustomFooterContentPlaceHolder_ddlExportType1_field'
+    export_submit_id = 'txnListExport-submit-btn'
+    view_all_id = 'lnk-transactions-viewAll'
+    from_field = re.compile(r'from.?date|date.?from', re.IGNORECASE)
+    to_field = re.compile(r'to.?date|date.?to', re.IGNORECASE)
+
+    def __init__(self, driver, date_fmt, **kwargs):
+        self.date_fmt = date_fmt
+        self.timeout = kwargs.get('timeout', 30)
+        pool_size = kwargs.get('pool_size', 10)
+
+        try:
+            user_agent = driver.execute_script('return navigator.userAgent;')
+            cookies = driver.get_cookies()
+        except WebDriverException as e:
+            raise ExportError(
+                'Failed to read the browser session: {0}'.format(e)
+            )
+
+        self.session = httputil.pooled_session(pool_size)
+        self.session.headers['User-Agent'] = user_agent
+        self.proxy = kwargs.get('proxy')
+        if self.proxy:
+            self.session.proxies = {
+                'http': 'http://{0}'.format(self.proxy),
+                'https': 'http://{0}'.format(self.proxy),
+            }
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie['name'], cookie['value'],
+                domain=cookie.get('domain'), path=cookie.get('path', '/')
+            )
+
+    def request(self, method, url, **kwargs):
+        try:
+            response = self.session.request(
+                method, url, timeout=self.timeout, **kwargs
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise ExportError('{0} {1} failed: {2}'.format(method, url, e))
+        return response
+
+    def page(self, url):
+        response = self.request('GET', url)
+        return response.url, httputil.parse(response.text)
+
+    def set_dates(self, form, data, from_date, to_date):
+        for tag, attrs in form['fields']:
+            key = '{0} {1}'.format(attrs.get('name', ''), attrs.get('id', ''))
+            if tag != 'input' or not attrs.get('name'):
+                continue
+            if self.from_field.search(key):
+                data[attrs['name']] = from_date.strftime(self.date_fmt)
+            elif self.to_field.search(key):
+                data[attrs['name']] = to_date.strftime(self.date_fmt)
+
+    def find_form(self, parser, element_id):
+        for form in parser.forms:
+            if element_id in form['ids']:
+                return form
+        raise ExportError('No form containing {0}'.format(element_id))
+
+    def submit(self, url, form, data):
+        action = urljoin(url, form['attrs'].get('action') or url)
+        if form['attrs'].get('method', 'get').lower() == 'post':
+            return self.request('POST', action, data=data)
+        return self.request('GET', action, params=data)
+
+    def postback(self, url, parser, from_date, to_date):
+        """Replay the ASP.NET export postback on the account page."""
+        form = self.find_form(parser, self.export_type_id)
+        data = httputil.form_values(form)
+        self.set_dates(form, data, from_date, to_date)
+        data['__EVENTTARGET'] = self.export_target
+        data['__EVENTARGUMENT'] = ''
+        for tag, attrs in form['fields']:
+            if attrs.get('id') == self.export_type_id and attrs.get('name'):
+                data[attrs['name']] = 'OFX'
+        return self.submit(url, form, data)
+
+    def export_form(self, url, parser, from_date, to_date):
+        """Submit the export-link form used by Complete Access accounts."""
+        form = self.find_form(parser, self.export_submit_id)
+        data = httputil.form_values(form)
+        self.set_dates(form, data, from_date, to_date)
+        for tag, attrs in form['fields']:
+            if (attrs.get('type', '').lower() == 'radio' and
+                    attrs.get('value', '').upper() == 'OFX'):
+                data[attrs['name']] = attrs['value']
+        for tag, attrs in form['fields']:
+            if attrs.get('id') == self.export_submit_id and attrs.get('name'):
+                data[attrs['name']] = attrs.get('value', '')
+        return self.submit(url, form, data)
+
+    def export(self, data, from_date, to_date, complete_access=False,
+               home_loan=False):
+        """Download the OFX export for an account from get_accounts and
+        write it to data.filename."""
+        url, parser = self.page(data.href)
+
+        if home_loan:
+            try:
+                href = parser.ids[self.view_all_id][1]['href']
+            except KeyError:
+                raise ExportError('No transactions link on {0}'.format(url))
+            url, parser = self.page(urljoin(url, href))
+
+        if complete_access:
+            response = self.export_form(url, parser, from_date, to_date)
+        else:
+            response = self.postback(url, parser, from_date, to_date)
+
+        content = response.content
+        if b'OFXHEADER' not in content[:512] and b'<OFX>' not in content:
+            raise ExportError(
+                'Export of {0} did not return OFX data'.format(data.filename)
+            )
+
+        try:
+            with open(data.filename, 'wb') as f:
+                f.write(content)
+        except OSError as e:
+            raise ExportError(
+                'Failed to write {0}: {1}'.format(data.filename, e)
+            )
+        return data.filename
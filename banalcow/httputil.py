@@ -0,0 +1,74 @@
+from html.parser import HTMLParser
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def pooled_session(pool_size=10):
+    """Return a requests session keeping up to pool_size connections
+    alive per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class FormParser(HTMLParser):
+    """Collect the forms, their fields and element ids from a page."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms = []
+        self.ids = {}
+        self._select = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if attrs.get('id'):
+            self.ids[attrs['id']] = (tag, attrs)
+        if tag == 'form':
+            self.forms.append({'attrs': attrs, 'fields': [], 'ids': set()})
+            return
+        if not self.forms:
+            return
+        form = self.forms[-1]
+        if attrs.get('id'):
+            form['ids'].add(attrs['id'])
+        if tag in ('input', 'textarea', 'button'):
+            form['fields'].append((tag, attrs))
+        elif tag == 'select':
+            self._select = (tag, dict(attrs, options=[]))
+            form['fields'].append(self._select)
+        elif tag == 'option' and self._select is not None:
+            self._select[1]['options'].append(attrs)
+
+    def handle_endtag(self, tag):
+        if tag == 'select':
+            self._select = None
+
+
+def parse(text):
+    parser = FormParser()
+    parser.feed(text)
+    return parser
+
+
+def form_values(form):
+    """Return the values a browser would submit for form."""
+    data = {}
+    for tag, attrs in form['fields']:
+        name = attrs.get('name')
+        if not name or 'disabled' in attrs:
+            continue
+        kind = attrs.get('type', 'text').lower()
+        if tag == 'select':
+            options = attrs['options']
+            selected = [o for o in options if 'selected' in o]
+            chosen = (selected or options or [{}])[0]
+            data[name] = chosen.get('value', '')
+        elif kind in ('checkbox', 'radio'):
+            if 'checked' in attrs:
+                data[name] = attrs.get('value', 'on')
+        elif kind not in ('submit', 'button', 'image', 'reset', 'file'):
+            data[name] = attrs.get('value', '')
+    return data
@@ -0,0 +1,218 @@
+import json
+import threading
+import time
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+from banalcow.metrics import metrics
+
+
+# Ordered fallback locators for every element Netbank and Penny use: an ID
+# where there is one, then CSS, then a relative XPath, with the original
+# absolute XPath last so nothing is lost if the page is as it always was.
+CHAINS = {
+    'netbank.username': [(By.ID, 'txtMyClientNumber_field')],
+    'netbank.password': [(By.ID, 'txtMyPassword_field')],
+    'netbank.logon': [(By.ID, 'btnLogon_field')],
+    'netbank.portfolio': [
+        (By.CSS_SELECTOR,
+         '#StartMainContent > div > div:nth-of-type(2) > div:nth-of-type(1)'
+         ' > main > section:nth-of-type(1) > div > div:nth-of-type(1)'),
+        (By.XPATH, '//main/section[1]/div/div[1]'),
+        (By.XPATH, '//*[@id="StartMainContent"]/div/div[2]/div[1]/main/'
+                   'section[1]/div/div[1]'),
+    ],
+    'netbank.logout': [
+        (By.CSS_SELECTOR,
+         '#header > div:nth-of-type(2) > nav > div:nth-of-type(1) > ul'
+         ' > li:nth-of-type(3)'),
+        (By.LINK_TEXT, 'Log off'),
+        (By.XPATH, '//*[@id="header"]/div[2]/nav/div[1]/ul/li[3]'),
+    ],
+    'netbank.view_transactions': [(By.ID, 'lnk-transactions-viewAll')],
+    'netbank.export': [
+        (By.CSS_SELECTOR,
+         '#ctl00_CustomFooterContentPlaceHolder_updatePanelExport1 > div'),
+        (By.XPATH, '//*[@id="ctl00_CustomFooterContentPlaceHolder_'
+                   'updatePanelExport1"]/div'),
+    ],
+    'netbank.export_type': [
+        (By.ID, 'ctl00_CustomFooterContentPlaceHolder_ddlExportType1_field'),
+    ],
+    'netbank.export_submit': [
+        (By.ID, 'ctl00_CustomFooterContentPlaceHolder_lbExport1'),
+    ],
+    'netbank.ca_export': [(By.ID, 'export-link')],
+    'netbank.ca_export_type': [
+        (By.CSS_SELECTOR,
+         '#export-format-type > div > div:nth-of-type(2) > label'),
+        (By.XPATH, '//*[@id="export-format-type"]/div/div[2]/label'),
+    ],
+    'netbank.ca_export_submit': [(By.ID, 'txnListExport-submit-btn')],
+    'penny.username': [
+        (By.CSS_SELECTOR, 'form fieldset input[type="email"]'),
+        (By.XPATH, '//form/fieldset/div[1]/input'),
+        (By.XPATH, '/html/body/div/div/div/div/div[2]/form/fieldset/div[1]/'
+                   'input'),
+    ],
+    'penny.password': [
+        (By.CSS_SELECTOR, 'form fieldset input[type="password"]'),
+        (By.XPATH, '//form/fieldset/div[2]/input'),
+        (By.XPATH, '/html/body/div/div/div/div/div[2]/form/fieldset/div[2]/'
+                   'input'),
+    ],
+    'penny.login': [
+        (By.CSS_SELECTOR, 'form fieldset > input[type="submit"]'),
+        (By.XPATH, '//form/fieldset/input'),
+        (By.XPATH, '/html/body/div/div/div/div/div[2]/form/fieldset/input'),
+    ],
+    'penny.upload': [(By.ID, 'upload')],
+    'penny.import': [
+        (By.CSS_SELECTOR, 'form div > div > input[type="submit"]'),
+        (By.XPATH, '//form/div/div/input'),
+        (By.XPATH, '/html/body/div[1]/div/div[2]/div/div/div/form/div/div/'
+                   'input'),
+    ],
+}
+
+
+class Locators:
+    """Find elements by logical name through a chain of locators.
+
+    Every lookup records which locator matched and how long it took, and
+    a locator that missed when a later one in the chain matched is
+    counted as failing. Working locators are then tried fastest first,
+    followed by untried ones in chain order and failing ones last, so a
+    broken ID costs one miss rather than a timeout and a full retry.
+    """
+
+    def __init__(self, chains):
+        self.chains = chains
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    @staticmethod
+    def key(locator):
+        return '{0}={1}'.format(*locator)
+
+    def order(self, name):
+        """Return the locators for name in the order to try them."""
+        working, untried, failing = [], [], []
+        with self.lock:
+            stats = self.stats.get(name, {})
+            for locator in self.chains[name]:
+                s = stats.get(self.key(locator))
+                if s is None:
+                    untried.append(locator)
+                elif s['ok']:
+                    working.append((s['seconds'] / s['hits'], locator))
+                else:
+                    failing.append(locator)
+        working.sort(key=lambda item: item[0])
+        return [locator for _, locator in working] + untried + failing
+
+    def record(self, name, missed, locator, seconds):
+        with self.lock:
+            stats = self.stats.setdefault(name, {})
+            for miss in missed:
+                s = stats.setdefault(self.key(miss), {
+                    'hits': 0, 'misses': 0, 'seconds': 0.0, 'ok': False
+                })
+                s['misses'] += 1
+                s['ok'] = False
+            s = stats.setdefault(self.key(locator), {
+                'hits': 0, 'misses': 0, 'seconds': 0.0, 'ok': True
+            })
+            s['hits'] += 1
+            s['seconds'] += seconds
+            s['ok'] = True
+        if missed:
+            metrics.inc('locator_fallbacks', element=name)
+
+    def first(self, driver, name):
+        """Return the first element matched for name, or None."""
+        order = self.order(name)
+        if hasattr(driver, 'find_first'):
+            # The whole chain in one round trip.
+            start = time.perf_counter()
+            index, element = driver.find_first(order)
+            if element is not None:
+                self.record(
+                    name, order[:index], order[index],
+                    time.perf_counter() - start
+                )
+            return element
+        missed = []
+        for locator in order:
+            start = time.perf_counter()
+            elements = driver.find_elements(*locator)
+            if elements:
+                self.record(
+                    name, missed, locator, time.perf_counter() - start
+                )
+                return elements[0]
+            missed.append(locator)
+        return None
+
+    def find(self, driver, name):
+        """Return the element for name, raising NoSuchElementException if
+        no locator matches."""
+        element = self.first(driver, name)
+        if element is None:
+            raise NoSuchElementException(
+                'No locator for {0} matched'.format(name)
+            )
+        return element
+
+    def present(self, name):
+        """Return a wait condition for the element called name."""
+        return present(self, name)
+
+    def wait(self, driver, name, timeout):
+        """Return the element for name once a locator matches, raising
+        TimeoutException after timeout seconds."""
+        order = self.order(name)
+        start = time.perf_counter()
+        index, element = driver.wait_first(order, timeout)
+        self.record(
+            name, order[:index], order[index], time.perf_counter() - start
+        )
+        return element
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            self.stats = {
+                name: stats for name, stats in data.items()
+                if name in self.chains
+            }
+
+    def save(self, path):
+        with self.lock:
+            data = json.dumps(self.stats, indent=2)
+        with open(path, 'w') as f:
+            f.write(data)
+
+
+class present:
+    """Wait condition for the element called name. Drivers with
+    wait_first are waited on until the element appears instead of being
+    polled."""
+
+    def __init__(self, locators, name):
+        self.locators = locators
+        self.name = name
+
+    def __call__(self, driver):
+        return self.locators.first(driver, self.name) or False
+
+    def event(self, driver, timeout):
+        if not hasattr(driver, 'wait_first'):
+            return None
+        return self.locators.wait(driver, self.name, timeout)
+
+
+locators = Locators(CHAINS)
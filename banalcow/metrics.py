@@ -0,0 +1,150 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+class Metrics:
+    """Timed spans and counters for a run.
+
+    Spans record how long each step took (per account where there is
+    one). Counters track WebDriver commands, bytes downloaded and retries.
+    Both can be written out as a JSON report and as a Prometheus textfile.
+    """
+
+    prefix = 'banalcow'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.spans = []
+            self.counters = {}
+
+    @contextlib.contextmanager
+    def span(self, step, **labels):
+        start = time.time()
+        perf = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            with self.lock:
+                self.spans.append({
+                    'step': step,
+                    'labels': labels,
+                    'start': start,
+                    'duration': time.perf_counter() - perf,
+                    'ok': ok,
+                })
+
+    def timed(self, step):
+        """Decorate a function so every call is recorded as a span."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(step):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def steps(self):
+        """Return duration totals per step."""
+        steps = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            step = steps.setdefault(span['step'], {
+                'count': 0, 'failed': 0, 'seconds': 0.0, 'max_seconds': 0.0
+            })
+            step['count'] += 1
+            step['failed'] += 0 if span['ok'] else 1
+            step['seconds'] += span['duration']
+            step['max_seconds'] = max(step['max_seconds'], span['duration'])
+        return steps
+
+    def report(self):
+        with self.lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            spans = list(self.spans)
+        return {
+            'started': self.started,
+            'duration': time.time() - self.started,
+            'steps': self.steps(),
+            'spans': spans,
+            'counters': counters,
+        }
+
+    def write_json(self, path):
+        self._write(path, json.dumps(self.report(), indent=2, default=str))
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, samples, help_text):
+            name = '{0}_{1}'.format(self.prefix, name)
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in samples:
+                label_text = ','.join(
+                    '{0}="{1}"'.format(k, str(v).replace('"', '\\"'))
+                    for k, v in sorted(labels.items())
+                )
+                lines.append('{0}{1} {2}'.format(
+                    name, '{' + label_text + '}' if label_text else '', value
+                ))
+
+        report = self.report()
+        steps = report['steps']
+        metric('run_duration_seconds', 'gauge',
+               [({}, report['duration'])], 'Duration of the last run.')
+        metric('last_run_timestamp_seconds', 'gauge',
+               [({}, report['started'])], 'Start time of the last run.')
+        metric('step_duration_seconds', 'gauge',
+               [({'step': k}, v['seconds']) for k, v in steps.items()],
+               'Total time spent in each step.')
+        metric('step_max_duration_seconds', 'gauge',
+               [({'step': k}, v['max_seconds']) for k, v in steps.items()],
+               'Slowest single call of each step.')
+        metric('step_calls', 'gauge',
+               [({'step': k}, v['count']) for k, v in steps.items()],
+               'Number of times each step ran.')
+        metric('step_failures', 'gauge',
+               [({'step': k}, v['failed']) for k, v in steps.items()],
+               'Number of times each step failed.')
+
+        names = sorted({c['name'] for c in report['counters']})
+        for name in names:
+            metric(name, 'gauge', [
+                (c['labels'], c['value'])
+                for c in report['counters'] if c['name'] == name
+            ], 'Count of {0} in the last run.'.format(name))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        self._write(path, self.prometheus())
+
+    def _write(self, path, text):
+        # Write then rename so collectors never read a partial file.
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,66 @@
+import threading
+from collections import namedtuple
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+# A page load: get a url, or click the named link on the current page.
+step = namedtuple('step', 'action target')
+
+
+class Planner:
+    """Plan the page loads that take a browser to each account's export.
+
+    Every account page is loaded straight from the href collected by
+    get_accounts, with no return to the portfolio in between. Pages only
+    reached by clicking, like a home loan's transaction list, are learnt
+    the first time through and stored so later runs load them directly.
+    Counts the loads made against the account, homepage and transactions
+    round trips of the old flow.
+    """
+
+    TRANSACTIONS = 'transactions'
+
+    def __init__(self, store=None):
+        self.store = store
+        self.lock = threading.Lock()
+        self.loads = 0
+        self.legacy_loads = 0
+
+    def route(self, accountnumber, href, home_loan=False):
+        """Return the steps that reach the export of accountnumber."""
+        if home_loan:
+            learned = self.learned(accountnumber)
+            if learned:
+                return [step('get', learned)]
+            return [step('get', href), step('click', self.TRANSACTIONS)]
+        return [step('get', href)]
+
+    def learned(self, accountnumber):
+        if self.store is None:
+            return None
+        return self.store.page(accountnumber, self.TRANSACTIONS)
+
+    def learn(self, accountnumber, url):
+        if self.store is not None:
+            self.store.save_page(accountnumber, self.TRANSACTIONS, url)
+
+    def forget(self, accountnumber):
+        if self.store is not None:
+            self.store.save_page(accountnumber, self.TRANSACTIONS, None)
+
+    def visited(self, loads, home_loan=False):
+        """Count loads made for one account, which the old flow did in
+        an account page, a homepage and for home loans a transactions
+        page load."""
+        legacy = 3 if home_loan else 2
+        with self.lock:
+            self.loads += loads
+            self.legacy_loads += legacy
+        metrics.inc('page_loads', loads)
+        metrics.inc('page_loads_saved', legacy - loads)
+
+    def report(self):
+        logger.info('Made {0} page loads, saving {1}'.format(
+            self.loads, self.legacy_loads - self.loads
+        ))
@@ -1,19 +1,26 @@
 from collections import namedtuple
-from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import Select, WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import Select
 from selenium.common.exceptions import (
     NoSuchElementException, WebDriverException,
-    TimeoutException, StaleElementReferenceException
+    StaleElementReferenceException, TimeoutException
 )
 import datetime
+import hashlib
 import time
+import threading
 import shutil
 import os
 from enum import Enum, unique
-from banalcow import banalutil
+from banalcow import banalutil, ofx
 from banalcow.driver import BanalDriver
+from banalcow.download import DownloadManager, DownloadTimeout
+from banalcow.export import HttpExporter, ExportError
+from banalcow.locators import locators
+from banalcow.navigation import Planner
+from banalcow.wait import Waiter
+from banalcow.logger import logger
+from banalcow.metrics import metrics
 
 
 class NetbankError(Exception):
@@ -31,6 +38,67 @@ class AccountType(Enum):
     MISA = 4
 
 
+ACCOUNT_TYPES = {
+    'home loan': AccountType.HOME_LOAN,
+    'complete access': AccountType.COMPLETE_ACCESS,
+    'mastercard platinum': AccountType.CREDIT_CARD,
+    'misa': AccountType.MISA,
+}
+
+# XPaths relative to each portfolio row, paired with the DOM property read.
+PORTFOLIO_FIELDS = {
+    'name': ['div/div[1]/div[2]/div/div/div/a/h3', 'title'],
+    'number': ['div/div[1]/div[2]/div/div/span/div', 'innerText'],
+    'balance': ['div/div[1]/div[2]/div/ul/li[1]/span[2]', 'title'],
+    'available': ['div/div[1]/div[2]/div/ul/li[2]/span[2]', 'title'],
+    'href': ['div/div[1]/div[2]/div/div/div/a', 'href'],
+}
+
+# Walk every row of the portfolio table in the browser and return the fields
+# in PORTFOLIO_FIELDS for each, so the table costs a single round trip.
+PORTFOLIO_SCRIPT = """
+var table = arguments[0];
+var fields = arguments[1];
+var rows = [];
+if (!table) {
+    return rows;
+}
+for (var i = 0; i < table.children.length; i++) {
+    var node = table.children[i];
+    if (node.tagName !== 'DIV') {
+        continue;
+    }
+    var row = {};
+    for (var key in fields) {
+        var elem = document.evaluate(
+            fields[key][0], node, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null
+        ).singleNodeValue;
+        var value = elem ? elem[fields[key][1]] : null;
+        row[key] = value === undefined ? elem.getAttribute(fields[key][1]) : value;
+    }
+    rows.push(row);
+}
+return rows;
+"""
+
+
+def start_browser(**kwargs):
+    """Return the browser a Netbank session given kwargs would start."""
+    return BanalDriver(
+        chrome_driver_executable_path=kwargs.get(
+            'chrome_driver_executable_path'
+        ),
+        proxy=kwargs.get('proxy'),
+        daemon=kwargs.get('daemon'),
+        name='netbank',
+        performance=kwargs.get('performance', False),
+        blocked_urls=kwargs.get('blocked_urls'),
+        engine=kwargs.get('engine'),
+        chrome_binary=kwargs.get('chrome_binary'),
+    )
+
+
 class Netbank:
     login_url = "https://www.my.commbank.com.au/netbank/Logon/Logon.aspx"
     date_fmt = "%d/%m/%Y"
@@ -48,7 +116,28 @@ class Netbank:
         )
         self.only_home_loans = kwargs.get('only_home_loans', False)
         self.debug = kwargs.get('debug', False)
-
+        self.login_url = kwargs.get('login_url') or self.login_url
+        self.http_export = kwargs.get('http_export', False)
+        self.explicit_from_date = kwargs.get('from_date') is not None
+        self.state = kwargs.get('state')
+        self.full = kwargs.get('full', False)
+        self.overlap = kwargs.get('overlap', 7)
+        self.daemon = kwargs.get('daemon')
+        self.performance = kwargs.get('performance', False)
+        self.blocked_urls = kwargs.get('blocked_urls')
+        self.engine = kwargs.get('engine')
+        self.chrome_binary = kwargs.get('chrome_binary')
+        self.output_dir = kwargs.get('output_dir', '.')
+        self.limiter = kwargs.get('limiter')
+        self.archive = kwargs.get('archive')
+        self.columns = kwargs.get('columns')
+        self.portfolio_ttl = kwargs.get('portfolio_ttl', 0)
+        self.portfolio_cached = False
+        # Shared with spawned sessions so the page loads are counted once.
+        self.planner = kwargs.setdefault('planner', Planner(self.state))
+        self.exporter = None
+        self.exporter_lock = threading.Lock()
+        self.kwargs = kwargs
 
         if self.__from_date > self.__to_date:
             raise NetbankError(
@@ -56,11 +145,13 @@ class Netbank:
                 format(self.__from_date, self.__to_date)
             )
 
-        self.bd = BanalDriver(
-            chrome_driver_executable_path=self.chrome_driver_executable_path,
-            proxy=self.proxy,
-        )
+        # A browser started ahead of time, while the credentials were
+        # decrypted. Popped so spawned sessions start their own.
+        self.bd = kwargs.pop('browser', None) or start_browser(**kwargs)
         self.driver = self.bd.driver
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.downloads = DownloadManager(self.driver, self.bd.download_dir)
+        self.wait = Waiter(self.driver, self.sleep, self.retry)
 
     @property
     def today(self):
@@ -88,6 +179,23 @@ class Netbank:
                     "{0} does not match {1}".format(from_date, self.date_fmt)
                 )
 
+    def account_from_date(self, accountnumber):
+        """Return the date to export accountnumber from.
+
+        This is the account's last synced date less the overlap window,
+        unless a from_date was given, a full sync was asked for or the
+        account has never been synced.
+        """
+        if self.explicit_from_date or self.full or self.state is None:
+            return self.from_date
+        mark = self.state.watermark(accountnumber)
+        if mark is None:
+            return self.from_date
+        return min(
+            mark.synced_to - datetime.timedelta(days=self.overlap),
+            self.to_date
+        )
+
     @property
     def to_date(self):
         return self.__to_date
@@ -106,123 +214,324 @@ class Netbank:
                     "{0} does not match {1}".format(to_date, self.date_fmt)
                 )
 
+    @metrics.timed('login')
     def login(self):
+        self.throttle()
         self.driver.get(self.login_url)
-        user_field = self.driver.find_element_by_id('txtMyClientNumber_field')
-        password_field = self.driver.find_element_by_id('txtMyPassword_field')
-        submit_button = self.driver.find_element_by_id('btnLogon_field')
+        user_field = locators.find(self.driver, 'netbank.username')
+        password_field = locators.find(self.driver, 'netbank.password')
+        submit_button = locators.find(self.driver, 'netbank.logon')
         user_field.send_keys(self.username)
         password_field.send_keys(self.password)
         submit_button.click()
         self.homepage = self.driver.current_url
 
+    def authenticated(self):
+        """Return True if the browser is still logged in from an earlier
+        run, leaving it on the portfolio page."""
+        homepage = self.bd.meta.get('homepage')
+        if not homepage:
+            return False
+        self.driver.get(homepage)
+        if locators.first(self.driver, 'netbank.username') is not None:
+            return False
+        self.homepage = self.driver.current_url
+        return True
+
+    def ensure_login(self):
+        """Log in unless the browser's session is still authenticated."""
+        if self.authenticated():
+            logger.info('Reusing authenticated Netbank session')
+        else:
+            self.login()
+
+    def throttle(self):
+        """Wait for this host's turn when sharing a rate limiter."""
+        if self.limiter is not None:
+            self.limiter.wait(self.login_url)
+
+    def close(self):
+        self.bd.quit(homepage=getattr(self, 'homepage', None))
+
+    @metrics.timed('get_accounts')
     def get_accounts(self):
-        """Account information in the form of a dict of tuples."""
+        """Account information in the form of a dict of tuples.
 
-        # Use WebDriverWait to wait for the presence of the portfolio table.
-        # This was taking a bit too long to render sometimes and selenium would
-        # throw an exception not being able to find the element in time.
-        WebDriverWait(self.driver, self.sleep).until(
-            EC.presence_of_element_located(
-                (By.XPATH, '//*[@id="StartMainContent"]/div/div[2]/div[1]/main/section[1]/div/div[1]')
-            )
-        )
+        The whole portfolio table is read with a single execute_script call
+        rather than a find_element/get_attribute round trip per field, or
+        not at all when it was read within portfolio_ttl seconds.
+        """
 
         account = namedtuple(
             'account',
-            'name balance available href filename account_type'
+            'name balance available href filename account_type from_date'
         )
 
-        accounts = {}
-        count = 1
-        while True:
-            account_type = None
-
-            try:
-                self.driver.find_element_by_xpath('//*[@id="StartMainContent"]/div/div[2]/div[1]/main/section[1]/div/div[1]/div[{0}]'.format(count))
-            except NoSuchElementException:
-                break
+        rows = self.portfolio_rows()
 
-            name = self.driver.find_element_by_xpath('//*[@id="StartMainContent"]/div/div[2]/div[1]/main/section[1]/div/div[1]/div[{0}]/div/div[1]/div[2]/div/div/div/a/h3'.format(count))
+        accounts = {}
+        for row in rows:
+            name = row.get('name')
+            if name is None:
+                if self.debug:
+                    print("DEBUG1: skipping incomplete row {0}".format(row))
+                continue
 
-            if name.get_attribute('title').lower() == 'commsec shares':
-                count += 1
+            if name.lower() == 'commsec shares':
                 continue
 
-            if name.get_attribute('title').lower() == 'home loan':
-                account_type = AccountType.HOME_LOAN
-            elif name.get_attribute('title').lower() == 'complete access':
-                account_type = AccountType.COMPLETE_ACCESS
-            elif name.get_attribute('title').lower() == 'mastercard platinum':
-                account_type = AccountType.CREDIT_CARD
-            elif name.get_attribute('title').lower() == 'misa':
-                account_type = AccountType.MISA
+            account_type = ACCOUNT_TYPES.get(name.lower())
 
             if self.only_home_loans and account_type != AccountType.HOME_LOAN:
-                count += 1
                 continue
 
-            number = self.driver.find_element_by_xpath('//*[@id="StartMainContent"]/div/div[2]/div[1]/main/section[1]/div/div[1]/div[{0}]/div/div[1]/div[2]/div/div/span/div'.format(count))
-            balance = self.driver.find_element_by_xpath('//*[@id="StartMainContent"]/div/div[2]/div[1]/main/section[1]/div/div[1]/div[{0}]/div/div[1]/div[2]/div/ul/li[1]/span[2]'.format(count))
-            available = self.driver.find_element_by_xpath('//*[@id="StartMainContent"]/div/div[2]/div[1]/main/section[1]/div/div[1]/div[{0}]/div/div[1]/div[2]/div/ul/li[2]/span[2]'.format(count))
-            href = self.driver.find_element_by_xpath('//*[@id="StartMainContent"]/div/div[2]/div[1]/main/section[1]/div/div[1]/div[{0}]/div/div[1]/div[2]/div/div/div/a'.format(count))
-
             # Remove all non-digits from account number
-            accountnumber = ''.join(filter(str.isdigit, number.text))
+            accountnumber = ''.join(filter(str.isdigit, row.get('number') or ''))
 
             if accounts.get(accountnumber):
-                count += 1
                 continue
 
-            filename = banalutil.filename(
-                accountnumber, self.from_date, self.to_date
-            )
+            from_date = self.account_from_date(accountnumber)
+            filename = os.path.join(self.output_dir, banalutil.filename(
+                accountnumber, from_date, self.to_date
+            ))
 
             if self.debug:
                 print(
                     "DEBUG1: {0},{1},{2},{3},{4},{5},{6}".format(
-                        name.get_attribute('title'),
+                        name,
                         accountnumber,
-                        balance.get_attribute('title'),
-                        available.get_attribute('title'),
-                        href.get_attribute('href'),
+                        row.get('balance'),
+                        row.get('available'),
+                        row.get('href'),
                         filename,
                         account_type
                     )
                 )
 
             accounts[accountnumber] = account(
-                name=name.get_attribute('title'),
-                balance=balance.get_attribute('title'),
-                available=available.get_attribute('title'),
-                href=href.get_attribute('href'),
+                name=name,
+                balance=row.get('balance'),
+                available=row.get('available'),
+                href=row.get('href'),
                 filename=filename,
-                account_type=account_type
+                account_type=account_type,
+                from_date=from_date
             )
 
-            count += 1
-
         return accounts
 
+    def portfolio_rows(self):
+        """Return the rows of the portfolio table, from the state store if
+        they were read less than portfolio_ttl seconds ago."""
+        login = hashlib.sha256(self.username.encode()).hexdigest()
+        self.portfolio_cached = False
+        if self.state is not None and self.portfolio_ttl:
+            rows = self.state.portfolio(login, self.portfolio_ttl)
+            if rows is not None:
+                self.portfolio_cached = True
+                metrics.inc('portfolio_cache_hits')
+                logger.info('Using the portfolio read in the last {0}s'.format(
+                    self.portfolio_ttl
+                ))
+                return rows
+
+        # Wait for the presence of the portfolio table.
+        # This was taking a bit too long to render sometimes and selenium would
+        # throw an exception not being able to find the element in time.
+        table = self.wait.until(
+            'portfolio', locators.present('netbank.portfolio')
+        )
+        rows = self.driver.execute_script(
+            PORTFOLIO_SCRIPT, table, PORTFOLIO_FIELDS
+        ) or []
+
+        saved = self.legacy_command_count(rows) - 2
+        metrics.inc('webdriver_commands_saved', saved, step='get_accounts')
+        logger.info(
+            'Read {0} portfolio rows in 2 WebDriver commands, saving {1}'.format(
+                len(rows), saved
+            )
+        )
+        if self.state is not None:
+            self.state.save_portfolio(login, rows)
+        return rows
+
+    def legacy_command_count(self, rows):
+        """Return the number of WebDriver commands the per-field XPath walk
+        of the portfolio table would have issued for rows."""
+        # The initial WebDriverWait plus the probe that ends the walk.
+        commands = 2
+        seen = set()
+        for row in rows:
+            # Row probe, name lookup and the 'commsec shares' title check.
+            commands += 3
+            name = (row.get('name') or '').lower()
+            if name == 'commsec shares':
+                continue
+            # The if/elif chain calls get_attribute('title') until it matches.
+            types = list(ACCOUNT_TYPES)
+            commands += types.index(name) + 1 if name in types else len(types)
+            if (self.only_home_loans and
+                    ACCOUNT_TYPES.get(name) != AccountType.HOME_LOAN):
+                continue
+            # number, balance, available and href lookups plus number.text.
+            commands += 5
+            number = ''.join(filter(str.isdigit, row.get('number') or ''))
+            if number in seen:
+                continue
+            seen.add(number)
+            # get_attribute calls building the record, and again for DEBUG1.
+            commands += 8 if self.debug else 4
+        return commands
+
     def logout(self):
-        attempts = 0
-        while attempts < self.retry:
-            attempts += 1
+        def click():
+            logout = self.wait.until(
+                'logout', locators.present('netbank.logout'), optional=True
+            )
+            if logout is not None:
+                logout.click()
+
+        try:
+            self.wait.call(
+                'logout', click, StaleElementReferenceException,
+                deadline=self.sleep
+            )
+        except StaleElementReferenceException:
+            pass
+
+    @metrics.timed('spawn')
+    def spawn(self):
+        """Return a new Netbank session sharing this one's login.
+
+        The authenticated cookies are copied into a fresh browser so the
+        new session can visit account pages without logging in again.
+        """
+        worker = Netbank(
+            self.username, self.password, self.sleep, self.retry,
+            **self.kwargs
+        )
+        try:
+            worker.adopt_session(self.driver.get_cookies(), self.homepage)
+        except WebDriverException:
+            worker.close()
+            raise
+        return worker
+
+    def adopt_session(self, cookies, homepage):
+        # Cookies can only be set for the domain currently loaded.
+        self.driver.get(homepage)
+        for cookie in cookies:
+            cookie.pop('sameSite', None)
+            self.driver.add_cookie(cookie)
+        self.homepage = homepage
+
+    def download_account(self, accountnumber, data):
+        """Export the OFX file for a single account from get_accounts."""
+        self.throttle()
+        if self.http_export:
             try:
-                logout = WebDriverWait(self.driver, self.sleep).until(
-                    EC.presence_of_element_located(
-                        (By.XPATH, '//*[@id=header]/div[2]/nav/div[1]/ul/li[3]')
-                    )
+                with metrics.span('http_export', account=accountnumber):
+                    self.export_account(data)
+            except ExportError as e:
+                logger.warning(
+                    'HTTP export of {0} failed, using the browser: {1}'.
+                    format(accountnumber, e)
                 )
-            except TimeoutException:
-                break
+            else:
+                self.downloaded(accountnumber, data)
+                return
 
-            try:
-                logout.click()
-            except StaleElementReferenceException:
-                pass
+        with metrics.span('navigate', account=accountnumber):
+            self.navigate(accountnumber, data)
+        with metrics.span('download_ofx', account=accountnumber):
+            self.download_ofx(data.filename, data.account_type)
+        self.downloaded(accountnumber, data)
+
+    def navigate(self, accountnumber, data):
+        """Load the pages the planner routes to the export of data.
+
+        The next account is loaded from its href, so there is no need to
+        go back to the homepage after each one.
+        """
+        home_loan = data.account_type == AccountType.HOME_LOAN
+        route = self.planner.route(accountnumber, data.href, home_loan)
+        loads = self.follow(accountnumber, data, route)
+        if route[0].target != data.href and not self.has_export():
+            # The learnt page no longer has the export, go the long way.
+            logger.info('Forgetting the transactions page of {0}'.format(
+                accountnumber
+            ))
+            self.planner.forget(accountnumber)
+            loads += self.follow(
+                accountnumber, data,
+                self.planner.route(accountnumber, data.href, home_loan)
+            )
+        self.planner.visited(loads, home_loan)
+
+    def has_export(self):
+        """Return whether the export shows up on the current page.
+
+        Given the full timeout, as a page that is merely slower than
+        usual must not make the planner forget it.
+        """
+        try:
+            self.wait.until('export', locators.present('netbank.export'))
+        except TimeoutException:
+            return False
+        return True
+
+    def follow(self, accountnumber, data, route):
+        for action, target in route:
+            if action == 'get':
+                with metrics.span('access_account', account=accountnumber):
+                    self.driver.get(target)
             else:
-                break
+                with metrics.span('view_transactions',
+                                  account=accountnumber):
+                    self.view_transactions()
+                if self.driver.current_url != data.href:
+                    self.planner.learn(accountnumber, self.driver.current_url)
+        return len(route)
+
+    def downloaded(self, accountnumber, data):
+        metrics.inc(
+            'downloaded_bytes', os.path.getsize(data.filename),
+            account=accountnumber
+        )
+        if self.archive is not None:
+            self.archive.add(
+                accountnumber, data.filename, data.from_date, self.to_date
+            )
+        if self.columns is not None:
+            self.columns.append(accountnumber, data.filename)
+        self.mark_synced(accountnumber, data)
+
+    def mark_synced(self, accountnumber, data):
+        if self.state is not None:
+            self.state.mark_synced(
+                accountnumber, self.to_date,
+                ofx.latest_fitid(data.filename)
+            )
+
+    def export_account(self, data, to_date=None):
+        """Request the OFX export for data over HTTP without the browser.
+
+        Exports from data.from_date to to_date, today by default, and may
+        be called from several threads at once.
+        """
+        with self.exporter_lock:
+            if self.exporter is None:
+                self.exporter = HttpExporter(
+                    self.driver, self.date_fmt, proxy=self.proxy,
+                    timeout=self.sleep
+                )
+        self.exporter.export(
+            data, data.from_date, to_date or self.to_date,
+            complete_access=data.account_type == AccountType.COMPLETE_ACCESS,
+            home_loan=data.account_type == AccountType.HOME_LOAN
+        )
 
     def access_homepage(self):
         self.driver.get(self.homepage)
@@ -234,114 +543,103 @@ class Netbank:
         """ Click the view transctions link within the Home Loan
         accounts page
 
-        Non Home Loan accounts dont have this link.
+        Non Home Loan accounts dont have this link, and the planner only
+        routes home loans through it, so it has to be there.
         """
-        attempts = 0
-        while (attempts < self.retry):
-            attempts += 1
-            try:
-                search_elem = WebDriverWait(self.driver, self.sleep).until(
-                    EC.presence_of_element_located(
-                        (By.XPATH, '//*[@id="lnk-transactions-viewAll"]')
-
-                    )
-                )
-            except TimeoutException:
-                break
+        def click():
+            self.wait.until(
+                'view_transactions',
+                locators.present('netbank.view_transactions')
+            ).click()
 
-            try:
-                search_elem.click()
-            except StaleElementReferenceException:
-                pass
-            else:
-                break
-
-    def download_ofx(self, filename, account_type):
-        attempts = 0
-        while (attempts < self.retry):
-            attempts += 1
-            try:
-                element_xpath = '//*[@id="ctl00_CustomFooterContentPlaceHolder_updatePanelExport1"]/div'
-                if account_type == AccountType.COMPLETE_ACCESS:
-                    element_xpath = '//*[@id="export-link"]'
-                export_elem = WebDriverWait(self.driver, self.sleep).until(
-                    EC.presence_of_element_located(
-                        (
-                            By.XPATH,
-                            element_xpath
-                        )
-                    )
-                )
-            except (
-                NoSuchElementException,
-                WebDriverException,
-                TimeoutException
-            ) as e:
-                if self.debug:
-                    print(e)
-
-                if attempts == self.retry:
-                    if not self.debug:
-                        session.logout()
-                        self.driver.quit()
-                    raise NetbankError("Unable to find export element")
-            else:
-                export_elem.click()
-                break
-
-        """
         try:
-            export_type_elem = Select(
-                self.driver.find_element_by_xpath(
-                    '//*[@id="ctl00_CustomFooterContentPlaceHolder_ddlExportType1_field"]'
-
-                )
+            self.wait.call(
+                'view_transactions', click, StaleElementReferenceException,
+                deadline=2 * self.sleep
             )
-        except (NoSuchElementException, WebDriverException) as e:
-            print(e)
-        else:
-            export_type_elem.select_by_value('OFX')
-        """
+        except StaleElementReferenceException:
+            pass
+        except TimeoutException:
+            raise NetbankError('Unable to find the view transactions link')
 
+    def download_ofx(self, filename, account_type):
+        directory = self.downloads.prepare(os.path.basename(filename))
         try:
+            # Complete Access accounts have their own export widgets.
+            prefix = 'netbank.'
             if account_type == AccountType.COMPLETE_ACCESS:
-                export_type_elem = self.driver.find_element_by_xpath(
-                    '//*[@id="export-format-type"]/div/div[2]/label'
+                prefix = 'netbank.ca_'
+
+            def click():
+                self.wait.until(
+                    'export', locators.present(prefix + 'export')
+                ).click()
+
+            try:
+                self.wait.call(
+                    'export', click,
+                    (NoSuchElementException, WebDriverException),
+                    deadline=2 * self.sleep
                 )
-            else:
+            except (NoSuchElementException, WebDriverException) as e:
+                logger.debug('Failed to click export: {0}'.format(e))
+                raise NetbankError("Unable to find export element")
+
+            """
+            try:
                 export_type_elem = Select(
                     self.driver.find_element_by_xpath(
                         '//*[@id="ctl00_CustomFooterContentPlaceHolder_ddlExportType1_field"]'
 
                     )
                 )
-        except (NoSuchElementException, WebDriverException) as e:
-            print(e)
-        else:
-            if account_type == AccountType.COMPLETE_ACCESS:
-                export_type_elem.click()
+            except (NoSuchElementException, WebDriverException) as e:
+                print(e)
             else:
                 export_type_elem.select_by_value('OFX')
+            """
+
+            try:
+                if account_type == AccountType.COMPLETE_ACCESS:
+                    export_type_elem = locators.find(
+                        self.driver, prefix + 'export_type'
+                    )
+                else:
+                    export_type_elem = Select(
+                        locators.find(self.driver, prefix + 'export_type')
+                    )
+            except (NoSuchElementException, WebDriverException) as e:
+                logger.warning(
+                    'Unable to select the OFX export: {0}'.format(e)
+                )
+            else:
+                if account_type == AccountType.COMPLETE_ACCESS:
+                    export_type_elem.click()
+                else:
+                    export_type_elem.select_by_value('OFX')
 
 
-        try:
-            submit_button_xpath = '//*[@id="ctl00_CustomFooterContentPlaceHolder_lbExport1"]'
-            if account_type == AccountType.COMPLETE_ACCESS:
-                submit_button_xpath = '//*[@id="txnListExport-submit-btn"]'
-            submit_button = self.driver.find_element_by_xpath(submit_button_xpath)
-        except (NoSuchElementException, WebDriverException) as e:
-            print(e)
-        else:
-            submit_button.click()
+            try:
+                submit_button = locators.find(
+                    self.driver, prefix + 'export_submit'
+                )
+            except (NoSuchElementException, WebDriverException) as e:
+                logger.warning(
+                    'Unable to find the export button: {0}'.format(e)
+                )
+            else:
+                submit_button.click()
 
-        ofxdata_filename = 'OFXData.ofx'
-        count = 1
-        while not os.path.exists(ofxdata_filename):
-            time.sleep(1)
-            if count > self.retry:
+            start = time.monotonic()
+            try:
+                path = self.downloads.wait(directory, self.retry)
+            except DownloadTimeout:
                 raise NetbankError(
                     "Unable to find file {0}".
                     format(filename)
                 )
-            count += 1
-        shutil.move(ofxdata_filename, filename)
+            self.wait.record('download', time.monotonic() - start)
+            shutil.move(path, filename)
+        finally:
+            # Also on failure, so a half finished download is not left.
+            self.downloads.release(directory)
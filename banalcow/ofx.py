@@ -0,0 +1,239 @@
+import re
+from collections import namedtuple
+
+
+OPEN = '<STMTTRN>'
+CLOSE = '</STMTTRN>'
+# Tags that end a transaction when a bank leaves out the closing </STMTTRN>.
+ENDS = (CLOSE, OPEN, '</BANKTRANLIST>')
+
+# Latin-1 maps every byte to a character so files round trip unchanged
+# whatever charset their header claims.
+ENCODING = 'latin-1'
+
+LEAF = re.compile(r'<([A-Z0-9.]+)>([^<\r\n]*)')
+DTSTART = re.compile(r'(<DTSTART>)([^<\r\n]*)')
+# A message set aggregate, such as BANKMSGSRSV1 or CREDITCARDMSGSRSV1.
+MESSAGE_SET = re.compile(r'<([A-Z]+MSGSRSV\d+)>(.*?)</\1>', re.DOTALL)
+
+transaction = namedtuple('transaction', 'fitid posted text')
+
+
+def fields(text):
+    """Return the leaf elements of an OFX fragment as a dict."""
+    return {
+        tag: value.strip() for tag, value in LEAF.findall(text)
+        if value.strip()
+    }
+
+
+def make_transaction(text):
+    values = fields(text)
+    return transaction(
+        fitid=values.get('FITID'),
+        posted=values.get('DTPOSTED', '')[:8] or None,
+        text=text
+    )
+
+
+def _end(buf):
+    """Return where the transaction at the start of buf ends, or -1."""
+    best = -1
+    for tag in ENDS:
+        i = buf.find(tag, len(OPEN))
+        if i < 0:
+            continue
+        if tag == CLOSE:
+            i += len(CLOSE)
+        if best < 0 or i < best:
+            best = i
+    return best
+
+
+def segments(f, chunk_size=65536):
+    """Stream an OFX file as text segments and transaction records.
+
+    Yields str for everything outside a STMTTRN aggregate and a
+    transaction for each STMTTRN, reading chunk_size characters at a time
+    so only one transaction is held in memory.
+    """
+    buf = ''
+    inside = False
+    while True:
+        chunk = f.read(chunk_size)
+        buf += chunk
+        while True:
+            if not inside:
+                i = buf.find(OPEN)
+                if i < 0:
+                    break
+                if i:
+                    yield buf[:i]
+                buf = buf[i:]
+                inside = True
+            else:
+                i = _end(buf)
+                if i < 0:
+                    break
+                yield make_transaction(buf[:i])
+                buf = buf[i:]
+                inside = False
+        if not chunk:
+            break
+        if not inside and len(buf) >= len(OPEN):
+            # Keep enough of the tail to match an opening tag split across
+            # chunks.
+            keep = len(OPEN) - 1
+            yield buf[:-keep]
+            buf = buf[-keep:]
+    if buf:
+        if inside:
+            yield make_transaction(buf)
+        else:
+            yield buf
+
+
+def transactions(filename):
+    """Yield every transaction in an OFX file."""
+    with open(filename, encoding=ENCODING, newline='') as f:
+        for segment in segments(f):
+            if isinstance(segment, transaction):
+                yield segment
+
+
+def latest_fitid(filename):
+    """Return the FITID of the most recently posted transaction."""
+    latest = None
+    for txn in transactions(filename):
+        if txn.fitid and (latest is None or
+                          (txn.posted or '') >= (latest.posted or '')):
+            latest = txn
+    return latest.fitid if latest else None
+
+
+def filter_new(filename, out_filename, seen, batch=500):
+    """Copy filename to out_filename leaving out transactions already seen.
+
+    seen is called with a list of FITIDs and returns the set of those
+    already imported. It is called once per batch transactions. Returns
+    the list of new transactions written.
+    """
+    new = []
+    written = set()
+    pending = []
+
+    def flush(out):
+        fitids = [s.fitid for s in pending if isinstance(s, transaction)]
+        known = seen(fitids) if fitids else set()
+        for segment in pending:
+            if not isinstance(segment, transaction):
+                out.write(segment)
+            elif segment.fitid not in known and segment.fitid not in written:
+                out.write(segment.text)
+                new.append(segment._replace(text=None))
+                if segment.fitid:
+                    written.add(segment.fitid)
+        del pending[:]
+
+    with open(filename, encoding=ENCODING, newline='') as f, \
+            open(out_filename, 'w', encoding=ENCODING, newline='') as out:
+        count = 0
+        for segment in segments(f):
+            pending.append(segment)
+            if isinstance(segment, transaction):
+                count += 1
+                if count % batch == 0:
+                    flush(out)
+        flush(out)
+
+    return new
+
+
+def merge(filenames, out_filename):
+    """Combine several OFX files into one with a statement per file.
+
+    The header and sign on response of the first file are kept, followed
+    by one message set of each type holding the statement responses of
+    every file, as an OFX file may have only one of each.
+    """
+    signon_end = '</SIGNONMSGSRSV1>'
+    header, newline = None, '\n'
+    message_sets = {}
+    for filename in filenames:
+        with open(filename, encoding=ENCODING, newline='') as f:
+            text = f.read()
+        start = text.find(signon_end)
+        end = text.rfind('</OFX>')
+        if start < 0 or end < 0:
+            raise ValueError('{0} is not an OFX file'.format(filename))
+        start += len(signon_end)
+        if header is None:
+            header = text[:start]
+            if '\r\n' in header:
+                newline = '\r\n'
+        found = MESSAGE_SET.findall(text, start, end)
+        if not found:
+            raise ValueError('{0} has no statements'.format(filename))
+        for name, responses in found:
+            message_sets.setdefault(name, []).append(responses.strip())
+    if header is None:
+        raise ValueError('No OFX files to merge')
+
+    with open(out_filename, 'w', encoding=ENCODING, newline='') as out:
+        out.write(header)
+        for name, responses in message_sets.items():
+            out.write('{1}<{0}>{1}{2}{1}</{0}>'.format(
+                name, newline, newline.join(responses)
+            ))
+        out.write('{0}</OFX>{0}'.format(newline))
+
+
+def merge_unique(filenames, out_filename):
+    """Combine OFX files for one account into a single statement.
+
+    The last file, usually the most recent, provides the header, balances
+    and closing tags. The transactions of every file are streamed into
+    its transaction list in order, each FITID only once, and DTSTART is
+    moved back to the earliest file's. Returns the number of
+    transactions written.
+    """
+    head, tail = [], []
+    found = False
+    with open(filenames[-1], encoding=ENCODING, newline='') as f:
+        for segment in segments(f):
+            if isinstance(segment, transaction):
+                found = True
+                tail = []
+            else:
+                (tail if found else head).append(segment)
+    prefix = ''.join(head)
+    suffix = ''.join(tail)
+    if not found:
+        list_end = prefix.rfind('</BANKTRANLIST>')
+        if list_end < 0:
+            raise ValueError('{0} is not an OFX file'.format(filenames[-1]))
+        prefix, suffix = prefix[:list_end], prefix[list_end:]
+
+    starts = []
+    for filename in filenames:
+        with open(filename, encoding=ENCODING, newline='') as f:
+            dtstart = DTSTART.search(f.read(4096))
+        if dtstart:
+            starts.append(dtstart.group(2).strip())
+    if starts:
+        prefix = DTSTART.sub(
+            lambda m: m.group(1) + min(starts), prefix, count=1
+        )
+
+    written = set()
+    with open(out_filename, 'w', encoding=ENCODING, newline='') as out:
+        out.write(prefix)
+        for filename in filenames:
+            for txn in transactions(filename):
+                key = txn.fitid or txn.text
+                if key in written:
+                    continue
+                written.add(key)
+                out.write(txn.text)
+        out.write(suffix)
+    return len(written)
@@ -1,11 +1,20 @@
 from urllib.parse import urljoin
 from collections import namedtuple
 import os
-from banalcow.driver import BanalDriver
+import threading
+import requests
+from banalcow import httputil
+from banalcow.metrics import metrics
+
+
+class PennyError(Exception):
+    pass
 
 
 class Penny:
 
+    max_workers = 1
+
     def __init__(self, base_url, username, password,
                  chrome_driver_executable_path, **kwargs):
         self.base_url = base_url
@@ -13,46 +22,218 @@ class Penny:
         self.password = password
         self.chrome_driver_executable_path = chrome_driver_executable_path
         self.proxy = kwargs.get('proxy')
+        self.sleep = kwargs.get('sleep', 30)
+        self.retry = kwargs.get('retry', 10)
+        self.daemon = kwargs.get('daemon')
+        self.performance = kwargs.get('performance', False)
+        self.blocked_urls = kwargs.get('blocked_urls')
+        self.limiter = kwargs.get('limiter')
+        self.engine = kwargs.get('engine')
+        self.chrome_binary = kwargs.get('chrome_binary')
 
-        bd = BanalDriver(
+        # Selenium is imported by the browser session only, so uploads
+        # over HTTP never load it.
+        from selenium.common.exceptions import WebDriverException
+        from banalcow.driver import BanalDriver
+        from banalcow.wait import Waiter
+        # What a failed upload raises.
+        self.errors = (PennyError, WebDriverException)
+        self.bd = BanalDriver(
             proxy=self.proxy,
-            chrome_driver_executable_path=self.chrome_driver_executable_path
+            chrome_driver_executable_path=self.chrome_driver_executable_path,
+            daemon=self.daemon,
+            name='penny',
+            performance=self.performance,
+            blocked_urls=self.blocked_urls,
+            engine=self.engine,
+            chrome_binary=self.chrome_binary
         )
-        self.driver = bd.driver
+        self.driver = self.bd.driver
+        self.wait = Waiter(self.driver, self.sleep, self.retry)
 
     @property
     def url(self):
-        _urls = namedtuple('urls', 'login transactions_import logout')
-        return _urls(
-            login=urljoin(self.base_url, 'login'),
-            transactions_import=urljoin(self.base_url, 'transactions/import'),
-            logout=urljoin(self.base_url, 'logout'),
-        )
+        return urls(self.base_url)
 
+    @metrics.timed('penny_login')
     def login(self):
+        from banalcow.locators import locators
+        self.throttle()
         self.driver.get(self.url.login)
-        user_field = self.driver.find_element_by_xpath(
-            '/html/body/div/div/div/div/div[2]/form/fieldset/div[1]/input'
-        )
-        password_field = self.driver.find_element_by_xpath(
-            '/html/body/div/div/div/div/div[2]/form/fieldset/div[2]/input'
-        )
-        submit_button = self.driver.find_element_by_xpath(
-            '/html/body/div/div/div/div/div[2]/form/fieldset/input'
-        )
+        user_field = locators.find(self.driver, 'penny.username')
+        password_field = locators.find(self.driver, 'penny.password')
+        submit_button = locators.find(self.driver, 'penny.login')
         user_field.send_keys(self.username)
         password_field.send_keys(self.password)
         submit_button.click()
+        self.wait.until(
+            'penny_login',
+            lambda driver: not driver.current_url.startswith(self.url.login)
+        )
         self.homepage = self.driver.current_url
 
+    def throttle(self):
+        """Wait for this host's turn when sharing a rate limiter."""
+        if self.limiter is not None:
+            self.limiter.wait(self.base_url)
+
+    def authenticated(self):
+        """Return True if the browser is still logged in to Penny."""
+        if not self.bd.meta.get('homepage'):
+            return False
+        self.driver.get(self.url.transactions_import)
+        if self.driver.current_url.startswith(self.url.login):
+            return False
+        self.homepage = self.bd.meta['homepage']
+        return True
+
+    def ensure_login(self):
+        """Log in unless the browser's session is still authenticated."""
+        if not self.authenticated():
+            self.login()
+
     def logout(self):
         self.driver.get(self.url.logout)
 
+    @metrics.timed('penny_upload')
     def upload(self, filename):
+        from selenium.webdriver.support import expected_conditions as EC
+        from banalcow.locators import locators
+        metrics.inc('uploaded_bytes', os.path.getsize(filename))
+        self.throttle()
         self.driver.get(self.url.transactions_import)
-        input_field = self.driver.find_element_by_xpath('//*[@id="upload"]')
-        input_field.send_keys(os.getcwd() + "/" + filename)
-        submit_button = self.driver.find_element_by_xpath(
-            '/html/body/div[1]/div/div[2]/div/div/div/form/div/div/input'
+        input_field = self.wait.until(
+            'penny_import', locators.present('penny.upload')
         )
+        input_field.send_keys(os.path.abspath(filename))
+        submit_button = locators.find(self.driver, 'penny.import')
         submit_button.click()
+        # Let the import request finish before navigating away.
+        self.wait.until('penny_upload', EC.staleness_of(submit_button))
+
+    def close(self):
+        self.bd.quit(homepage=getattr(self, 'homepage', None))
+
+
+class PennyClient:
+    """Upload OFX files to Penny over HTTP without starting a browser.
+
+    Logs in over a pooled requests session, keeps the session cookie and
+    CSRF form state, and posts each file as a multipart request. Uploads
+    may run concurrently from up to max_workers threads.
+    """
+
+    upload_field = 'upload'
+    errors = (PennyError,)
+
+    def __init__(self, base_url, username, password, **kwargs):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.proxy = kwargs.get('proxy')
+        self.timeout = kwargs.get('timeout', 30)
+        self.max_workers = max(1, kwargs.get('max_workers', 4))
+        self.limiter = kwargs.get('limiter')
+        self.session = httputil.pooled_session(self.max_workers)
+        if self.proxy:
+            self.session.proxies = {
+                'http': 'http://{0}'.format(self.proxy),
+                'https': 'http://{0}'.format(self.proxy),
+            }
+        self.lock = threading.Lock()
+        self.import_form = None
+
+    @property
+    def url(self):
+        return urls(self.base_url)
+
+    def request(self, method, url, **kwargs):
+        if self.limiter is not None:
+            self.limiter.wait(url)
+        try:
+            response = self.session.request(
+                method, url, timeout=self.timeout, **kwargs
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise PennyError('{0} {1} failed: {2}'.format(method, url, e))
+        return response
+
+    def form(self, url, match):
+        """Return the action and values of the first form on url for which
+        match(fields) is true."""
+        response = self.request('GET', url)
+        parser = httputil.parse(response.text)
+        for form in parser.forms:
+            if match(form['fields']):
+                action = urljoin(
+                    response.url, form['attrs'].get('action') or response.url
+                )
+                return action, form, httputil.form_values(form)
+        raise PennyError('No matching form on {0}'.format(response.url))
+
+    @metrics.timed('penny_login')
+    def login(self):
+        action, form, data = self.form(
+            self.url.login,
+            lambda fields: any(
+                a.get('type') == 'password' for t, a in fields
+            )
+        )
+        for tag, attrs in form['fields']:
+            kind = attrs.get('type', 'text').lower()
+            if kind in ('text', 'email') and attrs.get('name'):
+                data[attrs['name']] = self.username
+            elif kind == 'password' and attrs.get('name'):
+                data[attrs['name']] = self.password
+        response = self.request('POST', action, data=data)
+        if response.url.rstrip('/') == self.url.login.rstrip('/'):
+            raise PennyError('Failed to login to {0}'.format(self.base_url))
+        self.homepage = response.url
+
+    def logout(self):
+        self.request('GET', self.url.logout)
+
+    @metrics.timed('penny_upload')
+    def upload(self, filename):
+        metrics.inc('uploaded_bytes', os.path.getsize(filename))
+        with self.lock:
+            if self.import_form is None:
+                self.import_form = self.form(
+                    self.url.transactions_import,
+                    lambda fields: any(
+                        a.get('name') == self.upload_field for t, a in fields
+                    )
+                )
+        action, form, data = self.import_form
+        with open(filename, 'rb') as f:
+            response = self.request(
+                'POST', action, data=data,
+                files={
+                    self.upload_field: (
+                        os.path.basename(filename), f,
+                        'application/x-ofx'
+                    )
+                }
+            )
+        # Penny redirects away from the import form once the file is
+        # imported, and shows the form again when it rejects the file.
+        if response.url.rstrip('/') == self.url.login.rstrip('/'):
+            raise PennyError('Logged out of {0}'.format(self.base_url))
+        parser = httputil.parse(response.text)
+        if any(
+                a.get('name') == self.upload_field
+                for form in parser.forms for t, a in form['fields']):
+            raise PennyError('Penny did not import {0}'.format(filename))
+
+    def close(self):
+        self.session.close()
+
+
+def urls(base_url):
+    _urls = namedtuple('urls', 'login transactions_import logout')
+    return _urls(
+        login=urljoin(base_url, 'login'),
+        transactions_import=urljoin(base_url, 'transactions/import'),
+        logout=urljoin(base_url, 'logout'),
+    )
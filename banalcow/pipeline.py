@@ -0,0 +1,178 @@
+import glob
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from banalcow import banalutil, ofx, penny
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+item = namedtuple('item', 'account filename uploaded')
+
+# Put on the queue once per consumer to tell it no more files are coming.
+DONE = None
+
+
+class UploadPipeline:
+    """Upload OFX files to Penny while Netbank is still downloading.
+
+    Netbank workers put each file on a bounded queue as soon as it is
+    downloaded and consumer threads filter and upload it, so the upload
+    of one account overlaps the download of the next. When uploads fall
+    behind, put blocks the downloading worker until there is room.
+
+    connect is called once, from a consumer thread, and returns a logged
+    in Penny or PennyClient. Items that fail, for whatever reason, are
+    logged and left on disk, and the rest carry on. The OFX files already
+    in directory when the pipeline starts, left by a run whose uploads
+    failed, are uploaded first.
+    """
+
+    def __init__(self, connect, store, tmpdir, maxsize=2, archive=None,
+                 directory=None):
+        self.connect = connect
+        self.store = store
+        self.archive = archive
+        self.tmpdir = tmpdir
+        self.directory = directory
+        self.leftovers = []
+        self.queue = queue.Queue(maxsize=max(1, maxsize))
+        self.session = None
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.upload_seconds = 0.0
+        self.workers = 1
+        self.connected = threading.Event()
+        self.thread = threading.Thread(target=self.consume, daemon=True)
+
+    def start(self):
+        self.started = time.monotonic()
+        if self.directory is not None:
+            # Listed before anything new is downloaded into directory.
+            self.leftovers = [
+                item(banalutil.accountnumber(filename), filename, None)
+                for filename in sorted(
+                    glob.glob(os.path.join(self.directory, '*.ofx'))
+                )
+            ]
+            if self.leftovers:
+                logger.info('Uploading {0} files left by the last run'.format(
+                    len(self.leftovers)
+                ))
+        self.thread.start()
+        return self
+
+    def put(self, account, data, uploaded=None):
+        """Queue the file downloaded for account, blocking while the
+        queue is full. uploaded, if given, is called once Penny has the
+        file's transactions."""
+        with metrics.span('pipeline_wait', account=account):
+            self.queue.put(item(account, data.filename, uploaded))
+
+    def consume(self):
+        try:
+            with metrics.span('pipeline_connect'):
+                self.session = self.connect()
+            self.workers = self.session.max_workers
+        except Exception as e:
+            # Every queued item then fails, rather than blocking put.
+            logger.error('Failed to log in to Penny: {0}'.format(e))
+        finally:
+            self.connected.set()
+        threads = [
+            threading.Thread(target=self.worker, daemon=True)
+            for _ in range(self.workers - 1)
+        ]
+        for thread in threads:
+            thread.start()
+        self.worker()
+        for thread in threads:
+            thread.join()
+
+    def worker(self):
+        while True:
+            with self.lock:
+                leftover = self.leftovers.pop(0) if self.leftovers else None
+            if leftover is not None:
+                self.process(leftover)
+                continue
+            next_item = self.queue.get()
+            try:
+                if next_item is DONE:
+                    return
+                self.process(next_item)
+            finally:
+                self.queue.task_done()
+
+    def process(self, next_item):
+        try:
+            self.upload(next_item)
+            if next_item.uploaded is not None:
+                next_item.uploaded()
+        except Exception as e:
+            # A consumer that died would leave downloads blocked on put.
+            logger.error('Failed to upload {0}: {1}'.format(
+                next_item.filename, e
+            ))
+            with self.lock:
+                self.failures[next_item.account] = e
+
+    def upload(self, next_item):
+        if self.session is None:
+            raise penny.PennyError('Not logged in to Penny')
+        account, filename = next_item.account, next_item.filename
+        digest = None
+        if self.archive is not None:
+            digest = self.archive.add(account, filename)
+            if self.archive.uploaded(digest):
+                logger.info('Already imported {0}'.format(filename))
+                os.remove(filename)
+                return
+        new_filename = os.path.join(self.tmpdir, os.path.basename(filename))
+        new = ofx.filter_new(
+            filename, new_filename,
+            lambda fitids: self.store.seen(account, fitids)
+        )
+        if new:
+            logger.info('Uploading {0} new transactions from {1}'.format(
+                len(new), filename
+            ))
+            start = time.monotonic()
+            try:
+                self.session.upload(new_filename)
+            finally:
+                with self.lock:
+                    self.upload_seconds += time.monotonic() - start
+            self.store.add_fitids(account, new)
+        else:
+            logger.info('No new transactions in {0}'.format(filename))
+        if digest is not None:
+            self.archive.mark_uploaded(digest)
+        os.remove(new_filename)
+        os.remove(filename)
+
+    def close(self):
+        """Wait for every queued file to be uploaded and return a dict of
+        accounts that failed mapped to the exception raised for them.
+
+        Call once the downloads are finished. Logs how much sooner the
+        run finished than downloading everything before uploading.
+        """
+        downloaded = time.monotonic() - self.started
+        # The number of consumers is only known once connected.
+        self.connected.wait()
+        for _ in range(self.workers):
+            self.queue.put(DONE)
+        self.thread.join()
+        elapsed = time.monotonic() - self.started
+        saved = max(
+            0.0, downloaded + self.upload_seconds / self.workers - elapsed
+        )
+        metrics.inc('pipeline_seconds_saved', saved)
+        logger.info(
+            'Pipelined uploads finished {0:.1f}s after the downloads, '
+            'saving {1:.1f}s'.format(elapsed - downloaded, saved)
+        )
+        return self.failures
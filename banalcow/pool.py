@@ -0,0 +1,89 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from banalcow.logger import logger
+
+
+class NetbankPool:
+    """Download accounts concurrently over several browser sessions.
+
+    The logged in session is used as the first worker, and up to
+    workers - 1 more are spawned from it sharing its cookies.
+    """
+
+    def __init__(self, session, workers=1):
+        self.session = session
+        self.workers = max(1, workers)
+        self.sessions = [session]
+
+    def start(self, count):
+        """Spawn extra sessions until there are count of them."""
+        extra = min(self.workers, max(1, count)) - len(self.sessions)
+        if extra <= 0:
+            return
+        with ThreadPoolExecutor(max_workers=extra) as executor:
+            futures = [
+                executor.submit(self.session.spawn) for _ in range(extra)
+            ]
+        for future in futures:
+            try:
+                self.sessions.append(future.result())
+            except Exception as e:
+                logger.error('Failed to start worker session: {0}'.format(e))
+
+    def run(self, accounts, done=None):
+        """Download every account and return a dict of accounts that failed
+        mapped to the exception raised for them.
+
+        done, if given, is called with the account and its data from the
+        worker thread as soon as each download finishes. An exception from
+        either fails only that account. The spawned sessions are closed
+        before returning.
+        """
+        try:
+            return self.download(accounts, done)
+        finally:
+            self.close()
+
+    def download(self, accounts, done):
+        self.start(len(accounts))
+
+        work = queue.Queue()
+        for item in accounts.items():
+            work.put(item)
+
+        failures = {}
+        lock = threading.Lock()
+
+        def worker(session):
+            while True:
+                try:
+                    account, data = work.get_nowait()
+                except queue.Empty:
+                    return
+                logger.info('Downloading {0}'.format(account))
+                try:
+                    session.download_account(account, data)
+                    if done is not None:
+                        done(account, data)
+                except Exception as e:
+                    logger.error(
+                        'Failed to download {0}: {1}'.format(account, e)
+                    )
+                    with lock:
+                        failures[account] = e
+
+        with ThreadPoolExecutor(max_workers=len(self.sessions)) as executor:
+            for future in [executor.submit(worker, s) for s in self.sessions]:
+                future.result()
+
+        return failures
+
+    def close(self):
+        """Quit the spawned sessions, leaving the original logged in."""
+        sessions, self.sessions = self.sessions[1:], [self.session]
+        for session in sessions:
+            try:
+                session.close()
+            except Exception as e:
+                logger.error('Failed to close worker session: {0}'.format(e))
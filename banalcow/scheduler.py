@@ -0,0 +1,213 @@
+import collections
+import datetime
+import threading
+import time
+from banalcow import ofx
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+
+
+# Transactions a day assumed for each account type until its own history
+# says otherwise. Types are AccountType names.
+PRIORS = {
+    'COMPLETE_ACCESS': 2.0,
+    'CREDIT_CARD': 1.5,
+    'MISA': 0.1,
+    'HOME_LOAN': 0.05,
+}
+DEFAULT_PRIOR = 0.5
+
+# Days of history the prior counts for when blended with the first
+# download.
+PRIOR_DAYS = 14
+
+
+class RequestBudget:
+    """Allow at most limit bank requests in any window seconds.
+
+    Passed to Netbank as its limiter, so every request it throttles waits
+    here for a free slot, after spacing by an optional inner limiter such
+    as batch.HostLimiter.
+    """
+
+    def __init__(self, limit, window=3600, limiter=None):
+        self.limit = limit
+        self.window = window
+        self.limiter = limiter
+        self.lock = threading.Lock()
+        self.requests = collections.deque()
+
+    def expire(self, now):
+        while self.requests and self.requests[0] <= now - self.window:
+            self.requests.popleft()
+
+    def remaining(self):
+        with self.lock:
+            self.expire(time.monotonic())
+            return self.limit - len(self.requests)
+
+    def free_in(self, n):
+        """Return the seconds until n requests can be made."""
+        with self.lock:
+            now = time.monotonic()
+            self.expire(now)
+            over = len(self.requests) + n - self.limit
+            if over <= 0:
+                return 0
+            if over > len(self.requests):
+                return float('inf')
+            return self.requests[over - 1] + self.window - now
+
+    def wait(self, url):
+        if self.limiter is not None:
+            self.limiter.wait(url)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.expire(now)
+                if len(self.requests) < self.limit:
+                    self.requests.append(now)
+                    return
+                delay = self.requests[0] + self.window - now
+            metrics.inc('budget_wait_seconds', delay)
+            time.sleep(delay)
+
+
+class Scheduler:
+    """Decide which accounts a continuous sync should download, and when.
+
+    Each account's transaction rate starts from the prior for its type
+    and is updated from the transactions every download brings, as a
+    moving average with a half_life in days. An account is due again
+    once per_refresh new transactions are expected, clamped between
+    min_interval and max_interval seconds. Due accounts are downloaded
+    together in one login, most overdue first, as many as the budget
+    has room for.
+    """
+
+    def __init__(self, store, budget, **kwargs):
+        self.store = store
+        self.budget = budget
+        self.per_refresh = kwargs.get('per_refresh', 2)
+        self.min_interval = kwargs.get('min_interval', 3600)
+        self.max_interval = kwargs.get('max_interval', 7 * 86400)
+        self.half_life = kwargs.get('half_life', 30)
+        # Requests a session makes before its first account, the login.
+        self.session_cost = kwargs.get('session_cost', 1)
+        self.lock = threading.Lock()
+
+    def interval(self, rate):
+        if rate <= 0:
+            return self.max_interval
+        return min(self.max_interval, max(
+            self.min_interval, self.per_refresh / rate * 86400
+        ))
+
+    def next_run(self):
+        """Return the seconds until the next account is due and the
+        budget can log in and download it."""
+        schedule = self.store.schedule()
+        if not schedule:
+            # Nothing learnt yet, so every account is due.
+            due = 0
+        else:
+            due = max(0, min(s.due_at for s in schedule) - time.time())
+        return max(due, self.budget.free_in(self.session_cost + 1))
+
+    def select(self, accounts):
+        """Return the accounts from get_accounts that are due, within
+        the budget left after this session's login."""
+        now = time.time()
+        schedule = {s.accountnumber: s for s in self.store.schedule()}
+        due = []
+        for accountnumber, data in accounts.items():
+            s = schedule.get(accountnumber)
+            if s is None:
+                # Never downloaded: due now, ahead of everything else.
+                due.append((float('inf'), self.prior(data), accountnumber))
+            elif s.due_at <= now:
+                overdue = (now - s.due_at) / self.interval(s.rate)
+                due.append((overdue, s.rate, accountnumber))
+        due.sort(reverse=True)
+
+        room = max(0, self.budget.remaining())
+        if len(due) > room:
+            metrics.inc('accounts_deferred', len(due) - room)
+            logger.info('Deferring {0} due accounts to stay in budget'.format(
+                len(due) - room
+            ))
+        chosen = {}
+        for i, (_, rate, accountnumber) in enumerate(due):
+            data = accounts[accountnumber]
+            s = schedule.get(accountnumber)
+            if i < room:
+                chosen[accountnumber] = data
+                # Held back until it downloads, so a failing account is
+                # retried after min_interval rather than on every wake.
+                due_at = now + self.min_interval
+            elif s is None:
+                # Remembered so the next wake knows it is due.
+                due_at = now
+            else:
+                continue
+            self.store.save_schedule(
+                accountnumber, account_type(data), rate,
+                s.downloaded_at if s else None, due_at
+            )
+        return chosen
+
+    def prior(self, data):
+        return PRIORS.get(account_type(data), DEFAULT_PRIOR)
+
+    def downloaded(self, accountnumber, data):
+        """Learn from the transactions of a download and schedule the
+        account's next one."""
+        now = time.time()
+        with self.lock:
+            s = self.store.scheduled(accountnumber)
+            if s is None or s.downloaded_at is None:
+                # Judge a first download by its recent transactions only.
+                days = max(1, min(
+                    self.half_life,
+                    (datetime.datetime.now() - data.from_date).days
+                ))
+                since = datetime.datetime.now() - datetime.timedelta(days)
+                count = new_transactions(data.filename, since)
+                rate = (self.prior(data) * PRIOR_DAYS + count) / \
+                    (PRIOR_DAYS + days)
+            else:
+                since = datetime.datetime.fromtimestamp(s.downloaded_at)
+                days = max((now - s.downloaded_at) / 86400, 1 / 24)
+                count = new_transactions(data.filename, since)
+                weight = 1 - 0.5 ** (days / self.half_life)
+                rate = s.rate * (1 - weight) + count / days * weight
+            interval = self.interval(rate)
+            self.store.save_schedule(
+                accountnumber, account_type(data), rate, now, now + interval
+            )
+        metrics.inc('scheduled_transactions', count, account=accountnumber)
+        logger.info(
+            '{0}: {1} new transactions, {2:.2f} a day, next in {3:.1f}h'
+            .format(accountnumber, count, rate, interval / 3600)
+        )
+
+    def report(self):
+        now = time.time()
+        for s in sorted(self.store.schedule(), key=lambda s: s.due_at):
+            logger.info('{0} {1}: {2:.2f} a day, due in {3:.1f}h'.format(
+                s.accountnumber, s.account_type or 'unknown', s.rate,
+                max(0, s.due_at - now) / 3600
+            ))
+
+
+def account_type(data):
+    return data.account_type.name if data.account_type else None
+
+
+def new_transactions(filename, since):
+    """Return the number of transactions in filename posted after since."""
+    after = since.strftime('%Y%m%d')
+    return sum(
+        1 for txn in ofx.transactions(filename)
+        if txn.posted and txn.posted > after
+    )
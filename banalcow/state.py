@@ -0,0 +1,275 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    accountnumber TEXT PRIMARY KEY,
+    synced_to TEXT NOT NULL,
+    fitid TEXT
+);
+CREATE TABLE IF NOT EXISTS fitids (
+    accountnumber TEXT NOT NULL,
+    fitid TEXT NOT NULL,
+    posted TEXT,
+    PRIMARY KEY (accountnumber, fitid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS backfill (
+    accountnumber TEXT NOT NULL,
+    from_date TEXT NOT NULL,
+    to_date TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (accountnumber, from_date, to_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pages (
+    accountnumber TEXT NOT NULL,
+    page TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (accountnumber, page)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS balances (
+    accountnumber TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    downloaded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schedule (
+    accountnumber TEXT PRIMARY KEY,
+    account_type TEXT,
+    rate REAL NOT NULL,
+    downloaded_at REAL,
+    due_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS portfolios (
+    login TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    rows TEXT NOT NULL
+);
+"""
+
+watermark = namedtuple('watermark', 'synced_to fitid')
+balance = namedtuple('balance', 'fingerprint downloaded_at')
+scheduled = namedtuple(
+    'scheduled', 'accountnumber account_type rate downloaded_at due_at'
+)
+status = namedtuple(
+    'status', 'accountnumber synced_to transactions downloaded_at due_at'
+)
+
+
+class StateStore:
+    """Local SQLite store of what has already been synced per account."""
+
+    date_fmt = '%Y-%m-%d'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def watermark(self, accountnumber):
+        """Return the last synced date and FITID for accountnumber."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT synced_to, fitid FROM watermarks '
+                'WHERE accountnumber = ?', (accountnumber,)
+            ).fetchone()
+        if row is None:
+            return None
+        return watermark(
+            synced_to=datetime.datetime.strptime(row[0], self.date_fmt),
+            fitid=row[1]
+        )
+
+    def mark_synced(self, accountnumber, synced_to, fitid=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO watermarks (accountnumber, synced_to, fitid) '
+                'VALUES (?, ?, ?) ON CONFLICT(accountnumber) DO UPDATE SET '
+                'synced_to = excluded.synced_to, '
+                'fitid = COALESCE(excluded.fitid, watermarks.fitid)',
+                (accountnumber, synced_to.strftime(self.date_fmt), fitid)
+            )
+
+    def seen(self, accountnumber, fitids):
+        """Return the subset of fitids already imported for accountnumber."""
+        found = set()
+        fitids = list(fitids)
+        with self.lock:
+            # Stay well under SQLite's limit on bound parameters.
+            for i in range(0, len(fitids), 500):
+                chunk = fitids[i:i + 500]
+                found.update(row[0] for row in self.conn.execute(
+                    'SELECT fitid FROM fitids WHERE accountnumber = ? '
+                    'AND fitid IN ({0})'.format(','.join('?' * len(chunk))),
+                    [accountnumber] + chunk
+                ))
+        return found
+
+    def add_fitids(self, accountnumber, transactions):
+        """Record transactions from the ofx module as imported."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO fitids (accountnumber, fitid, posted) '
+                'VALUES (?, ?, ?)',
+                (
+                    (accountnumber, t.fitid, t.posted)
+                    for t in transactions if t.fitid
+                )
+            )
+
+    def windows(self, accountnumber):
+        """Return the backfill windows downloaded for accountnumber as a
+        dict of (from_date, to_date) to filename."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT from_date, to_date, filename FROM backfill '
+                'WHERE accountnumber = ?', (accountnumber,)
+            ).fetchall()
+        return {
+            (
+                datetime.datetime.strptime(from_date, self.date_fmt),
+                datetime.datetime.strptime(to_date, self.date_fmt)
+            ): filename
+            for from_date, to_date, filename in rows
+        }
+
+    def add_window(self, accountnumber, from_date, to_date, filename):
+        """Journal a downloaded backfill window."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO backfill '
+                '(accountnumber, from_date, to_date, filename) '
+                'VALUES (?, ?, ?, ?)',
+                (
+                    accountnumber, from_date.strftime(self.date_fmt),
+                    to_date.strftime(self.date_fmt), filename
+                )
+            )
+
+    def forget_window(self, accountnumber, from_date, to_date):
+        """Drop a journalled backfill window so it is downloaded again."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'DELETE FROM backfill WHERE accountnumber = ? AND '
+                'from_date = ? AND to_date = ?',
+                (
+                    accountnumber, from_date.strftime(self.date_fmt),
+                    to_date.strftime(self.date_fmt)
+                )
+            )
+
+    def page(self, accountnumber, page):
+        """Return the URL learnt for page of accountnumber, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT url FROM pages WHERE accountnumber = ? AND page = ?',
+                (accountnumber, page)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_page(self, accountnumber, page, url):
+        """Remember url for page of accountnumber, or forget it if None."""
+        with self.lock, self.conn:
+            if url is None:
+                self.conn.execute(
+                    'DELETE FROM pages WHERE accountnumber = ? AND page = ?',
+                    (accountnumber, page)
+                )
+            else:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO pages (accountnumber, page, url) '
+                    'VALUES (?, ?, ?)', (accountnumber, page, url)
+                )
+
+    def portfolio(self, login, ttl):
+        """Return the portfolio rows saved for login if they are less than
+        ttl seconds old, otherwise None."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT fetched_at, rows FROM portfolios WHERE login = ?',
+                (login,)
+            ).fetchone()
+        if row is None or time.time() - row[0] > ttl:
+            return None
+        return json.loads(row[1])
+
+    def save_portfolio(self, login, rows):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO portfolios (login, fetched_at, rows) '
+                'VALUES (?, ?, ?)', (login, time.time(), json.dumps(rows))
+            )
+
+    def balance(self, accountnumber):
+        """Return the balance fingerprint saved at the last download of
+        accountnumber, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT fingerprint, downloaded_at FROM balances '
+                'WHERE accountnumber = ?', (accountnumber,)
+            ).fetchone()
+        return balance(*row) if row else None
+
+    def save_balance(self, accountnumber, fingerprint):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO balances '
+                '(accountnumber, fingerprint, downloaded_at) '
+                'VALUES (?, ?, ?)', (accountnumber, fingerprint, time.time())
+            )
+
+    def schedule(self):
+        """Return the schedule of every account the scheduler knows."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT accountnumber, account_type, rate, downloaded_at, '
+                'due_at FROM schedule'
+            ).fetchall()
+        return [scheduled(*row) for row in rows]
+
+    def scheduled(self, accountnumber):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT accountnumber, account_type, rate, downloaded_at, '
+                'due_at FROM schedule WHERE accountnumber = ?',
+                (accountnumber,)
+            ).fetchone()
+        return scheduled(*row) if row else None
+
+    def save_schedule(self, accountnumber, account_type, rate, downloaded_at,
+                      due_at):
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO schedule (accountnumber, '
+                'account_type, rate, downloaded_at, due_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (accountnumber, account_type, rate, downloaded_at, due_at)
+            )
+
+    def summary(self):
+        """Return the status of every account the store knows."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT a.accountnumber, w.synced_to, '
+                '(SELECT COUNT(*) FROM fitids f '
+                'WHERE f.accountnumber = a.accountnumber), '
+                'b.downloaded_at, s.due_at FROM ('
+                'SELECT accountnumber FROM watermarks '
+                'UNION SELECT accountnumber FROM fitids '
+                'UNION SELECT accountnumber FROM balances '
+                'UNION SELECT accountnumber FROM schedule) a '
+                'LEFT JOIN watermarks w USING (accountnumber) '
+                'LEFT JOIN balances b USING (accountnumber) '
+                'LEFT JOIN schedule s USING (accountnumber) '
+                'ORDER BY a.accountnumber'
+            ).fetchall()
+        return [status(*row) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
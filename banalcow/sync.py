@@ -0,0 +1,548 @@
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from banalcow import (
+    backfill, banalutil, batch, changes, daemon, ofx, penny, state
+)
+from banalcow.archive import Archive
+from banalcow.config import ConfigError
+from banalcow.logger import logger
+from banalcow.metrics import metrics
+from banalcow.scheduler import RequestBudget, Scheduler
+
+
+upload = namedtuple('upload', 'filename account new_filename new digest')
+
+
+def browser_options(args, conf, warm):
+    """Return the kwargs every Netbank and Penny browser starts with."""
+    return dict(
+        chrome_driver_executable_path=conf.chrome_driver_executable_path,
+        engine=args.engine, chrome_binary=conf.chrome_binary, daemon=warm,
+        performance=args.lean, blocked_urls=conf.blocked_urls
+    )
+
+
+def prelaunch(args, conf, warm):
+    """Start the Netbank browser in the background and return its future,
+    so Selenium loads and Chrome starts while credentials are decrypted."""
+    options = browser_options(args, conf, warm)
+
+    def start():
+        from banalcow import netbank
+        return netbank.start_browser(**options)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        return executor.submit(start)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def prepare_uploads(store, tmpdir, directory='.', archive=None):
+    """Write a copy of each OFX file in directory holding only transactions
+    not yet imported into tmpdir, and return the ones with anything new.
+
+    With an archive, each file is archived first and skipped if Penny has
+    already accepted the same content.
+    """
+    uploads = []
+    for path in Path(directory).glob('*.ofx'):
+        filename = str(path)
+        account = banalutil.accountnumber(filename)
+        digest = None
+        if archive is not None:
+            digest = archive.add(account, filename)
+            if archive.uploaded(digest):
+                logger.info(f'Already imported {filename}')
+                os.remove(filename)
+                continue
+        new_filename = os.path.join(tmpdir, path.name)
+        new = ofx.filter_new(
+            filename, new_filename,
+            lambda fitids: store.seen(account, fitids)
+        )
+        if new:
+            uploads.append(
+                upload(filename, account, new_filename, new, digest)
+            )
+        else:
+            logger.info(f'No new transactions in {filename}')
+            if digest is not None:
+                archive.mark_uploaded(digest)
+            os.remove(filename)
+    return uploads
+
+
+def upload_batches(session, batches, store, archive=None):
+    """Upload each (filename, uploads) batch and return those that failed."""
+    def send(batch):
+        filename, items = batch
+        logger.info(
+            'Uploading {0} new transactions from {1}'.format(
+                sum(len(u.new) for u in items), filename
+            )
+        )
+        try:
+            session.upload(filename)
+        except session.errors as e:
+            logger.error(f'Failed to upload {filename}: {e}')
+            return batch
+        for u in items:
+            store.add_fitids(u.account, u.new)
+            if u.digest is not None:
+                archive.mark_uploaded(u.digest)
+            os.remove(u.filename)
+
+    with ThreadPoolExecutor(max_workers=session.max_workers) as executor:
+        return [b for b in executor.map(send, batches) if b is not None]
+
+
+def connect_penny(args, conf, credentials, warm, limiter=None):
+    """Return a logged in Penny session, over HTTP with --penny-http if
+    that works."""
+    if args.penny_http:
+        client = penny.PennyClient(
+            credentials.base_url, credentials.username, credentials.password,
+            max_workers=args.upload_workers, limiter=limiter
+        )
+        try:
+            client.login()
+            return client
+        except penny.PennyError as e:
+            logger.error(f'HTTP login to Penny failed: {e}')
+            client.close()
+
+    session = penny.Penny(
+        credentials.base_url, credentials.username, credentials.password,
+        sleep=args.sleep, retry=args.retry, limiter=limiter,
+        **browser_options(args, conf, warm)
+    )
+    try:
+        session.ensure_login()
+    except Exception:
+        session.close()
+        raise
+    return session
+
+
+def disconnect_penny(session, warm):
+    # Stay logged in when the browser is kept warm by the daemon.
+    if isinstance(session, penny.Penny) and not warm:
+        session.logout()
+    session.close()
+
+
+def sync_netbank(args, conf, credentials, store, warm, **kwargs):
+    """Download every account of one Netbank login into output_dir and
+    return the accounts found and a dict of those that failed."""
+    from selenium.common.exceptions import WebDriverException
+    from banalcow import netbank, pool
+    uploader = kwargs.get('uploader')
+    scheduler = kwargs.get('scheduler')
+    limiter = kwargs.get('limiter')
+    if scheduler is not None:
+        # Every bank request counts against the scheduler's hourly budget.
+        limiter = scheduler.budget
+    browser = kwargs.get('browser')
+    if browser is not None:
+        # Started by prelaunch while the credentials were decrypted.
+        browser = browser.result()
+    try:
+        session = netbank.Netbank(
+            credentials.username, credentials.password,
+            only_home_loans=args.only_home_loans, retry=args.retry,
+            sleep=args.sleep, debug=args.debug, http_export=args.http_export,
+            state=store, full=args.full, overlap=args.overlap,
+            login_url=conf.netbank_login_url,
+            output_dir=kwargs.get('output_dir', '.'),
+            limiter=limiter, archive=kwargs.get('archive'),
+            columns=kwargs.get('columns'), from_date=args.backfill,
+            portfolio_ttl=args.portfolio_ttl, browser=browser,
+            **browser_options(args, conf, warm)
+        )
+    except netbank.NetbankError:
+        if browser is not None:
+            browser.quit()
+        raise
+
+    try:
+        session.ensure_login()
+    except WebDriverException as e:
+        logger.error('Failed to login')
+        logger.error(traceback.format_exc())
+        session.close()
+        raise netbank.NetbankError('Failed to login to Netbank') from e
+
+    accounts = session.get_accounts()
+    selected = accounts
+    detector = None
+    history = kwargs.get('balances')
+    # Balances from a cached portfolio say nothing about what changed since.
+    if not session.portfolio_cached:
+        if history is not None:
+            history.record(accounts)
+        detector = changes.ChangeDetector(
+            store, refresh=args.refresh_days * 86400
+        )
+        if args.skip_unchanged and not (args.backfill or args.full):
+            selected, _ = detector.split(accounts)
+    if scheduler is not None:
+        selected = scheduler.select(selected)
+
+    def done(account, data):
+        saved = None
+        if detector is not None:
+            def saved():
+                detector.downloaded(account, data)
+        if scheduler is not None:
+            scheduler.downloaded(account, data)
+        if uploader is not None:
+            # Only unchanged once Penny has the transactions, so an
+            # account whose upload fails is downloaded again next run.
+            uploader.put(account, data, uploaded=saved)
+        elif saved is not None:
+            saved()
+
+    if args.backfill:
+        failures = backfill.Backfill(
+            session, store, months=args.window_months,
+            workers=args.backfill_workers
+        ).run(selected, done=done)
+    else:
+        failures = pool.NetbankPool(session, args.workers).run(
+            selected, done=done
+        )
+
+    if session.planner.loads:
+        session.planner.report()
+
+    if failures:
+        logger.error(
+            'Failed to download {0} of {1} accounts: {2}'.format(
+                len(failures), len(selected), ', '.join(failures)
+            )
+        )
+
+    if not args.debug:
+        # Stay logged in when the browser is kept warm by the daemon.
+        if not warm:
+            session.logout()
+        session.close()
+
+    return accounts, failures
+
+
+def sync_penny(args, conf, credentials, store, warm, **kwargs):
+    """Upload the new transactions of the OFX files in directory and
+    return the filenames that failed."""
+    limiter = kwargs.get('limiter')
+    archive = kwargs.get('archive')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        uploads = prepare_uploads(
+            store, tmpdir, kwargs.get('directory', '.'), archive
+        )
+        if uploads and args.merge_uploads:
+            merged = os.path.join(tmpdir, 'merged.ofx')
+            ofx.merge([u.new_filename for u in uploads], merged)
+            batches = [(merged, uploads)]
+        else:
+            batches = [(u.new_filename, [u]) for u in uploads]
+
+        if batches and args.penny_http:
+            client = penny.PennyClient(
+                credentials.base_url, credentials.username,
+                credentials.password, max_workers=args.upload_workers,
+                limiter=limiter
+            )
+            try:
+                client.login()
+                batches = upload_batches(client, batches, store, archive)
+            except penny.PennyError as e:
+                logger.error(f'HTTP upload to Penny failed: {e}')
+            finally:
+                client.close()
+
+        if batches:
+            session = penny.Penny(
+                credentials.base_url, credentials.username,
+                credentials.password, sleep=args.sleep, retry=args.retry,
+                limiter=limiter, **browser_options(args, conf, warm)
+            )
+            session.ensure_login()
+            batches = upload_batches(session, batches, store, archive)
+            if not warm:
+                session.logout()
+            session.close()
+
+        for filename, items in batches:
+            logger.error(f'Failed to upload {filename}')
+        return [filename for filename, items in batches]
+
+
+def sync(args, conf, store, warm, netbank_credentials, penny_credentials,
+         **kwargs):
+    """Download and upload the accounts of one login and return the
+    number of accounts, the downloads that failed and the uploads that
+    failed. Either set of credentials may be None to skip that side."""
+    output_dir = kwargs.get('output_dir', '.')
+    limiter = kwargs.get('limiter')
+    archive = kwargs.get('archive')
+    columns = kwargs.get('columns')
+    balances = kwargs.get('balances')
+    accounts, download_failures, upload_failures = {}, {}, []
+
+    uploader = None
+    if args.pipeline and netbank_credentials and penny_credentials:
+        from banalcow import pipeline
+        # Log in to Penny while Netbank logs in and lists accounts.
+        uploader = pipeline.UploadPipeline(
+            lambda: connect_penny(
+                args, conf, penny_credentials, warm, limiter
+            ),
+            store, tempfile.mkdtemp(), maxsize=args.upload_queue,
+            archive=archive, directory=output_dir
+        ).start()
+
+    try:
+        if netbank_credentials:
+            accounts, download_failures = sync_netbank(
+                args, conf, netbank_credentials, store, warm,
+                uploader=uploader, output_dir=output_dir, limiter=limiter,
+                archive=archive, columns=columns, balances=balances,
+                scheduler=kwargs.get('scheduler'),
+                browser=kwargs.get('browser')
+            )
+    finally:
+        if uploader is not None:
+            failures = uploader.close()
+            for account, e in failures.items():
+                logger.error(f'Failed to upload {account}: {e}')
+            upload_failures = list(failures)
+            if uploader.session is not None:
+                disconnect_penny(uploader.session, warm)
+            shutil.rmtree(uploader.tmpdir)
+
+    if penny_credentials and uploader is None:
+        upload_failures = sync_penny(
+            args, conf, penny_credentials, store, warm,
+            directory=output_dir, limiter=limiter, archive=archive
+        )
+
+    return len(accounts), download_failures, upload_failures
+
+
+def sync_profile(args, conf, profile, **kwargs):
+    """Sync one profile of a --batch run with its own state and archive."""
+    os.makedirs(profile.output_dir, exist_ok=True)
+    store = state.StateStore(profile.state_path)
+    archive = Archive(profile.archive_dir) if args.archive else None
+    try:
+        return sync(
+            args, conf, store, None,
+            conf.netbank_credentials(profile.netbank)
+            if args.netbank else None,
+            conf.penny_credentials(profile.penny)
+            if args.penny and profile.penny else None,
+            output_dir=profile.output_dir, archive=archive, **kwargs
+        )
+    finally:
+        if archive is not None:
+            prune(args, archive)
+            archive.close()
+        store.close()
+
+
+def prune(args, archive):
+    if args.prune_archive is not None:
+        logger.info('Pruned {0} archived files'.format(
+            archive.prune(args.prune_archive)
+        ))
+
+
+def run_batch(args, conf, **kwargs):
+    """Sync every profile in the config, or those named by --profile, and
+    return the number that failed."""
+    profiles = [
+        p for p in conf.profiles
+        if not args.profile or p.name in args.profile
+    ]
+    if not profiles:
+        logger.error('No profiles to sync in {0}'.format(args.config))
+        return 1
+    try:
+        conf.decrypt_all([
+            path for p in profiles
+            for path, wanted in (
+                (p.netbank, args.netbank), (p.penny, args.penny)
+            )
+            if wanted and isinstance(path, str)
+        ])
+    except ConfigError as e:
+        # The profiles using the entry fail with it when they run.
+        logger.error('{0}.'.format(e))
+
+    limiter = batch.HostLimiter(args.host_interval, conf.rate_limits)
+    runner = batch.BatchRunner(
+        lambda profile: sync_profile(
+            args, conf, profile, limiter=limiter, **kwargs
+        ),
+        workers=args.profile_workers
+    )
+    return batch.summary(runner.run(profiles))
+
+
+def stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_schedule(args, conf, store, warm, netbank_credentials,
+                 penny_credentials, **kwargs):
+    """Sync continuously, logging in whenever accounts are due and
+    downloading only those, until interrupted or sent SIGTERM.
+
+    The learnt waits and locators and the metrics are written after
+    every sync, and the metrics started afresh, so a scheduler that runs
+    for months keeps them current without growing.
+    """
+    from selenium.common.exceptions import WebDriverException
+    from banalcow.netbank import NetbankError
+    scheduler = Scheduler(
+        store, RequestBudget(args.requests_per_hour),
+        per_refresh=args.per_refresh,
+        min_interval=args.min_interval * 3600,
+        max_interval=args.max_interval * 86400
+    )
+    previous = signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            delay = scheduler.next_run()
+            if delay:
+                logger.info('Next sync in {0:.0f} minutes'.format(delay / 60))
+                time.sleep(delay)
+            failed = False
+            try:
+                sync(
+                    args, conf, store, warm, netbank_credentials,
+                    penny_credentials, scheduler=scheduler, **kwargs
+                )
+            except (NetbankError, WebDriverException) as e:
+                logger.error('Scheduled sync failed: {0}'.format(e))
+                failed = True
+            except Exception:
+                logger.exception('Scheduled sync failed')
+                failed = True
+            finally:
+                save_stats(args, conf)
+                metrics.reset()
+            if failed:
+                time.sleep(scheduler.min_interval)
+            scheduler.report()
+    except KeyboardInterrupt:
+        logger.info('Stopping the scheduler')
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+def uses_browser(args):
+    return args.netbank or not args.penny_http
+
+
+def save_stats(args, conf):
+    """Write the learnt waits and locators, and the metrics if asked."""
+    if uses_browser(args):
+        from banalcow import wait
+        from banalcow.locators import locators
+        wait.latencies.save(conf.latency_path)
+        locators.save(conf.locator_path)
+    if args.report:
+        metrics.write_json(args.report)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+
+
+def run(args, conf):
+    """Run a download, upload or sync command and return the number of
+    --batch profiles that failed."""
+    store = state.StateStore(conf.state_path)
+    # Locator and wait statistics only matter to a browser.
+    if uses_browser(args):
+        from banalcow import wait
+        from banalcow.locators import locators
+        wait.latencies.load(conf.latency_path)
+        locators.load(conf.locator_path)
+    # Each --batch profile has an archive of its own.
+    archive = Archive(conf.archive_dir) \
+        if args.archive and not args.batch else None
+    columns = balances = None
+    if args.columns:
+        from banalcow.columnar import ColumnStore
+        columns = ColumnStore(conf.columns_dir)
+    if args.balances:
+        from banalcow.balances import BalanceHistory
+        balances = BalanceHistory(conf.balances_dir)
+
+    failed = None
+    if args.batch:
+        if args.daemon:
+            # Warm browsers are leased by name, not by login.
+            logger.warning('Ignoring --daemon in --batch mode')
+        failed = run_batch(args, conf, columns=columns, balances=balances)
+    else:
+        warm = daemon.DaemonClient(conf.daemon_socket) if args.daemon \
+            else None
+        browser = None
+        if args.netbank and not args.schedule:
+            browser = prelaunch(args, conf, warm)
+
+        try:
+            try:
+                conf.prefetch([
+                    name for name in ('netbank', 'penny')
+                    if getattr(args, name)
+                ])
+                penny_conf = conf.penny if args.penny else None
+            except ConfigError as e:
+                logger.error('{0}.'.format(e))
+                sys.exit()
+        except BaseException:
+            if browser is not None and browser.exception() is None:
+                browser.result().quit()
+            raise
+
+        if args.schedule:
+            run_schedule(
+                args, conf, store, warm,
+                conf.netbank if args.netbank else None, penny_conf,
+                archive=archive, columns=columns, balances=balances
+            )
+        else:
+            errors = ()
+            if args.netbank:
+                from banalcow.netbank import NetbankError
+                errors = NetbankError
+            try:
+                sync(
+                    args, conf, store, warm,
+                    conf.netbank if args.netbank else None, penny_conf,
+                    archive=archive, columns=columns, balances=balances,
+                    browser=browser
+                )
+            except errors:
+                sys.exit()
+
+    if archive is not None:
+        prune(args, archive)
+        archive.close()
+    store.close()
+    if not (args.schedule and not args.batch):
+        # The scheduler writes them after every sync.
+        save_stats(args, conf)
+    return failed
@@ -0,0 +1,143 @@
+import collections
+import json
+import random
+import threading
+import time
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+from banalcow.metrics import metrics
+
+
+class Latencies:
+    """Recently observed durations of each named step.
+
+    Shared by every session in the process so a step learnt by one
+    browser benefits the others, and optionally saved between runs.
+    """
+
+    def __init__(self, size=20):
+        self.size = size
+        self.lock = threading.Lock()
+        self.steps = {}
+
+    def record(self, step, seconds):
+        with self.lock:
+            self.steps.setdefault(
+                step, collections.deque(maxlen=self.size)
+            ).append(seconds)
+
+    def recent(self, step):
+        with self.lock:
+            return list(self.steps.get(step, ()))
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for step, values in data.items():
+            for seconds in values[-self.size:]:
+                self.record(step, seconds)
+
+    def save(self, path):
+        with self.lock:
+            data = {step: list(values) for step, values in self.steps.items()}
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+
+latencies = Latencies()
+
+
+class Waiter:
+    """Condition waits and retries shared by Netbank and Penny.
+
+    Each step first waits for factor times the slowest of its recent
+    latencies (at least min_timeout) and only waits on up to the full
+    timeout if that runs out, so fast pages move on at once and only
+    slow steps pay for the ceiling. Retries back off exponentially with
+    jitter and stop at a per step deadline.
+    """
+
+    def __init__(self, driver, timeout, retry, **kwargs):
+        self.driver = driver
+        self.timeout = timeout
+        self.retry = retry
+        self.min_timeout = kwargs.get('min_timeout', 2)
+        self.factor = kwargs.get('factor', 3)
+        self.poll = kwargs.get('poll', 0.1)
+        self.base_delay = kwargs.get('base_delay', 0.25)
+        self.max_delay = kwargs.get('max_delay', 5)
+        self.latencies = kwargs.get('latencies', latencies)
+
+    def learned_timeout(self, step):
+        recent = self.latencies.recent(step)
+        if not recent:
+            return self.timeout
+        return min(
+            self.timeout, max(self.min_timeout, max(recent) * self.factor)
+        )
+
+    def record(self, step, seconds):
+        self.latencies.record(step, seconds)
+
+    def until(self, step, condition, optional=False):
+        """Wait for condition(driver) to return something truthy.
+
+        Raises TimeoutException once the full timeout has passed. An
+        optional condition, one that may never become true, is only given
+        the learned timeout and returns None when that runs out. The time
+        it waited is still recorded, so a step that has become slower
+        than it used to be is given longer next time.
+        """
+        learned = self.learned_timeout(step)
+        start = time.monotonic()
+        try:
+            result = self.wait(condition, learned)
+        except TimeoutException:
+            remaining = self.timeout - (time.monotonic() - start)
+            if optional:
+                self.record(step, time.monotonic() - start)
+                return None
+            if remaining <= 0:
+                raise
+            result = self.wait(condition, remaining)
+        self.record(step, time.monotonic() - start)
+        return result
+
+    def wait(self, condition, timeout):
+        # Conditions with an event() are told when they are met by drivers
+        # that support it, the rest are polled.
+        event = getattr(condition, 'event', None)
+        result = event(self.driver, timeout) if event else None
+        if result is not None:
+            return result
+        return WebDriverWait(
+            self.driver, timeout, poll_frequency=self.poll
+        ).until(condition)
+
+    def backoff(self, attempt):
+        """Return the delay before retry number attempt (from 1)."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def call(self, step, fn, exceptions, attempts=None, deadline=None):
+        """Call fn until it returns without raising one of exceptions.
+
+        Gives up, re-raising the last exception, after attempts calls
+        (self.retry by default) or once deadline seconds have passed.
+        """
+        attempts = attempts or self.retry
+        start = time.monotonic()
+        for attempt in range(1, attempts + 1):
+            try:
+                return fn()
+            except exceptions:
+                delay = self.backoff(attempt)
+                elapsed = time.monotonic() - start
+                if attempt == attempts or (
+                        deadline is not None and elapsed + delay > deadline):
+                    raise
+                metrics.inc('retries', step=step)
+                time.sleep(delay)
@@ -0,0 +1,65 @@
+"""Compare page load time and browser memory with BanalDriver's
+performance profile on and off.
+
+    python benchmarks/driver_profile.py https://www.commbank.com.au/ \
+        --runs 5 --chromedriver /usr/bin/chromedriver
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from banalcow.driver import BanalDriver  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('urls', nargs='+', help='Pages to load')
+    parser.add_argument(
+        '--runs', required=False, default=3, type=int,
+        help='Number of times each page is loaded per profile'
+    )
+    parser.add_argument(
+        '--chromedriver', required=False, default='chromedriver',
+        help='Path to chromedriver'
+    )
+    return parser.parse_args()
+
+
+def measure(urls, runs, chromedriver, performance):
+    bd = BanalDriver(chromedriver, performance=performance)
+    loads = []
+    rss = []
+    try:
+        for _ in range(runs):
+            for url in urls:
+                start = time.perf_counter()
+                bd.driver.get(url)
+                loads.append(time.perf_counter() - start)
+                rss.append(bd.rss())
+    finally:
+        bd.quit()
+    return loads, rss
+
+
+def main():
+    args = parse_args()
+    print('{0:<8} {1:>10} {2:>10} {3:>12} {4:>12}'.format(
+        'profile', 'median s', 'max s', 'median MiB', 'peak MiB'
+    ))
+    for performance in (False, True):
+        loads, rss = measure(
+            args.urls, args.runs, args.chromedriver, performance
+        )
+        print('{0:<8} {1:>10.3f} {2:>10.3f} {3:>12.1f} {4:>12.1f}'.format(
+            'lean' if performance else 'default',
+            statistics.median(loads), max(loads),
+            statistics.median(rss) / 2 ** 20, max(rss) / 2 ** 20
+        ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
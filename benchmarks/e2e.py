@@ -0,0 +1,198 @@
+"""Run the full cli.main flow headless against the fixture server.
+
+Records wall time, WebDriver round trips and peak memory of the Python
+process and every browser it starts, and compares them with a stored
+baseline.
+
+    python benchmarks/e2e.py --chromedriver /usr/bin/chromedriver \
+        --accounts 15 --latency 0.1 --save-baseline baseline.json
+    python benchmarks/e2e.py --baseline baseline.json -- --workers 4
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import yaml  # noqa: E402
+import cli  # noqa: E402
+from banalcow.driver import process_tree_rss  # noqa: E402
+from banalcow.metrics import metrics  # noqa: E402
+from fixture_server import FixtureServer  # noqa: E402
+
+
+# Results where a larger number is a regression.
+MEASURES = ('wall_seconds', 'webdriver_commands', 'peak_rss_bytes')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--chromedriver', required=False, default='chromedriver',
+        help='Path to chromedriver'
+    )
+    parser.add_argument(
+        '--accounts', required=False, default=10, type=int,
+        help='Number of accounts served by the fixture'
+    )
+    parser.add_argument(
+        '--latency', required=False, default=0.0, type=float,
+        help='Seconds the fixture adds to every response'
+    )
+    parser.add_argument(
+        '--download-latency', required=False, default=0.0, type=float,
+        help='Extra seconds the fixture adds to OFX exports'
+    )
+    parser.add_argument(
+        '--runs', required=False, default=3, type=int,
+        help='Number of runs, the median of which is reported'
+    )
+    parser.add_argument(
+        '--baseline', required=False, default=None,
+        help='Compare against the results stored in this file'
+    )
+    parser.add_argument(
+        '--save-baseline', required=False, default=None,
+        help='Store the results in this file'
+    )
+    parser.add_argument(
+        '--tolerance', required=False, default=0.1, type=float,
+        help='Fraction a measure may exceed the baseline by'
+    )
+    parser.add_argument(
+        'cli_args', nargs='*',
+        help='Extra cli.py arguments, given after --'
+    )
+    return parser.parse_args()
+
+
+class PeakMemory:
+    """Sample the memory of this process and its children."""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, process_tree_rss(os.getpid()))
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def write_config(directory, server, chromedriver):
+    path = os.path.join(directory, 'config.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump({
+            'pypass': None,
+            'netbank': {'username': 'fixture', 'password': 'fixture'},
+            'penny': {
+                'base_url': server.penny_url,
+                'username': 'fixture@example.com',
+                'password': 'fixture',
+            },
+            'netbank_login_url': server.login_url,
+            'chrome_driver_executable_path': chromedriver,
+            'state_path': os.path.join(directory, 'banalcow.db'),
+            'latency_path': os.path.join(directory, 'latencies.json'),
+            'locator_path': os.path.join(directory, 'locators.json'),
+        }, f)
+    return path
+
+
+def run(args):
+    server = FixtureServer(
+        accounts=args.accounts, latency=args.latency,
+        download_latency=args.download_latency
+    ).start()
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            config = write_config(directory, server, args.chromedriver)
+            os.chdir(directory)
+            metrics.reset()
+            with PeakMemory() as memory:
+                start = time.perf_counter()
+                cli.main(
+                    ['sync', '--lean', '--config', config] +
+                    args.cli_args
+                )
+                wall = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        server.stop()
+
+    report = metrics.report()
+    return {
+        'wall_seconds': wall,
+        'webdriver_commands': sum(
+            c['value'] for c in report['counters']
+            # Browser round trips, through chromedriver or over DevTools.
+            if c['name'] in ('webdriver_commands', 'cdp_commands')
+        ),
+        'peak_rss_bytes': memory.peak,
+        'fixture_requests': server.fixture.requests,
+        'uploaded_transactions': sum(server.fixture.uploads),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print each measure against the baseline and return the number of
+    regressions."""
+    regressions = 0
+    for measure in MEASURES:
+        old = baseline.get(measure)
+        new = results[measure]
+        if not old:
+            continue
+        change = (new - old) / old
+        regressed = change > tolerance
+        regressions += regressed
+        print('{0:<20} {1:>14.2f} {2:>14.2f} {3:>+8.1%}{4}'.format(
+            measure, old, new, change, '  REGRESSION' if regressed else ''
+        ))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    runs = [run(args) for _ in range(args.runs)]
+    results = {
+        key: statistics.median(r[key] for r in runs) for key in runs[0]
+    }
+    results['settings'] = {
+        'accounts': args.accounts, 'latency': args.latency,
+        'download_latency': args.download_latency,
+        'cli_args': args.cli_args,
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,453 @@
+"""A local stand-in for Netbank and Penny.
+
+Serves pages with the DOM structure Netbank.get_accounts,
+view_transactions, download_ofx and Penny.login/upload expect, the export
+postbacks HttpExporter replays and the forms PennyClient submits. Every
+response can be delayed to mimic a slow bank.
+
+    python benchmarks/fixture_server.py --accounts 15 --latency 0.2
+"""
+import argparse
+import datetime
+import html
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+ACCOUNT_NAMES = [
+    'Complete Access', 'Home Loan', 'MasterCard Platinum', 'MISA',
+]
+
+NETBANK = '/netbank'
+LOGIN = NETBANK + '/Logon/Logon.aspx'
+LOGOUT = NETBANK + '/Logon/Logout.aspx'
+PORTFOLIO = NETBANK + '/Portfolio/Home/Home.aspx'
+ACCOUNT = NETBANK + '/Account/Account.aspx'
+HISTORY = NETBANK + '/TransactionHistory/History.aspx'
+EXPORT = NETBANK + '/api/export'
+PENNY = '/penny/'
+
+
+class Fixture:
+    """State shared by every request: accounts, sessions and uploads."""
+
+    def __init__(self, accounts=4, latency=0.0, download_latency=0.0,
+                 transactions_per_day=1):
+        self.latency = latency
+        self.download_latency = download_latency
+        self.transactions_per_day = transactions_per_day
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.penny_sessions = set()
+        self.uploads = []
+        self.requests = 0
+        # Seconds since the epoch of the first request, for startup.py.
+        self.first_request = None
+        self.accounts = []
+        for i in range(accounts):
+            name = ACCOUNT_NAMES[i % len(ACCOUNT_NAMES)]
+            self.accounts.append({
+                'index': i,
+                'name': name,
+                'number': '06 2000 {0:04d} {1:04d}'.format(i // 10000, i),
+                'balance': '${0:,.2f}'.format(1000 + i * 12.5),
+                'available': '${0:,.2f}'.format(900 + i * 12.5),
+            })
+
+    def digits(self, account):
+        return ''.join(filter(str.isdigit, account['number']))
+
+    def ofx(self, account, from_date=None, to_date=None):
+        to_date = to_date or datetime.date.today()
+        from_date = from_date or to_date - datetime.timedelta(days=365)
+        acctid = self.digits(account)
+        transactions = []
+        day = from_date
+        while day <= to_date:
+            for n in range(self.transactions_per_day):
+                stamp = day.strftime('%Y%m%d')
+                transactions.append(
+                    '<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>{0}\n'
+                    '<TRNAMT>-{1}.{2:02d}\n<FITID>{3}{0}{2}\n'
+                    '<NAME>Payee {4}\n<MEMO>Fixture\n</STMTTRN>'.format(
+                        stamp, day.day, n, acctid, (day.day + n) % 7
+                    )
+                )
+            day += datetime.timedelta(days=1)
+        return (
+            'OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\nSECURITY:NONE\n'
+            'ENCODING:USASCII\nCHARSET:1252\nCOMPRESSION:NONE\n'
+            'OLDFILEUID:NONE\nNEWFILEUID:NONE\n\n'
+            '<OFX>\n<SIGNONMSGSRSV1>\n<SONRS>\n<STATUS>\n<CODE>0\n'
+            '<SEVERITY>INFO\n</STATUS>\n<DTSERVER>{0}\n<LANGUAGE>ENG\n'
+            '</SONRS>\n</SIGNONMSGSRSV1>\n<BANKMSGSRSV1>\n<STMTTRNRS>\n'
+            '<TRNUID>1\n<STATUS>\n<CODE>0\n<SEVERITY>INFO\n</STATUS>\n'
+            '<STMTRS>\n<CURDEF>AUD\n<BANKACCTFROM>\n<BANKID>062000\n'
+            '<ACCTID>{1}\n<ACCTTYPE>CHECKING\n</BANKACCTFROM>\n'
+            '<BANKTRANLIST>\n<DTSTART>{2}\n<DTEND>{3}\n{4}\n'
+            '</BANKTRANLIST>\n<LEDGERBAL>\n<BALAMT>{5}\n<DTASOF>{3}\n'
+            '</LEDGERBAL>\n</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n'
+            '</OFX>\n'
+        ).format(
+            to_date.strftime('%Y%m%d'), acctid, from_date.strftime('%Y%m%d'),
+            to_date.strftime('%Y%m%d'), '\n'.join(transactions),
+            account['balance'].strip('$').replace(',', '')
+        ).encode()
+
+
+def page(title, body, script=''):
+    return (
+        '<!DOCTYPE html><html><head><title>{0}</title>{2}</head>'
+        '<body>{1}</body></html>'.format(title, body, script)
+    ).encode()
+
+
+def portfolio_row(account, href):
+    # Mirrors the nesting the portfolio XPaths in netbank.py walk.
+    return (
+        '<div><div><div><div></div><div><div>'
+        '<div><div><a href="{href}"><h3 title="{name}">{name}</h3></a></div>'
+        '<span><div>{number}</div></span></div>'
+        '<ul><li><span>Balance</span><span title="{balance}">{balance}</span>'
+        '</li><li><span>Available</span>'
+        '<span title="{available}">{available}</span></li></ul>'
+        '</div></div></div></div></div>'
+    ).format(href=href, **{k: html.escape(str(v)) for k, v in account.items()})
+
+
+def netbank_header():
+    return (
+        '<div id="header"><div></div><div><nav><div><ul><li>Home</li>'
+        '<li>Help</li><li><a href="{0}">Log off</a></li></ul></div></nav>'
+        '</div></div>'.format(LOGOUT)
+    )
+
+
+POSTBACK_SCRIPT = (
+    '<script>function __doPostBack(target, argument) {'
+    'var f = document.forms["aspnetForm"];'
+    'f.__EVENTTARGET.value = target; f.__EVENTARGUMENT.value = argument;'
+    'f.submit(); }</script>'
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fixture = None
+
+    def log_message(self, *args):
+        pass
+
+    def cookies(self):
+        cookies = {}
+        for part in self.headers.get('Cookie', '').split(';'):
+            if '=' in part:
+                name, value = part.strip().split('=', 1)
+                cookies[name] = value
+        return cookies
+
+    def form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if 'multipart/form-data' in self.headers.get('Content-Type', ''):
+            return {}, body
+        return {
+            k: v[0] for k, v in parse_qs(body.decode(), True).items()
+        }, body
+
+    def send(self, status, body=b'', headers=None, content_type='text/html'):
+        with self.fixture.lock:
+            if self.fixture.first_request is None:
+                self.fixture.first_request = time.time()
+        time.sleep(self.fixture.latency)
+        with self.fixture.lock:
+            self.fixture.requests += 1
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, location, headers=None):
+        headers = dict(headers or {}, Location=location)
+        self.send(302, headers=headers)
+
+    def authenticated(self):
+        return self.cookies().get('NetBankSession') in self.fixture.sessions
+
+    def penny_authenticated(self):
+        return self.cookies().get('penny_session') in self.fixture.penny_sessions
+
+    def account(self, query):
+        try:
+            return self.fixture.accounts[int(query['account'][0])]
+        except (KeyError, IndexError, ValueError):
+            return None
+
+    def download(self, account, from_date=None, to_date=None):
+        time.sleep(self.fixture.download_latency)
+        self.send(
+            200, self.fixture.ofx(account, from_date, to_date),
+            {'Content-Disposition': 'attachment; filename=OFXData.ofx'},
+            'application/x-ofx'
+        )
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == LOGIN:
+            return self.send(200, page('Log on', (
+                '<form method="post" action="{0}">'
+                '<input id="txtMyClientNumber_field" name="client">'
+                '<input id="txtMyPassword_field" name="password" '
+                'type="password">'
+                '<input id="btnLogon_field" type="submit" value="Log on">'
+                '</form>'
+            ).format(LOGIN)))
+        elif url.path == LOGOUT:
+            self.fixture.sessions.discard(self.cookies().get('NetBankSession'))
+            return self.redirect(LOGIN)
+        elif url.path.startswith(NETBANK):
+            if not self.authenticated():
+                return self.redirect(LOGIN)
+            if url.path == PORTFOLIO:
+                return self.portfolio()
+            account = self.account(query)
+            if account is None:
+                return self.send(404, page('Not found', ''))
+            if url.path == ACCOUNT:
+                return self.account_page(account)
+            if url.path == HISTORY:
+                return self.history_page(account)
+        elif url.path.startswith(PENNY):
+            return self.penny_get(url)
+        self.send(404, page('Not found', ''))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        form, body = self.form()
+        if url.path == LOGIN:
+            session = secrets.token_hex(8)
+            self.fixture.sessions.add(session)
+            return self.redirect(PORTFOLIO, {
+                'Set-Cookie': 'NetBankSession={0}; Path=/'.format(session)
+            })
+        elif url.path.startswith(NETBANK):
+            if not self.authenticated():
+                return self.redirect(LOGIN)
+            account = self.account(query)
+            if account is None:
+                return self.send(404, page('Not found', ''))
+            dates = self.dates(form)
+            if url.path == HISTORY:
+                if (form.get('__EVENTTARGET') ==
+                        'ctl00$CustomFooterContentPlaceHolder$lbExport1' and
+                        form.get('ctl00$CustomFooterContentPlaceHolder$'
+                                 'ddlExportType1$field') == 'OFX'):
+                    return self.download(account, *dates)
+                return self.history_page(account)
+            if url.path == EXPORT and form.get('format') == 'OFX':
+                return self.download(account, *dates)
+            return self.send(400, page('Bad export', ''))
+        elif url.path.startswith(PENNY):
+            return self.penny_post(url, form, body)
+        self.send(404, page('Not found', ''))
+
+    def dates(self, form):
+        parsed = []
+        for key in ('fromDate', 'toDate'):
+            try:
+                parsed.append(datetime.datetime.strptime(
+                    form.get(key, ''), '%d/%m/%Y'
+                ).date())
+            except ValueError:
+                parsed.append(None)
+        return parsed
+
+    def portfolio(self):
+        rows = ''.join(
+            portfolio_row(a, '{0}?account={1}'.format(ACCOUNT, a['index']))
+            for a in self.fixture.accounts
+        )
+        self.send(200, page('Portfolio', (
+            netbank_header() +
+            '<div id="StartMainContent"><div><div></div><div><div><main>'
+            '<section><div><div>{0}</div></div></section>'
+            '</main></div></div></div></div>'
+        ).format(rows)))
+
+    def account_page(self, account):
+        if account['name'] == 'Home Loan':
+            return self.send(200, page(account['name'], (
+                netbank_header() +
+                '<a id="lnk-transactions-viewAll" '
+                'href="{0}?account={1}">View all transactions</a>'
+            ).format(HISTORY, account['index'])))
+        if account['name'] == 'Complete Access':
+            return self.send(200, page(account['name'], (
+                netbank_header() +
+                '<a id="export-link" href="#">Export</a>'
+                '<form method="post" action="{0}?account={1}">'
+                '<input type="hidden" name="fromDate" value="">'
+                '<input type="hidden" name="toDate" value="">'
+                '<div id="export-format-type"><div>'
+                '<div><label><input type="radio" name="format" value="CSV" '
+                'checked>CSV</label></div>'
+                '<div><label><input type="radio" name="format" value="OFX">'
+                'OFX</label></div>'
+                '</div></div>'
+                '<input id="txnListExport-submit-btn" type="submit" '
+                'value="Export">'
+                '</form>'
+            ).format(EXPORT, account['index'])))
+        return self.history_page(account)
+
+    def history_page(self, account):
+        self.send(200, page(account['name'], (
+            netbank_header() +
+            '<form name="aspnetForm" id="aspnetForm" method="post" '
+            'action="{0}?account={1}">'
+            '<input type="hidden" name="__EVENTTARGET" value="">'
+            '<input type="hidden" name="__EVENTARGUMENT" value="">'
+            '<input type="hidden" name="__VIEWSTATE" value="{2}">'
+            '<input type="text" name="fromDate" value="">'
+            '<input type="text" name="toDate" value="">'
+            '<div id="ctl00_CustomFooterContentPlaceHolder_updatePanelExport1">'
+            '<div>Export</div>'
+            '<select id="ctl00_CustomFooterContentPlaceHolder_ddlExportType1'
+            '_field" name="ctl00$CustomFooterContentPlaceHolder$'
+            'ddlExportType1$field">'
+            '<option value="CSV" selected>CSV</option>'
+            '<option value="OFX">OFX</option></select>'
+            '<a id="ctl00_CustomFooterContentPlaceHolder_lbExport1" '
+            'href="javascript:__doPostBack(\'ctl00$CustomFooterContent'
+            'PlaceHolder$lbExport1\',\'\')">Export</a>'
+            '</div></form>'
+        ).format(HISTORY, account['index'], secrets.token_hex(32)),
+            POSTBACK_SCRIPT))
+
+    def penny_get(self, url):
+        path = url.path[len(PENNY):]
+        if path == 'login':
+            return self.send(200, page('Penny', (
+                '<div><div><div><div><div></div><div>'
+                '<form method="post" action="{0}login">'
+                '<input type="hidden" name="_token" value="fixture">'
+                '<fieldset>'
+                '<div><input type="email" name="email"></div>'
+                '<div><input type="password" name="password"></div>'
+                '<input type="submit" value="Login">'
+                '</fieldset></form></div></div></div></div></div>'
+            ).format(PENNY)))
+        if path == 'logout':
+            self.fixture.penny_sessions.discard(
+                self.cookies().get('penny_session')
+            )
+            return self.redirect(PENNY + 'login')
+        if not self.penny_authenticated():
+            return self.redirect(PENNY + 'login')
+        if path == 'transactions/import':
+            return self.penny_import()
+        return self.send(200, page('Penny', '<div>Transactions</div>'))
+
+    def penny_import(self, error=''):
+        return self.send(200, page('Import', (
+            '<div><div><div>{1}</div><div><div><div><div>'
+            '<form method="post" enctype="multipart/form-data" '
+            'action="{0}transactions/import">'
+            '<input type="hidden" name="_token" value="fixture">'
+            '<input type="file" id="upload" name="upload">'
+            '<div><div><input type="submit" value="Import"></div></div>'
+            '</form></div></div></div></div></div></div>'
+        ).format(PENNY, html.escape(error))))
+
+    def penny_post(self, url, form, body):
+        path = url.path[len(PENNY):]
+        if path == 'login':
+            session = secrets.token_hex(8)
+            self.fixture.penny_sessions.add(session)
+            return self.redirect(PENNY + 'transactions', {
+                'Set-Cookie': 'penny_session={0}; Path=/'.format(session)
+            })
+        if not self.penny_authenticated():
+            return self.redirect(PENNY + 'login')
+        if path == 'transactions/import':
+            if b'<OFX>' not in body:
+                return self.penny_import('Not an OFX file')
+            with self.fixture.lock:
+                self.fixture.uploads.append(body.count(b'<STMTTRN>'))
+            return self.redirect(PENNY + 'transactions')
+        self.send(404, page('Not found', ''))
+
+
+class FixtureServer:
+    """Run the fixture on a background thread of a threading HTTP server."""
+
+    def __init__(self, host='127.0.0.1', port=0, **kwargs):
+        self.fixture = Fixture(**kwargs)
+        handler = type('Handler', (Handler,), {'fixture': self.fixture})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    @property
+    def login_url(self):
+        return self.base_url + LOGIN
+
+    @property
+    def penny_url(self):
+        return self.base_url + PENNY
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', required=False, default=8000, type=int)
+    parser.add_argument(
+        '--accounts', required=False, default=4, type=int,
+        help='Number of accounts in the portfolio'
+    )
+    parser.add_argument(
+        '--latency', required=False, default=0.0, type=float,
+        help='Seconds added to every response'
+    )
+    parser.add_argument(
+        '--download-latency', required=False, default=0.0, type=float,
+        help='Extra seconds added to OFX exports'
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = FixtureServer(
+        port=args.port, accounts=args.accounts, latency=args.latency,
+        download_latency=args.download_latency
+    )
+    print('Netbank login: {0}'.format(server.login_url))
+    print('Penny base_url: {0}'.format(server.penny_url))
+    server.start().thread.join()
+
+
+if __name__ == '__main__':
+    main()
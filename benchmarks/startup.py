@@ -0,0 +1,175 @@
+"""Measure how quickly each cli.py command starts.
+
+Runs every command in a fresh Python process against the fixture server
+and records the time spent importing modules, the time until the first
+request reaches the fixture (the first page the browser navigates to, or
+the first HTTP upload) and the wall time of the whole command.
+
+    python benchmarks/startup.py --chromedriver /usr/bin/chromedriver
+    python benchmarks/startup.py --save-baseline startup.json
+    python benchmarks/startup.py --baseline startup.json \
+        --command upload -- --penny-http
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from e2e import write_config  # noqa: E402
+from fixture_server import FixtureServer  # noqa: E402
+
+
+COMMANDS = ('download', 'upload', 'sync', 'status')
+
+# Results where a larger number is a regression.
+MEASURES = ('import_seconds', 'first_request_seconds', 'wall_seconds')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--chromedriver', required=False, default='chromedriver',
+        help='Path to chromedriver'
+    )
+    parser.add_argument(
+        '--accounts', required=False, default=4, type=int,
+        help='Number of accounts served by the fixture'
+    )
+    parser.add_argument(
+        '--command', required=False, action='append', default=None,
+        choices=COMMANDS, help='Only measure this command (may be repeated)'
+    )
+    parser.add_argument(
+        '--runs', required=False, default=3, type=int,
+        help='Number of runs of each command, the median of which is reported'
+    )
+    parser.add_argument(
+        '--baseline', required=False, default=None,
+        help='Compare against the results stored in this file'
+    )
+    parser.add_argument(
+        '--save-baseline', required=False, default=None,
+        help='Store the results in this file'
+    )
+    parser.add_argument(
+        '--tolerance', required=False, default=0.1, type=float,
+        help='Fraction a measure may exceed the baseline by'
+    )
+    parser.add_argument(
+        'cli_args', nargs='*',
+        help='Extra arguments for every measured command but status, given '
+        'after --'
+    )
+    return parser.parse_args()
+
+
+def import_seconds(stderr):
+    """Return the seconds -X importtime reports for the top level imports,
+    which include every import nested under them."""
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented under the module importing them.
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            total += int(cumulative)
+    return total / 1e6
+
+
+def run(args, command):
+    server = FixtureServer(accounts=args.accounts).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            config = write_config(directory, server, args.chromedriver)
+            argv = [command, '--config', config]
+            if command != 'status':
+                argv += ['--lean'] + args.cli_args
+            if command == 'upload':
+                # Something new for penny, as a download would have left.
+                for account in server.fixture.accounts:
+                    path = os.path.join(
+                        directory, server.fixture.digits(account) + '.ofx'
+                    )
+                    with open(path, 'wb') as f:
+                        f.write(server.fixture.ofx(account))
+            start = time.time()
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime',
+                 os.path.join(ROOT, 'cli.py')] + argv,
+                cwd=directory, capture_output=True, text=True
+            )
+            wall = time.time() - start
+    finally:
+        server.stop()
+
+    if process.returncode:
+        sys.stderr.write(process.stderr[-2000:])
+    first = server.fixture.first_request
+    return {
+        'import_seconds': import_seconds(process.stderr),
+        'first_request_seconds': None if first is None else first - start,
+        'wall_seconds': wall,
+        'returncode': process.returncode,
+    }
+
+
+def median(values):
+    values = [v for v in values if v is not None]
+    return statistics.median(values) if values else None
+
+
+def compare(results, baseline, tolerance):
+    """Print each measure of each command against the baseline and return
+    the number of regressions."""
+    regressions = 0
+    for command, measures in results.items():
+        for measure in MEASURES:
+            old = baseline.get(command, {}).get(measure)
+            new = measures[measure]
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change > tolerance
+            regressions += regressed
+            print('{0:<9} {1:<22} {2:>8.3f} {3:>8.3f} {4:>+8.1%}{5}'.format(
+                command, measure, old, new, change,
+                '  REGRESSION' if regressed else ''
+            ))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    results = {}
+    for command in args.command or COMMANDS:
+        runs = [run(args, command) for _ in range(args.runs)]
+        results[command] = {
+            measure: median(r[measure] for r in runs) for measure in MEASURES
+        }
+        results[command]['failed_runs'] = sum(
+            1 for r in runs if r['returncode']
+        )
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,107 +1,311 @@
 import argparse
-from banalcow import netbank, config, penny
-from banalcow.logger import logger
-from selenium.common.exceptions import WebDriverException
-import sys
-import time
+import datetime
 import os
-from pathlib import Path
-import traceback
+import sys
+from banalcow import config
 
 
-def parse_args():
-    parser = argparse.ArgumentParser()
+# Option groups of each command. Everything heavier than the config is
+# imported once the command is known, so status and --help start fast.
+COMMANDS = {
+    'download': (
+        'common', 'run', 'browser', 'files', 'download', 'batch', 'schedule'
+    ),
+    'upload': ('common', 'run', 'browser', 'files', 'upload', 'batch'),
+    'sync': (
+        'common', 'run', 'browser', 'files', 'download', 'upload', 'sync',
+        'batch', 'schedule'
+    ),
+    'status': ('common',),
+}
+
+HELP = {
+    'download': 'Download Netbank accounts as OFX files',
+    'upload': 'Upload the new transactions of OFX files to Penny',
+    'sync': 'Download from Netbank and upload to Penny',
+    'status': 'Show what has been synced for each account',
+}
+
+
+def option_groups():
+    """Return a parent parser holding the options of each group."""
+    groups = {
+        name: argparse.ArgumentParser(add_help=False)
+        for name in (
+            'common', 'run', 'browser', 'files', 'download', 'upload',
+            'sync', 'batch', 'schedule'
+        )
+    }
+
+    parser = groups['common']
+    parser.add_argument(
+        '--config', required=False, default='./config.yml',
+        help='Path of the config file'
+    )
+
+    parser = groups['run']
     parser.add_argument(
-        '--debug', 
+        '--report', required=False, default=None,
+        help='Write a JSON report of step timings and counters to this path'
+    )
+    parser.add_argument(
+        '--prometheus', required=False, default=None,
+        help='Write the run metrics to this Prometheus textfile'
+    )
+
+    parser = groups['browser']
+    parser.add_argument(
+        '--retry', required=False, default=10, type=int,
+        help='Number of attempts to retry'
+    )
+    parser.add_argument(
+        '--sleep', required=False, default=30, type=int,
+        help='The number of seconds to sleep'
+    )
+    parser.add_argument(
+        '--engine', required=False, default='selenium',
+        choices=('selenium', 'cdp'),
+        help='Drive Chrome through chromedriver, or directly over DevTools'
+    )
+    parser.add_argument(
+        '--daemon', required=False, action='store_true', default=False,
+        help='Attach to the warm browsers of a running banalcow.daemon'
+    )
+    parser.add_argument(
+        '--lean', required=False, action='store_true', default=False,
+        help='Run Chrome headless without images, trackers or ads'
+    )
+
+    parser = groups['files']
+    parser.add_argument(
+        '--archive', required=False, action='store_true', default=False,
+        help='Keep a compressed copy of every download and skip uploads '
+        'penny has already accepted'
+    )
+    parser.add_argument(
+        '--prune-archive', required=False, default=None, type=int,
+        metavar='DAYS', help='Drop archived downloads older than DAYS'
+    )
+
+    parser = groups['download']
+    parser.add_argument(
+        '--debug',
         required=False, action='store_true', default=False,
         help='Debug'
     )
     parser.add_argument(
-        '--only-home-loans', 
+        '--only-home-loans',
         required=False, action='store_true', default=False,
         help='Only process home loans'
     )
+    parser.add_argument(
+        '--workers', required=False, default=1, type=int,
+        help='Number of browser sessions downloading accounts concurrently'
+    )
+    parser.add_argument(
+        '--http-export', required=False, action='store_true', default=False,
+        help='Request OFX exports over HTTP, falling back to the browser'
+    )
+    parser.add_argument(
+        '--full', required=False, action='store_true', default=False,
+        help='Download a full year instead of since the last sync'
+    )
+    parser.add_argument(
+        '--overlap', required=False, default=7, type=int,
+        help='Days before the last sync to download again'
+    )
+    parser.add_argument(
+        '--backfill', required=False, default=None, metavar='DD/MM/YYYY',
+        help='Download everything since this date in resumable windows'
+    )
+    parser.add_argument(
+        '--window-months', required=False, default=3, type=int,
+        help='Calendar months in each --backfill window'
+    )
+    parser.add_argument(
+        '--backfill-workers', required=False, default=4, type=int,
+        help='Number of --backfill windows exported concurrently'
+    )
+    parser.add_argument(
+        '--portfolio-ttl', required=False, default=0, type=int,
+        help='Reuse the account list read within this many seconds'
+    )
+    parser.add_argument(
+        '--skip-unchanged', required=False, action='store_true',
+        default=False,
+        help='Only download accounts whose balances changed since last time'
+    )
+    parser.add_argument(
+        '--refresh-days', required=False, default=7, type=int,
+        help='Download unchanged accounts anyway after this many days'
+    )
+    parser.add_argument(
+        '--columns', required=False, action='store_true', default=False,
+        help='Append downloaded transactions to the columnar store'
+    )
+    parser.add_argument(
+        '--balances', required=False, action='store_true', default=False,
+        help='Record a snapshot of every account balance'
+    )
+
+    parser = groups['upload']
+    parser.add_argument(
+        '--penny-http', required=False, action='store_true', default=False,
+        help='Upload to penny over HTTP, falling back to the browser'
+    )
+    parser.add_argument(
+        '--upload-workers', required=False, default=4, type=int,
+        help='Number of concurrent HTTP uploads to penny'
+    )
+    parser.add_argument(
+        '--merge-uploads', required=False, action='store_true',
+        default=False, help='Import all accounts into penny in one upload'
+    )
+
+    parser = groups['sync']
     parser.add_argument(
         '--penny', required=False, action='store_true', default=False,
-        help='Import into penny'
+        help='Only import into penny'
     )
     parser.add_argument(
         '--netbank', required=False, action='store_true', default=False,
-        help='Download netbank data'
+        help='Only download netbank data'
     )
     parser.add_argument(
-        '--retry', required=False, default=10, type=int,
-        help='Number of attempts to retry'
+        '--pipeline', required=False, action='store_true', default=False,
+        help='Upload each account to penny as soon as it is downloaded'
     )
     parser.add_argument(
-        '--sleep', required=False, default=30, type=int,
-        help='The number of seconds to sleep'
+        '--upload-queue', required=False, default=2, type=int,
+        help='Downloaded files waiting for upload before downloads pause'
     )
-    return parser.parse_args()
 
+    parser = groups['batch']
+    parser.add_argument(
+        '--batch', required=False, action='store_true', default=False,
+        help='Sync every login listed under profiles in the config'
+    )
+    parser.add_argument(
+        '--profile', required=False, action='append', default=None,
+        help='Only sync this profile in --batch mode (may be repeated)'
+    )
+    parser.add_argument(
+        '--profile-workers', required=False, default=2, type=int,
+        help='Number of profiles synced concurrently in --batch mode'
+    )
+    parser.add_argument(
+        '--host-interval', required=False, default=1.0, type=float,
+        help='Minimum seconds between requests to one host in --batch mode'
+    )
 
-def main():
-    args = parse_args()
-    conf = config.Config('./config.yml')
+    parser = groups['schedule']
+    parser.add_argument(
+        '--schedule', required=False, action='store_true', default=False,
+        help='Run continuously, downloading each account as often as its '
+        'activity needs'
+    )
+    parser.add_argument(
+        '--requests-per-hour', required=False, default=30, type=int,
+        help='Most bank requests a --schedule run makes in any hour'
+    )
+    parser.add_argument(
+        '--per-refresh', required=False, default=2, type=float,
+        help='New transactions expected between scheduled downloads'
+    )
+    parser.add_argument(
+        '--min-interval', required=False, default=1, type=float,
+        metavar='HOURS', help='Shortest time between scheduled downloads'
+    )
+    parser.add_argument(
+        '--max-interval', required=False, default=7, type=float,
+        metavar='DAYS', help='Longest time between scheduled downloads'
+    )
+    return groups
 
-    if args.netbank:
-        session = netbank.Netbank(
-            conf.netbank.username, conf.netbank.password,
-            chrome_driver_executable_path=conf.chrome_driver_executable_path,
-            only_home_loans=args.only_home_loans, retry=args.retry,
-            sleep=args.sleep, debug=args.debug
+
+def parse_args(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0].startswith('-') and argv[0] not in ('-h', '--help'):
+        # Options without a command, as before there were commands.
+        argv = ['sync'] + argv
+
+    groups = option_groups()
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command, names in COMMANDS.items():
+        commands.add_parser(
+            command, help=HELP[command],
+            parents=[groups[name] for name in names]
         )
+    args = parser.parse_args(argv)
+
+    # Give the options of every other group their defaults, so the rest
+    # of the run can read any of them.
+    for name, group in groups.items():
+        if name not in COMMANDS[args.command]:
+            group.parse_known_args([], namespace=args)
+
+    if args.command == 'download':
+        args.netbank, args.penny = True, False
+    elif args.command == 'upload':
+        args.netbank, args.penny = False, True
+    elif args.command == 'sync' and not (args.netbank or args.penny):
+        args.netbank = args.penny = True
+
+    if args.window_months < 1:
+        parser.error('--window-months must be at least 1')
+    if args.schedule and args.requests_per_hour < 2:
+        parser.error('--requests-per-hour must allow a login and a download')
+    return args
+
+
+def when(timestamp):
+    if timestamp is None:
+        return '-'
+    return datetime.datetime.fromtimestamp(timestamp).strftime(
+        '%Y-%m-%d %H:%M'
+    )
+
+
+def status(conf):
+    """Print what the state store, and that of each --batch profile that
+    has one, knows of every account."""
+    status_table(conf.state_path)
+    for profile in conf.profiles:
+        if os.path.exists(profile.state_path):
+            print('\nProfile {0}'.format(profile.name))
+            status_table(profile.state_path)
+
+
+def status_table(state_path):
+    from banalcow import state
+    store = state.StateStore(state_path)
+    try:
+        accounts = store.summary()
+    finally:
+        store.close()
+    print('{0:<20} {1:<10} {2:>12} {3:<16} {4}'.format(
+        'Account', 'Synced to', 'Transactions', 'Downloaded', 'Due'
+    ))
+    for a in accounts:
+        print('{0:<20} {1:<10} {2:>12} {3:<16} {4}'.format(
+            a.accountnumber, a.synced_to or '-', a.transactions,
+            when(a.downloaded_at), when(a.due_at)
+        ))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    conf = config.Config(args.config)
+
+    if args.command == 'status':
+        status(conf)
+        return
 
-        try:
-            session.login()
-        except WebDriverException as e:
-            logger.error('Failed to login')
-            logger.error(traceback.format_ext())
-            session.driver.quit()
-            sys.exit()
-
-        accounts = session.get_accounts()
-
-        for account, data in accounts.items():
-            try:
-                session.access_account(account, data.href)
-            except WebDriverException as e:
-                logger.error('Failed to access account')
-                logger.error(traceback.format_ext())
-                session.driver.quit()
-                sys.exit()
-
-            if data.account_type == netbank.AccountType.HOME_LOAN:
-                session.view_transactions()
-
-            session.download_ofx(data.filename, data.account_type)
-            session.access_homepage()
-
-        if not args.debug:
-            session.logout()
-            session.driver.quit()
-
-    if args.penny:
-        try:
-            chrome_driver = conf.chrome_driver_executable_path
-            session = penny.Penny(
-                conf.penny.base_url, conf.penny.username, conf.penny.password,
-                chrome_driver_executable_path=chrome_driver
-            )
-        except AttributeError:
-            logger.error('Failed to find Penny config in pass.')
-            sys.exit()
-
-        session.login()
-        time.sleep(10)
-        for path in Path('.').glob('*.ofx'):
-            filename = str(path)
-            logger.info(f'Uploading {filename}')
-            session.upload(filename)
-            os.remove(filename)
-
-        session.logout()
-        session.driver.quit()
+    # Imported only now: it brings in Selenium when a browser is needed.
+    from banalcow import sync
+    if sync.run(args, conf):
+        return 1
 
 
 if __name__ == '__main__':
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fixture_server import FixtureServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    server = FixtureServer(accounts=4).start()
+    yield server
+    server.stop()
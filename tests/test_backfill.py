@@ -0,0 +1,64 @@
+import datetime
+from collections import namedtuple
+
+from banalcow import backfill, ofx, state
+
+
+account = namedtuple('account', 'filename from_date account_type')
+
+STATEMENT = (
+    '<OFX>\n<BANKMSGSRSV1>\n<STMTTRNRS>\n<STMTRS>\n<BANKTRANLIST>\n'
+    '<DTSTART>{0:%Y%m%d}\n<DTEND>{1:%Y%m%d}\n'
+    '<STMTTRN>\n<DTPOSTED>{0:%Y%m%d}\n<TRNAMT>-1.00\n'
+    '<FITID>{0:%Y%m%d}\n</STMTTRN>\n'
+    '</BANKTRANLIST>\n</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n</OFX>\n'
+)
+
+
+class FakeSession:
+    """Exports a statement for each window, broken ones while broken."""
+
+    columns = None
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.from_date = datetime.datetime(2025, 1, 1)
+        self.to_date = datetime.datetime(2025, 12, 31)
+        self.broken = False
+        self.exports = []
+
+    def throttle(self):
+        pass
+
+    def export_account(self, data, to_date=None):
+        self.exports.append(data.from_date)
+        with open(data.filename, 'w') as f:
+            if self.broken and to_date == self.to_date:
+                f.write('<OFX>\n</OFX>\n')
+            else:
+                f.write(STATEMENT.format(data.from_date, to_date))
+
+
+def test_broken_window_fails_account_and_is_retried(tmp_path):
+    session = FakeSession(str(tmp_path))
+    session.broken = True
+    store = state.StateStore(str(tmp_path / 'banalcow.db'))
+    accounts = {'06200000000000': account(None, None, None)}
+    merged = []
+
+    def done(accountnumber, data):
+        merged.append(data.filename)
+
+    failures = backfill.Backfill(session, store).run(accounts, done)
+    assert isinstance(failures['06200000000000'], ValueError)
+    assert merged == []
+    assert len(store.windows('06200000000000')) == 3
+
+    # Only the broken window is downloaded again.
+    session.broken = False
+    session.exports = []
+    failures = backfill.Backfill(session, store).run(accounts, done)
+    assert failures == {}
+    assert session.exports == [datetime.datetime(2025, 10, 1)]
+    assert len(list(ofx.transactions(merged[0]))) == 4
+    store.close()
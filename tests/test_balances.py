@@ -0,0 +1,109 @@
+import os
+from collections import namedtuple
+
+import pytest
+
+from banalcow.balances import MISSING, SNAPSHOT, BalanceHistory, cents
+
+
+account = namedtuple('account', 'balance available')
+
+
+@pytest.mark.parametrize('accountnumber', ['', '.hidden', '../06200000'])
+def test_append_rejects_account_numbers_that_are_not_file_names(
+        tmp_path, accountnumber):
+    history = BalanceHistory(str(tmp_path))
+    with pytest.raises(ValueError, match='Invalid account number'):
+        history.append(accountnumber, '$1.00', '$1.00')
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_record_skips_account_without_number(tmp_path):
+    history = BalanceHistory(str(tmp_path))
+    stored = history.record({
+        '': account('$5.00', '$5.00'),
+        '06200000000000': account('$1,234.56', '$5.00 DR'),
+    }, when=1000)
+    assert stored == 1
+    assert history.accounts() == ['06200000000000']
+    assert history.snapshots('06200000000000').tolist() == [
+        (1000, 123456, -500)
+    ]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('$1,234.56', 123456),
+    ('$5.00 CR', 500),
+    ('$5.00 dr', -500),
+    ('-$5.00', -500),
+    ('$-5.00', -500),
+    ('12', 1200),
+    ('', MISSING),
+    ('n/a', MISSING),
+    (None, MISSING),
+])
+def test_cents(text, expected):
+    assert cents(text) == expected
+
+
+def history_of(tmp_path, *snapshots):
+    history = BalanceHistory(str(tmp_path))
+    for when, balance, available in snapshots:
+        history.append('06200000000000', balance, available, when)
+    return history
+
+
+def test_range_bounds(tmp_path):
+    history = history_of(
+        tmp_path, (100, '$1.00', None), (200, '$2.00', None),
+        (200, '$3.00', None), (300, '$4.00', None)
+    )
+
+    def times(start, end):
+        return history.range('06200000000000', start, end)['time'].tolist()
+
+    assert times(None, None) == [100, 200, 200, 300]
+    # start is inclusive, end exclusive, for repeated times too.
+    assert times(200, 300) == [200, 200]
+    assert times(101, 299) == [200, 200]
+    assert times(None, 200) == [100]
+    assert times(301, None) == []
+    assert times(200, 200) == []
+
+
+@pytest.mark.parametrize('how, expected', [
+    ('last', [300, 500]),
+    ('min', [100, 500]),
+    ('max', [300, 500]),
+    ('mean', [200, 500]),
+])
+def test_downsample_skips_missing(tmp_path, how, expected):
+    history = history_of(
+        tmp_path, (0, '$1.00', '$1.00'), (10, None, '$1.00'),
+        (20, '$3.00', '$1.00'), (40, None, '$1.00'),
+        (110, '$5.00', '$1.00'), (120, None, '$1.00')
+    )
+    times, values = history.downsample(
+        '06200000000000', 100, field='balance', how=how
+    )
+    assert times.tolist() == [0, 100]
+    assert values.tolist() == expected
+
+
+def test_downsample_all_missing(tmp_path):
+    history = history_of(tmp_path, (0, None, '$1.00'))
+    times, values = history.downsample('06200000000000', 100)
+    assert times.tolist() == values.tolist() == []
+
+
+def test_truncated_record_is_ignored_then_replaced(tmp_path):
+    history = history_of(tmp_path, (100, '$1.00', '$2.00'))
+    path = history.path('06200000000000')
+    with open(path, 'ab') as f:
+        f.write(b'\xff' * (SNAPSHOT.itemsize // 2))
+    assert history.snapshots('06200000000000').tolist() == [(100, 100, 200)]
+    assert history.append('06200000000000', '$3.00', None, 200)
+    assert os.path.getsize(path) == 2 * SNAPSHOT.itemsize
+    assert history.snapshots('06200000000000').tolist() == [
+        (100, 100, 200), (200, 300, MISSING)
+    ]
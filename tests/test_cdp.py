@@ -0,0 +1,262 @@
+import asyncio
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import websockets
+from selenium.common.exceptions import (
+    NoSuchElementException, StaleElementReferenceException, TimeoutException
+)
+
+from banalcow import cdp
+
+
+# The document served for every URL: element ids and their tag names.
+DOCUMENT = {'user': 'INPUT', 'login': 'BUTTON'}
+
+
+class FakeChrome:
+    """A DevTools websocket that answers the commands cdp sends with a
+    one page document, on a loop of its own."""
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.objects = {}
+        self.removed = set()
+        self.clicks = []
+        self.navigations = []
+        self.cookies = {}
+        self.closed_targets = []
+        self.disconnected = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def serve():
+            self.server = await websockets.serve(self.handler, '127.0.0.1', 0)
+            started.set()
+            await self.server.serve_forever()
+
+        self.thread = threading.Thread(
+            target=self.loop.run_until_complete, args=(serve(),), daemon=True
+        )
+        self.thread.start()
+        started.wait(5)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = 'ws://127.0.0.1:{0}'.format(port)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.thread.join(5)
+
+    def remote(self, value):
+        object_id = 'obj{0}'.format(next(self.ids))
+        self.objects[object_id] = value
+        return object_id
+
+    def array(self, element_ids):
+        return {
+            'type': 'object', 'subtype': 'array',
+            'objectId': self.remote(element_ids),
+        }
+
+    def find(self, by, value):
+        if by == 'id' and value in DOCUMENT and value not in self.removed:
+            return [self.remote(value)]
+        return []
+
+    def first(self, locators):
+        for i, (by, value) in enumerate(locators):
+            found = self.find(by, value)
+            if found:
+                return self.array([i, found[0]])
+        return {'type': 'object', 'subtype': 'null', 'value': None}
+
+    async def call(self, params):
+        declaration = params['functionDeclaration']
+        args = [a.get('value', a.get('objectId')) for a in params['arguments']]
+        element = self.objects.get(params.get('objectId'))
+        if element is not None and element in self.removed:
+            return {'result': {}, 'exceptionDetails': {
+                'text': 'Uncaught',
+                'exception': {'description': 'Error: stale element'},
+            }}
+        if declaration == cdp.FIND_ALL:
+            return {'result': self.array(self.find(*args))}
+        if declaration == cdp.FIND_FIRST:
+            return {'result': self.first(args[0])}
+        if declaration == cdp.WAIT_FIRST:
+            result = self.first(args[0])
+            if result['subtype'] == 'null':
+                await asyncio.sleep(args[1])
+            return {'result': result}
+        if declaration == cdp.CLICK:
+            self.clicks.append(element)
+            return {'result': {'type': 'undefined'}}
+        if 'this.tagName' in declaration:
+            return {'result': {'type': 'string', 'value': DOCUMENT[element]}}
+        # Any other script returns its arguments.
+        return {'result': {'type': 'object', 'value': args}}
+
+    async def handler(self, websocket):
+        contexts = itertools.count(1)
+
+        async def event(session, method, params):
+            await websocket.send(json.dumps({
+                'sessionId': session, 'method': method, 'params': params
+            }))
+
+        async def context(session):
+            await event(session, 'Runtime.executionContextCreated', {
+                'context': {'id': next(contexts), 'auxData': {
+                    'isDefault': True, 'frameId': 'F' + session
+                }}
+            })
+
+        async for raw in websocket:
+            message = json.loads(raw)
+            method = message['method']
+            params = message.get('params', {})
+            session = message.get('sessionId')
+            result = {}
+            if method == 'Target.createTarget':
+                result = {'targetId': 'T{0}'.format(message['id'])}
+            elif method == 'Target.attachToTarget':
+                result = {'sessionId': 'S' + params['targetId']}
+            elif method == 'Target.closeTarget':
+                self.closed_targets.append(params['targetId'])
+            elif method == 'Page.getFrameTree':
+                result = {'frameTree': {'frame': {
+                    'id': 'F' + session, 'url': 'about:blank'
+                }}}
+            elif method == 'Runtime.enable':
+                await context(session)
+            elif method == 'Page.navigate':
+                self.navigations.append(params['url'])
+                await websocket.send(json.dumps({
+                    'id': message['id'],
+                    'result': {'frameId': 'F' + session, 'loaderId': 'L'},
+                }))
+                await event(session, 'Runtime.executionContextsCleared', {})
+                await event(session, 'Page.frameNavigated', {'frame': {
+                    'id': 'F' + session, 'url': params['url']
+                }})
+                await context(session)
+                await event(session, 'Page.loadEventFired', {})
+                continue
+            elif method == 'Runtime.callFunctionOn':
+                result = await self.call(params)
+            elif method == 'Runtime.getProperties':
+                values = self.objects[params['objectId']]
+                result = {'result': [
+                    {'name': str(i), 'value': {'type': 'number', 'value': v}}
+                    if isinstance(v, int) else
+                    {'name': str(i), 'value': {'type': 'object',
+                                               'objectId': v}}
+                    for i, v in enumerate(values)
+                ] + [{'name': 'length', 'value': {'value': len(values)}}]}
+            elif method == 'Network.setCookie':
+                self.cookies[params['name']] = params
+                result = {'success': True}
+            elif method == 'Network.getCookies':
+                result = {'cookies': [
+                    {'name': c['name'], 'value': c['value'],
+                     'domain': c.get('domain', '127.0.0.1'),
+                     'path': c['path'], 'secure': c['secure'],
+                     'httpOnly': c['httpOnly'], 'session': True,
+                     'expires': -1}
+                    for c in self.cookies.values()
+                ]}
+            await websocket.send(json.dumps({
+                'id': message['id'], 'result': result
+            }))
+        self.disconnected.set()
+
+
+@pytest.fixture
+def chrome():
+    chrome = FakeChrome()
+    yield chrome
+    chrome.stop()
+
+
+@pytest.fixture
+def devtools(chrome):
+    """The HTTP endpoint Chrome's DevTools server gives the websocket on."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = json.dumps({'webSocketDebuggerUrl': chrome.url}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield '127.0.0.1:{0}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def driver(devtools):
+    driver = cdp.connect(None, [], address=devtools)
+    yield driver
+    driver.quit()
+
+
+def test_navigate(driver, chrome):
+    assert driver.current_url == 'about:blank'
+    driver.get('http://bank.test/login')
+    assert driver.current_url == 'http://bank.test/login'
+    assert chrome.navigations == ['http://bank.test/login']
+
+
+def test_find_and_click(driver, chrome):
+    driver.get('http://bank.test/login')
+    assert driver.find_element('id', 'user').tag_name == 'input'
+    with pytest.raises(NoSuchElementException):
+        driver.find_element('id', 'missing')
+
+    index, button = driver.find_first([('id', 'missing'), ('id', 'login')])
+    assert index == 1
+    button.click()
+    assert chrome.clicks == ['login']
+
+    chrome.removed.add('login')
+    with pytest.raises(StaleElementReferenceException):
+        button.click()
+
+
+def test_wait_first(driver):
+    driver.get('http://bank.test/login')
+    index, element = driver.wait_first([('id', 'user')], 1)
+    assert index == 0 and element.tag_name == 'input'
+    with pytest.raises(TimeoutException):
+        driver.wait_first([('id', 'missing')], 0.2)
+
+
+def test_execute_script(driver):
+    driver.get('http://bank.test/login')
+    assert driver.execute_script('return arguments;', 1, 'two') == [1, 'two']
+
+
+def test_cookies(driver):
+    driver.get('http://bank.test/login')
+    driver.add_cookie({'name': 'session', 'value': 'abc', 'path': '/'})
+    cookies = driver.get_cookies()
+    assert [(c['name'], c['value']) for c in cookies] == [('session', 'abc')]
+    assert 'expiry' not in cookies[0]
+
+
+def test_quit_closes_page_and_connection(driver, chrome):
+    target = driver.page.target_id
+    driver.quit()
+    assert chrome.closed_targets == [target]
+    assert chrome.disconnected.wait(5)
+    with pytest.raises(cdp.CDPError):
+        driver.execute_script('return 1;')
@@ -0,0 +1,47 @@
+from collections import namedtuple
+
+import pytest
+
+from banalcow import changes, state
+
+
+account = namedtuple('account', 'balance available')
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = state.StateStore(str(tmp_path / 'banalcow.db'))
+    yield store
+    store.close()
+
+
+def test_split(store):
+    detector = changes.ChangeDetector(store)
+    before = {
+        'same': account('$1.00', '$1.00'),
+        'moved': account('$1.00', '$1.00'),
+        'unread': account(None, None),
+    }
+    for accountnumber, data in before.items():
+        detector.downloaded(accountnumber, data)
+
+    changed, unchanged = detector.split({
+        'same': account('$1.00', '$1.00'),
+        'moved': account('$1.00', '$0.50'),
+        'unread': account(None, None),
+        'new': account('$1.00', '$1.00'),
+    })
+    assert sorted(changed) == ['moved', 'new', 'unread']
+    assert unchanged == ['same']
+
+
+def test_split_refreshes_after_interval(store, monkeypatch):
+    detector = changes.ChangeDetector(store, refresh=3600)
+    data = {'same': account('$1.00', '$1.00')}
+    detector.downloaded('same', data['same'])
+    now = changes.time.time()
+
+    monkeypatch.setattr(changes.time, 'time', lambda: now + 3500)
+    assert detector.split(data) == ({}, ['same'])
+    monkeypatch.setattr(changes.time, 'time', lambda: now + 3700)
+    assert detector.split(data) == (data, [])
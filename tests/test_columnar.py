@@ -0,0 +1,31 @@
+from banalcow.columnar import ColumnStore
+
+
+def transaction(fitid, posted, amount):
+    return (
+        '<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>{1}\n<TRNAMT>{2}\n'
+        '<FITID>{0}\n<NAME>Payee\n</STMTTRN>\n'
+    ).format(fitid, posted, amount)
+
+
+def test_append_skips_malformed_transactions(tmp_path, caplog):
+    path = tmp_path / '06200000000000.ofx'
+    path.write_text(
+        '<OFX>\n<BANKMSGSRSV1>\n<STMTTRNRS>\n<STMTRS>\n<BANKTRANLIST>\n' +
+        transaction('1', '20260101', '-1,250.50') +
+        transaction('2', '20260102', '12.5O') +
+        transaction('3', '20260103', 'NaN') +
+        transaction('4', '2026-01-04', '-3.00') +
+        transaction('5', '20260105', '4.00') +
+        transaction('6', '20260106', '1E+30') +
+        transaction('7', '20260107', '-92233720368547758.09') +
+        '</BANKTRANLIST>\n</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n</OFX>\n'
+    )
+    store = ColumnStore(str(tmp_path / 'columns'))
+    assert store.append('06200000000000', str(path)) == 2
+    assert list(store.column('amount')) == [-125050, 400]
+    assert caplog.text.count('Skipping transaction') == 5
+
+    # The skipped transactions stay out on a second append.
+    assert store.append('06200000000000', str(path)) == 0
+    assert ColumnStore(str(tmp_path / 'columns')).rows == 2
@@ -0,0 +1,46 @@
+import pytest
+
+import cli
+from banalcow import config
+
+
+class FailingStore:
+    """A pass store whose gpg calls all fail, as pypass reports them."""
+
+    def get_decrypted_password(self, path):
+        return None
+
+
+@pytest.fixture
+def failing_pass(monkeypatch):
+    monkeypatch.setattr(
+        config.Config, 'pypass', property(lambda self: FailingStore())
+    )
+
+
+def test_decrypt_failure_is_a_config_error(tmp_path, failing_pass):
+    path = tmp_path / 'config.yml'
+    path.write_text('pypass:\n  path: /nonexistent\n')
+    conf = config.Config(str(path))
+    with pytest.raises(config.ConfigError, match='Personal/penny'):
+        conf.prefetch(['penny'])
+
+
+def test_upload_logs_a_failed_decrypt(tmp_path, monkeypatch, caplog,
+                                      failing_pass):
+    path = tmp_path / 'config.yml'
+    path.write_text('pypass:\n  path: /nonexistent\nstate_path: {0}\n'.format(
+        tmp_path / 'state.db'
+    ))
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(SystemExit):
+        cli.main(['upload', '--penny-http', '--config', str(path)])
+    assert 'Failed to decrypt pass entry Personal/penny' in caplog.text
+
+
+@pytest.mark.parametrize('months', ['0', '-1'])
+def test_window_months_must_be_positive(capsys, months):
+    with pytest.raises(SystemExit):
+        cli.parse_args(['sync', '--window-months', months])
+    assert '--window-months must be at least 1' in capsys.readouterr().err
+    assert cli.parse_args(['sync', '--window-months', '1']).window_months == 1
@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from banalcow import daemon
+
+
+class Process:
+    def poll(self):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def no_chrome(monkeypatch):
+    """Browsers that start without launching Chrome."""
+    def start(browser):
+        browser.process = Process()
+        browser.address = '127.0.0.1:{0}'.format(id(browser) % 60000)
+    monkeypatch.setattr(daemon.Browser, 'start', start)
+    monkeypatch.setattr(daemon.Browser, 'stop', lambda browser: None)
+
+
+def browser_daemon(tmp_path, **kwargs):
+    return daemon.BrowserDaemon(
+        str(tmp_path / 'daemon.sock'), str(tmp_path), 'chrome',
+        max_browsers=1, **kwargs
+    )
+
+
+def test_failed_start_frees_browser(tmp_path, monkeypatch):
+    browsers = browser_daemon(tmp_path)
+    started = daemon.Browser.start
+
+    def start(browser):
+        raise daemon.DaemonError('Chrome did not start')
+    monkeypatch.setattr(daemon.Browser, 'start', start)
+    with pytest.raises(daemon.DaemonError, match='did not start'):
+        browsers.acquire('netbank', os.getpid())
+    browser = browsers.browsers['netbank'][0]
+    assert (browser.in_use, browser.lease, browser.holder,
+            browser.leased_at) == (False, None, None, None)
+    assert browsers.status()['netbank'][0]['holder'] is None
+
+    monkeypatch.setattr(daemon.Browser, 'start', started)
+    lease = browsers.acquire('netbank', 1234567)
+    assert browsers.status()['netbank'][0]['holder'] == 1234567
+    browsers.release(lease['address'], lease=lease['lease'])
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+def test_reclaims_browser_of_dead_client(tmp_path):
+    browsers = browser_daemon(tmp_path)
+    lost = browsers.acquire('netbank', dead_pid())
+    lease = browsers.acquire('netbank', 1234567)
+    assert lease['address'] == lost['address']
+    assert lease['lease'] != lost['lease']
+    assert browsers.status()['netbank'][0]['holder'] == 1234567
+
+
+def test_keeps_browser_of_live_client(tmp_path):
+    browsers = browser_daemon(tmp_path)
+    browsers.acquire('netbank', os.getpid())
+    with pytest.raises(daemon.DaemonError, match='No idle netbank'):
+        browsers.acquire('netbank', os.getpid())
+
+
+def test_reclaims_browser_after_lease_ttl(tmp_path):
+    browsers = browser_daemon(tmp_path, lease_ttl=0.1)
+    lost = browsers.acquire('netbank')
+    with pytest.raises(daemon.DaemonError):
+        browsers.acquire('netbank')
+    time.sleep(0.2)
+    lease = browsers.acquire('netbank')
+
+    # The lost client coming back must not free the new lease.
+    with pytest.raises(daemon.DaemonError, match='has expired'):
+        browsers.release(lost['address'], lease=lost['lease'])
+    assert browsers.status()['netbank'][0]['in_use']
+    browsers.release(lease['address'], lease=lease['lease'])
+    assert not browsers.status()['netbank'][0]['in_use']
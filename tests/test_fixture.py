@@ -0,0 +1,222 @@
+import datetime
+import os
+import shutil
+from collections import namedtuple
+
+import pytest
+import requests
+import yaml
+from selenium.common.exceptions import WebDriverException
+
+import cli
+from banalcow import banalutil, ofx, state
+from banalcow.driver import BanalDriver
+from banalcow.export import ExportError, HttpExporter
+from banalcow.penny import PennyClient, PennyError
+from e2e import write_config
+from fixture_server import FixtureServer
+
+
+account = namedtuple('account', 'href filename')
+
+
+class CookieDriver:
+    """Just enough of a WebDriver to hand a logged in session to
+    HttpExporter."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def execute_script(self, script, *args):
+        return 'banalcow-tests'
+
+    def get_cookies(self):
+        return [
+            {'name': c.name, 'value': c.value, 'domain': c.domain,
+             'path': c.path}
+            for c in self.session.cookies
+        ]
+
+
+def netbank_session(server):
+    session = requests.Session()
+    session.post(server.login_url, data={'client': 'x', 'password': 'y'})
+    return session
+
+
+def write_ofx(server, directory):
+    for a in server.fixture.accounts:
+        with open(os.path.join(
+                directory, server.fixture.digits(a) + '.ofx'), 'wb') as f:
+            f.write(server.fixture.ofx(a))
+
+
+def browser_available():
+    return shutil.which('chromedriver') is not None
+
+
+def test_meta_without_lease():
+    # Netbank and Penny read meta on every login.
+    bd = BanalDriver.__new__(BanalDriver)
+    bd.lease = None
+    assert bd.meta == {}
+    bd.lease = {'meta': {'homepage': 'https://example.com/'}}
+    assert bd.meta['homepage'] == 'https://example.com/'
+
+
+@pytest.mark.parametrize('index,kind', [
+    (0, {'complete_access': True}),
+    (1, {'home_loan': True}),
+    (2, {}),
+])
+def test_http_export_downloads_ofx(server, tmp_path, index, kind):
+    fixture_account = server.fixture.accounts[index]
+    exporter = HttpExporter(CookieDriver(netbank_session(server)), '%d/%m/%Y')
+    data = account(
+        href='{0}/netbank/Account/Account.aspx?account={1}'.format(
+            server.base_url, index
+        ),
+        filename=str(tmp_path / 'OFXData.ofx')
+    )
+    to_date = datetime.datetime.now()
+    from_date = to_date - datetime.timedelta(days=9)
+    exporter.export(data, from_date, to_date, **kind)
+    transactions = list(ofx.transactions(data.filename))
+    assert len(transactions) == 10
+    assert server.fixture.digits(fixture_account) in \
+        open(data.filename).read()
+
+
+def test_http_export_fails_without_browser_session():
+    class ClosedDriver:
+        def execute_script(self, script, *args):
+            raise WebDriverException('chrome not reachable')
+
+    # Raised as ExportError so the download falls back to the browser.
+    with pytest.raises(ExportError, match='browser session'):
+        HttpExporter(ClosedDriver(), '%d/%m/%Y')
+
+
+def test_http_export_fails_to_write(server, tmp_path):
+    exporter = HttpExporter(CookieDriver(netbank_session(server)), '%d/%m/%Y')
+    data = account(
+        href='{0}/netbank/Account/Account.aspx?account=2'.format(
+            server.base_url
+        ),
+        filename=str(tmp_path / 'missing' / 'OFXData.ofx')
+    )
+    to_date = datetime.datetime.now()
+    with pytest.raises(ExportError, match='Failed to write'):
+        exporter.export(data, to_date - datetime.timedelta(days=9), to_date)
+
+
+def test_http_export_fails_on_connection_error(tmp_path):
+    exporter = HttpExporter(
+        CookieDriver(requests.Session()), '%d/%m/%Y', timeout=1
+    )
+    data = account(
+        href='http://127.0.0.1:9/netbank/Account/Account.aspx',
+        filename=str(tmp_path / 'OFXData.ofx')
+    )
+    to_date = datetime.datetime.now()
+    with pytest.raises(ExportError, match='GET'):
+        exporter.export(data, to_date, to_date)
+
+
+def test_penny_client_uploads(server, tmp_path):
+    write_ofx(server, str(tmp_path))
+    client = PennyClient(
+        server.penny_url, 'fixture@example.com', 'fixture', max_workers=2
+    )
+    client.login()
+    for path in sorted(tmp_path.glob('*.ofx')):
+        client.upload(str(path))
+    client.logout()
+    client.close()
+    assert server.fixture.uploads == [366] * 4
+
+
+def test_penny_client_fails_on_rejected_upload(server, tmp_path):
+    path = tmp_path / 'statement.ofx'
+    path.write_text('Not OFX')
+    client = PennyClient(server.penny_url, 'fixture@example.com', 'fixture')
+    client.login()
+    with pytest.raises(PennyError, match='did not import'):
+        client.upload(str(path))
+    client.close()
+    assert server.fixture.uploads == []
+
+
+def test_penny_client_uploads_merged_accounts(server, tmp_path):
+    write_ofx(server, str(tmp_path))
+    merged = str(tmp_path / 'merged.ofx')
+    ofx.merge([str(p) for p in sorted(tmp_path.glob('*.ofx'))], merged)
+    client = PennyClient(server.penny_url, 'fixture@example.com', 'fixture')
+    client.login()
+    client.upload(merged)
+    client.close()
+    assert server.fixture.uploads == [366 * 4]
+
+
+def test_cli_upload(server, tmp_path, monkeypatch):
+    config = write_config(str(tmp_path), server, 'chromedriver')
+    write_ofx(server, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    assert not cli.main(['upload', '--penny-http', '--config', config])
+    assert sorted(server.fixture.uploads) == [366] * 4
+    assert not list(tmp_path.glob('*.ofx'))
+
+    # A second run finds nothing new to upload.
+    write_ofx(server, str(tmp_path))
+    assert not cli.main(['upload', '--penny-http', '--config', config])
+    assert len(server.fixture.uploads) == 4
+
+    store = state.StateStore(str(tmp_path / 'banalcow.db'))
+    assert sum(s.transactions for s in store.summary()) == 366 * 4
+    store.close()
+
+
+@pytest.mark.skipif(not browser_available(), reason='needs chromedriver')
+def test_cli_sync(server, tmp_path, monkeypatch):
+    config = write_config(str(tmp_path), server, shutil.which('chromedriver'))
+    monkeypatch.chdir(tmp_path)
+    assert not cli.main(['sync', '--lean', '--config', config])
+    assert len(server.fixture.uploads) == len(server.fixture.accounts)
+    assert all(server.fixture.uploads)
+
+
+def test_batch_upload_keeps_profiles_apart(server, tmp_path, monkeypatch):
+    other = FixtureServer(accounts=4).start()
+    try:
+        config = write_config(str(tmp_path), server, 'chromedriver')
+        with open(config) as f:
+            values = yaml.safe_load(f)
+        values['profiles'] = {
+            name: {
+                'netbank': values['netbank'],
+                'penny': dict(values['penny'], base_url=s.penny_url),
+                'output_dir': str(tmp_path / name),
+            }
+            for name, s in (('alice', server), ('bob', other))
+        }
+        with open(config, 'w') as f:
+            yaml.safe_dump(values, f)
+        # A joint account: both logins download the same statements.
+        today = datetime.datetime.now()
+        for name in ('alice', 'bob'):
+            (tmp_path / name).mkdir()
+            for a in server.fixture.accounts:
+                (tmp_path / name / banalutil.filename(
+                    server.fixture.digits(a), today, today
+                )).write_bytes(server.fixture.ofx(a))
+
+        monkeypatch.chdir(tmp_path)
+        assert not cli.main(
+            ['upload', '--batch', '--penny-http', '--archive',
+             '--profile-workers', '1', '--host-interval', '0',
+             '--config', config]
+        )
+        assert server.fixture.uploads == [366] * 4
+        assert other.fixture.uploads == [366] * 4
+    finally:
+        other.stop()
@@ -0,0 +1,146 @@
+import os
+
+from collections import namedtuple
+
+import pytest
+from selenium.common.exceptions import (
+    NoSuchElementException, TimeoutException
+)
+
+from banalcow import netbank
+from banalcow.download import DownloadManager
+from banalcow.metrics import metrics
+from banalcow.navigation import step
+
+
+account = namedtuple('account', 'href account_type')
+
+
+class Driver:
+    current_url = None
+
+    def execute_cdp_cmd(self, command, params):
+        pass
+
+    def get(self, url):
+        self.current_url = url
+
+
+class Wait:
+    def call(self, name, function, exceptions, **kwargs):
+        raise NoSuchElementException('no export link')
+
+
+class Element:
+    def click(self):
+        pass
+
+
+class SlowPage:
+    """A Waiter for a page on which only the steps in present show up."""
+
+    def __init__(self, present=()):
+        self.present = present
+        self.waits = []
+
+    def until(self, step, condition, optional=False):
+        self.waits.append((step, optional))
+        if step in self.present:
+            return Element()
+        if optional:
+            return None
+        raise TimeoutException(step)
+
+    def call(self, step, function, exceptions, attempts=None, deadline=None):
+        assert deadline
+        return function()
+
+
+class Planner:
+    TRANSACTIONS = 'transactions'
+
+    def __init__(self, learned):
+        self.learned = learned
+        self.forgotten = []
+
+    def route(self, accountnumber, href, home_loan=False):
+        if self.learned and not self.forgotten:
+            return [step('get', self.learned)]
+        return [step('get', href), step('click', None)]
+
+    def forget(self, accountnumber):
+        self.forgotten.append(accountnumber)
+
+    def learn(self, accountnumber, url):
+        pass
+
+    def visited(self, loads, home_loan=False):
+        pass
+
+
+def test_download_ofx_releases_directory_on_failure(tmp_path):
+    session = netbank.Netbank.__new__(netbank.Netbank)
+    session.downloads = DownloadManager(Driver(), str(tmp_path))
+    session.sleep = 30
+    session.wait = Wait()
+    with pytest.raises(netbank.NetbankError, match='export element'):
+        session.download_ofx(
+            str(tmp_path / 'OFXData.ofx'), netbank.AccountType.HOME_LOAN
+        )
+    assert os.listdir(str(tmp_path)) == []
+
+
+def home_loan(learned=None, present=()):
+    session = netbank.Netbank.__new__(netbank.Netbank)
+    session.driver = Driver()
+    session.sleep = 30
+    session.wait = SlowPage(present)
+    session.planner = Planner(learned)
+    data = account(
+        href='https://netbank/account',
+        account_type=netbank.AccountType.HOME_LOAN
+    )
+    return session, data
+
+
+def test_view_transactions_link_is_required():
+    session, data = home_loan()
+    with pytest.raises(netbank.NetbankError, match='view transactions'):
+        session.navigate('06200000000000', data)
+    # Not given up on after the learned timeout only.
+    assert session.wait.waits == [('view_transactions', False)]
+
+
+def test_learned_page_is_forgotten_after_full_timeout():
+    session, data = home_loan(
+        learned='https://netbank/transactions', present=('view_transactions',)
+    )
+    session.navigate('06200000000000', data)
+    assert session.planner.forgotten == ['06200000000000']
+    assert session.wait.waits == [
+        ('export', False), ('view_transactions', False)
+    ]
+    assert session.driver.current_url == data.href
+
+
+def test_learned_page_is_kept_when_export_shows():
+    session, data = home_loan(
+        learned='https://netbank/transactions', present=('export',)
+    )
+    session.navigate('06200000000000', data)
+    assert session.planner.forgotten == []
+    assert session.driver.current_url == 'https://netbank/transactions'
+
+
+def test_follow_records_a_span_per_step():
+    session, data = home_loan(present=('view_transactions',))
+    metrics.reset()
+    route = [step('get', data.href), step('click', None)]
+    assert session.follow('06200000000000', data, route) == 2
+    assert [
+        (span['step'], span['labels'], span['ok']) for span in metrics.spans
+    ] == [
+        ('access_account', {'account': '06200000000000'}, True),
+        ('view_transactions', {'account': '06200000000000'}, True),
+    ]
+    metrics.reset()
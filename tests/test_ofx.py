@@ -0,0 +1,148 @@
+import io
+import re
+
+import pytest
+
+from banalcow import ofx
+
+
+HEADER = (
+    'OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\n\n<OFX>\n'
+    '<SIGNONMSGSRSV1>\n<SONRS>\n<DTSERVER>{0}\n</SONRS>\n'
+    '</SIGNONMSGSRSV1>\n'
+)
+
+
+def statement(fitid, credit_card=False):
+    if credit_card:
+        return (
+            '<CREDITCARDMSGSRSV1>\n<CCSTMTTRNRS>\n<CCSTMTRS>\n'
+            '<BANKTRANLIST>\n<STMTTRN>\n<FITID>{0}\n</STMTTRN>\n'
+            '</BANKTRANLIST>\n</CCSTMTRS>\n</CCSTMTTRNRS>\n'
+            '</CREDITCARDMSGSRSV1>\n'
+        ).format(fitid)
+    return (
+        '<BANKMSGSRSV1>\n<STMTTRNRS>\n<STMTRS>\n'
+        '<BANKTRANLIST>\n<STMTTRN>\n<FITID>{0}\n</STMTTRN>\n'
+        '</BANKTRANLIST>\n</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n'
+    ).format(fitid)
+
+
+def write(path, *statements):
+    path.write_text(
+        HEADER.format(path.stem) + ''.join(statements) + '</OFX>\n'
+    )
+    return str(path)
+
+
+def test_merge_keeps_one_message_set_per_type(tmp_path):
+    filenames = [
+        write(tmp_path / 'a.ofx', statement('a')),
+        write(tmp_path / 'b.ofx', statement('b', credit_card=True)),
+        write(tmp_path / 'c.ofx', statement('c')),
+    ]
+    merged = str(tmp_path / 'merged.ofx')
+    ofx.merge(filenames, merged)
+    text = open(merged).read()
+
+    assert text.startswith(HEADER.format('a'))
+    assert text.count('<SIGNONMSGSRSV1>') == 1
+    assert text.count('<BANKMSGSRSV1>') == 1
+    assert text.count('<CREDITCARDMSGSRSV1>') == 1
+    assert text.count('<STMTTRNRS>') == 2
+    assert text.endswith('</CREDITCARDMSGSRSV1>\n</OFX>\n')
+    assert [t.fitid for t in ofx.transactions(merged)] == ['a', 'c', 'b']
+
+
+def test_merge_rejects_file_without_statements(tmp_path):
+    filenames = [
+        write(tmp_path / 'a.ofx', statement('a')),
+        write(tmp_path / 'b.ofx'),
+    ]
+    with pytest.raises(ValueError, match='no statements'):
+        ofx.merge(filenames, str(tmp_path / 'merged.ofx'))
+
+
+def bank_statement(*transactions):
+    return (
+        HEADER.format('bank') +
+        '<BANKMSGSRSV1>\n<STMTTRNRS>\n<STMTRS>\n<BANKTRANLIST>\n' +
+        ''.join(
+            '<STMTTRN>\n<DTPOSTED>{1}\n<TRNAMT>-1.00\n<FITID>{0}\n'
+            '</STMTTRN>\n'.format(fitid, posted)
+            for fitid, posted in transactions
+        ) +
+        '</BANKTRANLIST>\n<LEDGERBAL>\n<BALAMT>1.00\n</LEDGERBAL>\n'
+        '</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n</OFX>\n'
+    )
+
+
+def squeeze(text):
+    return re.sub('\n+', '\n', text)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 9, 64, 65536])
+def test_segments_across_chunk_boundaries(chunk_size):
+    text = bank_statement(('a', '20260101'), ('b', '20260102'))
+    segments = list(ofx.segments(io.StringIO(text), chunk_size))
+    found = [s for s in segments if isinstance(s, ofx.transaction)]
+    assert [(t.fitid, t.posted) for t in found] == \
+        [('a', '20260101'), ('b', '20260102')]
+    assert all(t.text.startswith(ofx.OPEN) for t in found)
+    assert ''.join(
+        s.text if isinstance(s, ofx.transaction) else s for s in segments
+    ) == text
+
+
+def test_segments_without_closing_tags():
+    text = (
+        '<BANKTRANLIST>\n<STMTTRN>\n<FITID>a\n<STMTTRN>\n<FITID>b\n'
+        '</BANKTRANLIST>\n'
+    )
+    found = [
+        s.fitid for s in ofx.segments(io.StringIO(text), 5)
+        if isinstance(s, ofx.transaction)
+    ]
+    assert found == ['a', 'b']
+
+
+def test_filter_new_drops_seen_fitids(tmp_path):
+    path = tmp_path / 'in.ofx'
+    path.write_text(bank_statement(
+        ('a', '20260101'), ('b', '20260102'), ('c', '20260103'),
+        ('b', '20260102')
+    ))
+    out = tmp_path / 'out.ofx'
+    calls = []
+
+    def seen(fitids):
+        calls.append(fitids)
+        return {'a'} & set(fitids)
+
+    new = ofx.filter_new(str(path), str(out), seen, batch=2)
+    assert [t.fitid for t in new] == ['b', 'c']
+    assert calls == [['a', 'b'], ['c', 'b']]
+    # Header and footer kept; dropped transactions leave a blank line.
+    assert squeeze(out.read_text()) == squeeze(bank_statement(
+        ('b', '20260102'), ('c', '20260103')
+    ))
+
+
+def test_filter_new_all_seen(tmp_path):
+    path = tmp_path / 'in.ofx'
+    path.write_text(bank_statement(('a', '20260101'), ('b', '20260102')))
+    out = tmp_path / 'out.ofx'
+    new = ofx.filter_new(str(path), str(out), lambda fitids: set(fitids))
+    assert new == []
+    assert squeeze(out.read_text()) == squeeze(bank_statement())
+
+
+def test_latest_fitid(tmp_path):
+    path = tmp_path / 'in.ofx'
+    path.write_text(bank_statement(
+        ('b', '20260102'), ('c', '20260103'), ('a', '20260101'),
+        ('d', '20260103')
+    ))
+    assert ofx.latest_fitid(str(path)) == 'd'
+    path.write_text(bank_statement())
+    assert ofx.latest_fitid(str(path)) is None
@@ -0,0 +1,131 @@
+import datetime
+import os
+import threading
+from collections import namedtuple
+
+import pytest
+
+from banalcow import banalutil, state
+from banalcow.pipeline import UploadPipeline
+from fixture_server import Fixture
+
+
+download = namedtuple('download', 'filename')
+
+
+class FakeSession:
+    max_workers = 2
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.uploaded = []
+
+    def upload(self, filename):
+        if any(name in filename for name in self.fail):
+            # Anything, not just a Penny or WebDriver error.
+            raise ValueError('bad upload')
+        self.uploaded.append(filename)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = state.StateStore(str(tmp_path / 'state.db'))
+    yield store
+    store.close()
+
+
+def downloads(tmp_path, count):
+    fixture = Fixture(accounts=count)
+    files = []
+    for a in fixture.accounts:
+        path = tmp_path / '{0}.ofx'.format(fixture.digits(a))
+        path.write_bytes(fixture.ofx(a))
+        files.append((fixture.digits(a), str(path)))
+    return files
+
+
+def run(pipeline, files):
+    """Put files and close the pipeline, failing instead of hanging."""
+    result = {}
+
+    def target():
+        pipeline.start()
+        for account, filename in files:
+            pipeline.put(account, download(filename))
+        result['failures'] = pipeline.close()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive(), 'pipeline hung'
+    return result['failures']
+
+
+def test_failing_upload_does_not_stop_the_others(tmp_path, store):
+    files = downloads(tmp_path, 6)
+    session = FakeSession(fail=(files[1][0], files[4][0]))
+    tmpdir = tmp_path / 'tmp'
+    tmpdir.mkdir()
+    pipeline = UploadPipeline(
+        lambda: session, store, str(tmpdir), maxsize=1
+    )
+    failures = run(pipeline, files)
+    assert sorted(failures) == sorted([files[1][0], files[4][0]])
+    assert len(session.uploaded) == 4
+
+
+def test_uploaded_is_called_once_penny_has_the_file(tmp_path, store):
+    files = downloads(tmp_path, 3)
+    session = FakeSession(fail=(files[1][0],))
+    tmpdir = tmp_path / 'tmp'
+    tmpdir.mkdir()
+    pipeline = UploadPipeline(lambda: session, store, str(tmpdir)).start()
+    uploaded = []
+    for account, filename in files:
+        pipeline.put(
+            account, download(filename),
+            uploaded=lambda account=account: uploaded.append(account)
+        )
+    pipeline.close()
+    assert sorted(uploaded) == sorted([files[0][0], files[2][0]])
+
+
+def test_failing_connect_does_not_hang(tmp_path, store):
+    def connect():
+        raise RuntimeError('no penny')
+
+    tmpdir = tmp_path / 'tmp'
+    tmpdir.mkdir()
+    pipeline = UploadPipeline(connect, store, str(tmpdir), maxsize=1)
+    files = downloads(tmp_path, 3)
+    failures = run(pipeline, files)
+    assert sorted(failures) == sorted(account for account, _ in files)
+
+
+def test_failed_upload_is_retried_by_the_next_run(tmp_path, store):
+    out = tmp_path / 'out'
+    out.mkdir()
+    fixture = Fixture(accounts=3)
+    today = datetime.datetime.now()
+    files = []
+    for a in fixture.accounts:
+        path = out / banalutil.filename(fixture.digits(a), today, today)
+        path.write_bytes(fixture.ofx(a))
+        files.append((fixture.digits(a), str(path)))
+    tmpdir = tmp_path / 'tmp'
+    tmpdir.mkdir()
+
+    session = FakeSession(fail=(files[1][0],))
+    pipeline = UploadPipeline(lambda: session, store, str(tmpdir))
+    assert list(run(pipeline, files)) == [files[1][0]]
+    assert [str(p) for p in out.iterdir()] == [files[1][1]]
+
+    # The next run downloads nothing new, but uploads what was left.
+    session = FakeSession()
+    pipeline = UploadPipeline(
+        lambda: session, store, str(tmpdir), directory=str(out)
+    )
+    assert run(pipeline, []) == {}
+    assert [os.path.basename(f) for f in session.uploaded] == \
+        [os.path.basename(files[1][1])]
+    assert list(out.iterdir()) == []
@@ -0,0 +1,44 @@
+from banalcow.pool import NetbankPool
+
+
+class FakeSession:
+    def __init__(self, fail=None):
+        self.fail = fail or {}
+        self.downloaded = []
+        self.spawned = []
+        self.closed = False
+
+    def spawn(self):
+        session = FakeSession(self.fail)
+        self.spawned.append(session)
+        return session
+
+    def download_account(self, account, data):
+        if account in self.fail:
+            raise self.fail[account]
+        self.downloaded.append(account)
+
+    def close(self):
+        self.closed = True
+
+
+def test_failures_are_per_account():
+    session = FakeSession({
+        'a2': OSError('move failed'), 'a5': ValueError('bad amount')
+    })
+    accounts = {'a{0}'.format(i): None for i in range(8)}
+    done = []
+
+    def callback(account, data):
+        if account == 'a6':
+            raise RuntimeError('callback failed')
+        done.append(account)
+
+    failures = NetbankPool(session, workers=3).run(accounts, done=callback)
+    assert sorted(failures) == ['a2', 'a5', 'a6']
+    assert sorted(done) == ['a0', 'a1', 'a3', 'a4', 'a7']
+
+    # Spawned sessions are closed, the logged in one is left open.
+    assert len(session.spawned) == 2
+    assert all(s.closed for s in session.spawned)
+    assert not session.closed
@@ -0,0 +1,185 @@
+import datetime
+import os
+import signal
+import time
+from argparse import Namespace
+from collections import namedtuple
+
+import pytest
+
+from banalcow import scheduler, state, sync
+from banalcow.metrics import metrics
+from banalcow.netbank import AccountType
+
+
+account = namedtuple('account', 'account_type from_date filename')
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(scheduler.time, 'sleep', clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = state.StateStore(str(tmp_path / 'banalcow.db'))
+    yield store
+    store.close()
+
+
+def test_budget_free_in(clock):
+    budget = scheduler.RequestBudget(3, window=100)
+    assert budget.free_in(3) == 0
+    for _ in range(3):
+        budget.wait('https://netbank')
+        clock.now += 10
+    # Requests at 1000, 1010 and 1020; now 1030.
+    assert budget.remaining() == 0
+    assert budget.free_in(1) == 70
+    assert budget.free_in(2) == 80
+    assert budget.free_in(4) == float('inf')
+    clock.now = 1100
+    assert budget.free_in(1) == 0
+    assert budget.remaining() == 1
+
+
+def test_budget_wait_sleeps_until_a_slot_frees(clock):
+    budget = scheduler.RequestBudget(2, window=100)
+    budget.wait('https://netbank')
+    clock.now += 30
+    budget.wait('https://netbank')
+    budget.wait('https://netbank')
+    assert clock.sleeps == [70]
+    assert clock.now == 1100
+
+
+def schedule(store, accountnumber, rate, due_in):
+    now = time.time()
+    store.save_schedule(
+        accountnumber, 'COMPLETE_ACCESS', rate, now - 86400, now + due_in
+    )
+
+
+def accounts(*names):
+    return {
+        name: account(AccountType.COMPLETE_ACCESS, None, None)
+        for name in names
+    }
+
+
+def test_select_orders_by_overdue(store):
+    schedule(store, 'a', 2.0, -3600)
+    schedule(store, 'b', 0.1, -86400)
+    schedule(store, 'c', 2.0, 3600)
+    s = scheduler.Scheduler(store, scheduler.RequestBudget(10))
+    # Never downloaded first, then by the fraction of its interval
+    # overdue: a day of a week for b, an hour of a day for a.
+    assert list(s.select(accounts('a', 'b', 'c', 'd'))) == ['d', 'b', 'a']
+    # Held back until downloaded.
+    assert store.scheduled('a').due_at > time.time() + 3000
+
+
+def test_select_defers_beyond_budget(store):
+    schedule(store, 'a', 2.0, -3600)
+    schedule(store, 'b', 0.1, -86400)
+    budget = scheduler.RequestBudget(2)
+    budget.wait('https://netbank')
+    s = scheduler.Scheduler(store, budget)
+    metrics.reset()
+    due = accounts('a', 'b')
+    # New accounts go busiest type first.
+    due['d'] = account(AccountType.CREDIT_CARD, None, None)
+    due['e'] = account(AccountType.MISA, None, None)
+    assert list(s.select(due)) == ['d']
+    assert metrics.report()['counters'] == [
+        {'name': 'accounts_deferred', 'labels': {}, 'value': 3}
+    ]
+    # A deferred new account is remembered as due, the others stay due.
+    assert store.scheduled('e').due_at <= time.time()
+    assert store.scheduled('a').due_at < time.time()
+
+
+def write_transactions(path, count):
+    today = datetime.date.today().strftime('%Y%m%d')
+    path.write_text('<OFX>\n<BANKTRANLIST>\n' + ''.join(
+        '<STMTTRN>\n<DTPOSTED>{0}\n<TRNAMT>-1.00\n<FITID>{1}\n</STMTTRN>\n'
+        .format(today, i) for i in range(count)
+    ) + '</BANKTRANLIST>\n</OFX>\n')
+    return str(path)
+
+
+def test_downloaded_blends_first_download_with_prior(store, tmp_path):
+    s = scheduler.Scheduler(store, scheduler.RequestBudget(10))
+    data = account(
+        AccountType.MISA,
+        datetime.datetime.now() - datetime.timedelta(days=6),
+        write_transactions(tmp_path / 'a.ofx', 3)
+    )
+    s.downloaded('a', data)
+    rate = (scheduler.PRIORS['MISA'] * scheduler.PRIOR_DAYS + 3) / \
+        (scheduler.PRIOR_DAYS + 6)
+    saved = store.scheduled('a')
+    assert saved.rate == pytest.approx(rate)
+    assert saved.due_at - saved.downloaded_at == \
+        pytest.approx(s.interval(rate))
+
+
+def test_downloaded_updates_moving_average(store, tmp_path):
+    s = scheduler.Scheduler(store, scheduler.RequestBudget(10), half_life=30)
+    store.save_schedule(
+        'a', 'MISA', 1.0, time.time() - 2 * 86400, time.time()
+    )
+    data = account(
+        AccountType.MISA, None, write_transactions(tmp_path / 'a.ofx', 4)
+    )
+    s.downloaded('a', data)
+    weight = 1 - 0.5 ** (2 / 30)
+    assert store.scheduled('a').rate == \
+        pytest.approx(1.0 * (1 - weight) + 4 / 2 * weight, rel=1e-3)
+
+
+def test_run_schedule_survives_errors_and_stops_on_sigterm(
+        store, tmp_path, monkeypatch):
+    args = Namespace(
+        requests_per_hour=30, per_refresh=2, min_interval=1, max_interval=7,
+        netbank=True, penny_http=False, report=str(tmp_path / 'report.json'),
+        prometheus=None
+    )
+    conf = Namespace(
+        latency_path=str(tmp_path / 'latencies.json'),
+        locator_path=str(tmp_path / 'locators.json')
+    )
+    runs = []
+
+    def fake_sync(*args, **kwargs):
+        runs.append(len(metrics.spans))
+        with metrics.span('sync'):
+            if len(runs) == 1:
+                raise OSError('disk full')
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    monkeypatch.setattr(sync, 'sync', fake_sync)
+    monkeypatch.setattr(sync.time, 'sleep', lambda seconds: None)
+    metrics.reset()
+    sync.run_schedule(args, conf, store, None, None, None)
+    # The second sync ran after the first failed, each with fresh metrics.
+    assert runs == [0, 0]
+    assert os.path.exists(conf.latency_path)
+    assert os.path.exists(args.report)
+    assert signal.getsignal(signal.SIGTERM) is signal.SIG_DFL
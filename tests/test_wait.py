@@ -0,0 +1,95 @@
+import time
+
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+from banalcow import wait
+from banalcow.metrics import metrics
+
+
+class Driver:
+    pass
+
+
+def waiter(timeout=1, **kwargs):
+    kwargs.setdefault('latencies', wait.Latencies())
+    return wait.Waiter(Driver(), timeout, 3, poll=0.01, **kwargs)
+
+
+def after(seconds):
+    """A condition that comes true seconds from now."""
+    ready = time.monotonic() + seconds
+    return lambda driver: time.monotonic() >= ready
+
+
+def test_learned_timeout():
+    w = waiter(timeout=30, min_timeout=2, factor=3)
+    assert w.learned_timeout('step') == 30
+    w.record('step', 0.1)
+    assert w.learned_timeout('step') == 2
+    w.record('step', 4)
+    assert w.learned_timeout('step') == 12
+    w.record('step', 20)
+    assert w.learned_timeout('step') == 30
+
+
+def test_slow_step_waits_on_to_the_full_timeout():
+    w = waiter(timeout=1, min_timeout=0.05, factor=1)
+    w.record('step', 0.05)
+    assert w.until('step', after(0.3))
+    assert 0.3 <= max(w.latencies.recent('step')) < 1
+
+
+def test_full_timeout_raises():
+    w = waiter(timeout=0.2, min_timeout=0.05)
+    with pytest.raises(TimeoutException):
+        w.until('step', lambda driver: False)
+
+
+def test_optional_timeout_grows_learned_timeout():
+    w = waiter(timeout=10, min_timeout=0.05, factor=2)
+    w.record('step', 0.05)
+    assert w.until('step', lambda driver: False, optional=True) is None
+    # The timed out wait is a sample, so the next wait is longer.
+    assert w.learned_timeout('step') >= 0.2
+    assert w.until('step', after(0.15), optional=True)
+
+
+def test_call_retries_with_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(wait.time, 'sleep', sleeps.append)
+    w = waiter(base_delay=1, max_delay=3)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ValueError('flaky')
+        return 'done'
+
+    metrics.reset()
+    assert w.call('flaky', flaky, ValueError) == 'done'
+    assert len(calls) == 3
+    assert 0.5 <= sleeps[0] <= 1.5 and 1 <= sleeps[1] <= 3
+    assert metrics.report()['counters'] == [
+        {'name': 'retries', 'labels': {'step': 'flaky'}, 'value': 2}
+    ]
+
+
+def test_call_gives_up(monkeypatch):
+    monkeypatch.setattr(wait.time, 'sleep', lambda seconds: None)
+    w = waiter(base_delay=1)
+
+    def broken():
+        raise ValueError('broken')
+
+    with pytest.raises(ValueError):
+        w.call('broken', broken, ValueError, attempts=2)
+    # A deadline shorter than the first backoff stops at one attempt.
+    calls = []
+    with pytest.raises(ValueError):
+        w.call(
+            'broken', lambda: calls.append(1) or broken(), ValueError,
+            deadline=0.1
+        )
+    assert calls == [1]